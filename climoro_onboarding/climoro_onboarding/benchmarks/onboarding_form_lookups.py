@@ -0,0 +1,133 @@
+"""
+Benchmark of the Onboarding Form lookup paths against the composite indexes
+in `onboarding_form.ONBOARDING_FORM_INDEXES`.
+
+Seeds synthetic applications (100k by default), then for every lookup prints
+the index MariaDB picks (EXPLAIN) and the median/p95 latency, with the
+composite indexes and again with them ignored. The seeded rows are deleted
+afterwards. Run it on a scratch site:
+
+    bench --site <site> execute climoro_onboarding.climoro_onboarding.benchmarks.onboarding_form_lookups.run
+    bench --site <site> execute climoro_onboarding.climoro_onboarding.benchmarks.onboarding_form_lookups.run --kwargs "{'rows': 200000}"
+"""
+
+import random
+import statistics
+import time
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form import (
+    ONBOARDING_FORM_INDEXES,
+)
+
+NAME_PREFIX = "OFBENCH-"
+INSERT_CHUNK = 5000
+STATUSES = ("Draft", "Draft", "Draft", "In Progress", "Submitted", "Approved", "Rejected")
+
+# Lookup -> (query as the callers issue it, parameters drawn from the seed)
+LOOKUPS = {
+    # submit_onboarding_form, send_resume_email
+    "email + status, modified desc": (
+        "select name, current_step from `tabOnboarding Form` {hint}"
+        " where email = %(email)s and status = 'Draft' order by modified desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    # get_existing_application, save_verified_email_to_doctype
+    "email, modified desc": (
+        "select name, status, current_step, modified from `tabOnboarding Form` {hint}"
+        " where email = %(email)s order by modified desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    # save_step_data, get_saved_data
+    "email, creation desc": (
+        "select name, status, current_step, draft_version from `tabOnboarding Form` {hint}"
+        " where email = %(email)s order by creation desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    # ghg_workspace_access._get_latest_approved_form
+    "company_name + status, modified desc": (
+        "select name, modified from `tabOnboarding Form` {hint}"
+        " where company_name = %(company_name)s and status = 'Approved' order by modified desc limit 1",
+        lambda seed: {"company_name": seed.company()},
+    ),
+    # ghg_report._fetch_boundaries
+    "company_name + docstatus, modified desc": (
+        "select name from `tabOnboarding Form` {hint}"
+        " where company_name = %(company_name)s and docstatus = 1 order by modified desc limit 1",
+        lambda seed: {"company_name": seed.company()},
+    ),
+}
+
+
+class _Seed:
+    def __init__(self, rows):
+        self.random = random.Random(rows)
+        self.emails = max(rows * 7 // 10, 1)
+        self.companies = max(rows // 5, 1)
+
+    def email(self):
+        return f"applicant{self.random.randrange(self.emails)}@bench.example.com"
+
+    def company(self):
+        return f"Bench Company {self.random.randrange(self.companies)}"
+
+
+def run(rows=100000, samples=500):
+    """Seed `rows` applications, benchmark every lookup and clean up"""
+    seed = _Seed(rows)
+    try:
+        _seed_applications(seed, rows)
+        frappe.db.sql("analyze table `tabOnboarding Form`")
+        print(f"Onboarding Form lookups over {rows} seeded applications, {samples} samples each\n")
+        print(f"{'lookup':<42}{'index':<40}{'median ms':>10}{'p95 ms':>10}")
+        ignore = f"ignore index ({', '.join(f'`{name}`' for name in ONBOARDING_FORM_INDEXES)})"
+        for label, (query, params) in LOOKUPS.items():
+            for hint in ("", ignore):
+                index = _explain_index(query.format(hint=hint), params(seed))
+                median, p95 = _time_lookup(query.format(hint=hint), params, seed, samples)
+                title = label if not hint else "  without composite indexes"
+                print(f"{title:<42}{index:<40}{median:>10.3f}{p95:>10.3f}")
+    finally:
+        frappe.db.delete("Onboarding Form", {"name": ["like", f"{NAME_PREFIX}%"]})
+        frappe.db.commit()
+
+
+def _seed_applications(seed, rows):
+    fields = [
+        "name", "owner", "creation", "modified", "modified_by", "docstatus",
+        "email", "first_name", "phone_number", "company_name", "status", "current_step",
+    ]
+    start = add_to_date(now_datetime(), days=-365)
+    values = []
+    for i in range(rows):
+        created = add_to_date(start, seconds=i * 300)
+        values.append((
+            f"{NAME_PREFIX}{i:07d}", "Guest", created,
+            add_to_date(created, seconds=seed.random.randrange(86400)), "Guest", 0,
+            seed.email(), "Bench", "9000000000", seed.company(),
+            seed.random.choice(STATUSES), seed.random.randint(1, 6),
+        ))
+        if len(values) == INSERT_CHUNK:
+            frappe.db.bulk_insert("Onboarding Form", fields=fields, values=values)
+            values = []
+    if values:
+        frappe.db.bulk_insert("Onboarding Form", fields=fields, values=values)
+    frappe.db.commit()
+
+
+def _explain_index(query, values):
+    plan = frappe.db.sql(f"explain {query}", values, as_dict=True)
+    return plan[0].get("key") or "(full scan)"
+
+
+def _time_lookup(query, params, seed, samples):
+    timings = []
+    for _ in range(samples):
+        values = params(seed)
+        started = time.perf_counter()
+        frappe.db.sql(query, values)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
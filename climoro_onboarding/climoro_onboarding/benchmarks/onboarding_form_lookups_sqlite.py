@@ -0,0 +1,121 @@
+"""
+Stand-alone counterpart of `onboarding_form_lookups` for machines without a
+site: the same seed, lookups and composite indexes against an in-memory
+SQLite table, with and without the composite indexes. It needs no frappe and
+no database server, so its plans are SQLite's, not MariaDB's; use it to check
+that every lookup is served by an index seek, and the site benchmark for
+MariaDB latencies. Results are in `onboarding_form_lookups_results.md`.
+
+    python climoro_onboarding/climoro_onboarding/benchmarks/onboarding_form_lookups_sqlite.py
+"""
+
+import random
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+
+ROWS = 100000
+SAMPLES = 500
+STATUSES = ("Draft", "Draft", "Draft", "In Progress", "Submitted", "Approved", "Rejected")
+
+# Copy of onboarding_form.ONBOARDING_FORM_INDEXES; importing it needs frappe
+ONBOARDING_FORM_INDEXES = {
+    "email_status_modified_index": ["email", "status", "modified"],
+    "email_creation_index": ["email", "creation"],
+    "company_name_status_modified_index": ["company_name", "status", "modified"],
+    "company_name_docstatus_modified_index": ["company_name", "docstatus", "modified"],
+}
+
+# Same lookups as onboarding_form_lookups.LOOKUPS, with SQLite placeholders
+LOOKUPS = {
+    "email + status, modified desc": (
+        "select name, current_step from form where email = :email and status = 'Draft' order by modified desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    "email, modified desc": (
+        "select name, status, current_step, modified from form where email = :email order by modified desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    "email, creation desc": (
+        "select name, status, current_step, draft_version from form where email = :email order by creation desc limit 1",
+        lambda seed: {"email": seed.email()},
+    ),
+    "company_name + status, modified desc": (
+        "select name, modified from form where company_name = :company_name and status = 'Approved'"
+        " order by modified desc limit 1",
+        lambda seed: {"company_name": seed.company()},
+    ),
+    "company_name + docstatus, modified desc": (
+        "select name from form where company_name = :company_name and docstatus = 1 order by modified desc limit 1",
+        lambda seed: {"company_name": seed.company()},
+    ),
+}
+
+
+class _Seed:
+    def __init__(self, rows):
+        self.random = random.Random(rows)
+        self.emails = max(rows * 7 // 10, 1)
+        self.companies = max(rows // 5, 1)
+
+    def email(self):
+        return f"applicant{self.random.randrange(self.emails)}@bench.example.com"
+
+    def company(self):
+        return f"Bench Company {self.random.randrange(self.companies)}"
+
+
+def run(rows=ROWS, samples=SAMPLES):
+    print(f"SQLite {sqlite3.sqlite_version}, {rows} seeded applications, {samples} samples each")
+    for composite in (False, True):
+        db = _seed_applications(rows, composite)
+        print("\nwith composite indexes" if composite else "\nwithout composite indexes (standard modified/creation indexes only)")
+        print(f"{'lookup':<42}{'median ms':>10}{'p95 ms':>10}  plan")
+        for label, (query, params) in LOOKUPS.items():
+            seed = _Seed(rows + 1)
+            plan = "; ".join(row[3] for row in db.execute(f"explain query plan {query}", params(seed)))
+            median, p95 = _time_lookup(db, query, params, seed, samples)
+            print(f"{label:<42}{median:>10.3f}{p95:>10.3f}  {plan}")
+
+
+def _seed_applications(rows, composite):
+    db = sqlite3.connect(":memory:")
+    db.execute(
+        "create table form (name text primary key, creation text, modified text, docstatus int,"
+        " email text, company_name text, status text, current_step int, draft_version int)"
+    )
+    # Indexes frappe adds to every table
+    db.execute("create index modified_index on form (modified)")
+    db.execute("create index creation_index on form (creation)")
+    seed = _Seed(rows)
+    start = datetime.now() - timedelta(days=365)
+    values = []
+    for i in range(rows):
+        created = start + timedelta(seconds=i * 300)
+        values.append((
+            f"OFBENCH-{i:07d}", created.isoformat(),
+            (created + timedelta(seconds=seed.random.randrange(86400))).isoformat(), 0,
+            seed.email(), seed.company(), seed.random.choice(STATUSES), seed.random.randint(1, 6), 0,
+        ))
+    db.executemany("insert into form values (?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+    if composite:
+        for index_name, fields in ONBOARDING_FORM_INDEXES.items():
+            db.execute(f"create index {index_name} on form ({', '.join(fields)})")
+    db.execute("analyze")
+    return db
+
+
+def _time_lookup(db, query, params, seed, samples):
+    timings = []
+    for _ in range(samples):
+        values = params(seed)
+        started = time.perf_counter()
+        db.execute(query, values).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+if __name__ == "__main__":
+    run()
@@ -1,9 +1,61 @@
 # Copyright (c) 2025, climoro and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
+from frappe.utils import flt
+
+# Conversion of the selectable consumption units to kWh
+KWH_PER_UNIT = {
+	"kWh": 1.0,
+	"MWh": 1000.0,
+	"GWh": 1000000.0,
+}
 
 
 class ElectricityPurchased(Document):
-	pass
+	def validate(self):
+		self.calculate_dual_emissions()
+
+	def calculate_dual_emissions(self):
+		"""Compute location- and market-based tCO2e for Scope 2 dual reporting.
+
+		Location-based uses the average grid factor of the selected region; without a
+		region it falls back to Activity Data x EF (the row's own ETCO2eq, already in
+		tCO2e, so it matches the Scope 2 inventory line). Market-based
+		prices the consumption covered by a contractual instrument at the instrument's
+		factor and the remainder at the region's residual mix (or grid average).
+		"""
+		consumption_kwh = flt(self.activity_data) * KWH_PER_UNIT.get(self.unit_selection, 1.0)
+
+		grid = None
+		if self.grid_emission_factor:
+			grid = frappe.db.get_value(
+				"Grid Emission Factor",
+				self.grid_emission_factor,
+				["location_based_ef", "residual_mix_ef"],
+				as_dict=True,
+			)
+		if grid:
+			self.location_based_ef = flt(grid.location_based_ef)
+			self.residual_mix_ef = flt(grid.residual_mix_ef)
+			location_based = consumption_kwh * self.location_based_ef / 1000.0
+			residual_ef = self.residual_mix_ef or self.location_based_ef
+			uncovered_rate = residual_ef / 1000.0
+		else:
+			location_based = flt(self.etco2eq) or flt(self.activity_data) * flt(self.ef)
+			uncovered_rate = (location_based / consumption_kwh) if consumption_kwh else 0.0
+
+		covered_kwh = 0.0
+		if self.contractual_instrument and consumption_kwh:
+			covered_kwh = flt(self.instrument_quantity) * KWH_PER_UNIT.get(self.unit_selection, 1.0)
+			covered_kwh = min(max(covered_kwh, 0.0), consumption_kwh)
+
+		market_based = (covered_kwh * flt(self.instrument_ef) / 1000.0) + (
+			(consumption_kwh - covered_kwh) * uncovered_rate
+		)
+		if not consumption_kwh:
+			market_based = location_based
+
+		self.location_based_etco2eq = flt(location_based, 6)
+		self.market_based_etco2eq = flt(market_based, 6)
@@ -933,7 +933,10 @@ def _append_inventory_lines(doc, company: str, year: int, start_date=None, end_d
 	# Future: Scope 3 mappings → append under Category 3..6 as Aggregate
 
 def _sum_scope2_dual(company: str, start, end):
-	"""Sum Scope 2 dual metrics from Electricity Purchased if fields are available.
+	"""Sum Scope 2 location- and market-based tCO2e from Electricity Purchased.
+
+	Both figures are stored per row at save time, so they are aggregated together
+	in a single query.
 
 	Returns: { "lb": float, "mb": float }
 	"""
@@ -941,54 +944,22 @@ def _sum_scope2_dual(company: str, start, end):
 		return {"lb": 0.0, "mb": 0.0}
 
 	meta = frappe.get_meta("Electricity Purchased")
-	# Candidate fieldnames for location- and market-based totals
-	cand_lb = [
-		"location_based_etco2eq",
-		"etco2eq_location",
-		"lb_etco2eq",
-		"location_based_total",
-	]
-	cand_mb = [
-		"market_based_etco2eq",
-		"etco2eq_market",
-		"mb_etco2eq",
-		"market_based_total",
-	]
-
-	field_lb = next((f for f in cand_lb if meta.has_field(f)), None)
-	field_mb = next((f for f in cand_mb if meta.has_field(f)), None)
-	fallback_total = meta.has_field("etco2eq")
-
 	filters = {"date": ["between", [start, end]]}
 	if meta.has_field("company") and company:
 		filters["company"] = company
 	if not _is_admin() and not meta.has_field("company"):
 		filters["owner"] = frappe.session.user
 
-	selected = ["name", "date"]
-	if field_lb:
-		selected.append(field_lb)
-	if field_mb:
-		selected.append(field_mb)
-	if fallback_total:
-		selected.append("etco2eq")
-
-	rows = frappe.get_all("Electricity Purchased", filters=filters, fields=selected, order_by="date asc")
-
-	lb_sum = 0.0
-	mb_sum = 0.0
-	for r in rows:
-		if field_lb and field_lb in r:
-			lb_sum += float(r.get(field_lb) or 0)
-		if field_mb and field_mb in r:
-			mb_sum += float(r.get(field_mb) or 0)
-		# If specific fields not present, fall back to total for both (best-effort)
-		if not field_lb and fallback_total and "etco2eq" in r:
-			lb_sum += float(r.get("etco2eq") or 0)
-		if not field_mb and fallback_total and "etco2eq" in r:
-			mb_sum += float(r.get("etco2eq") or 0)
-
-	return {"lb": lb_sum, "mb": mb_sum}
+	totals = frappe.get_all(
+		"Electricity Purchased",
+		filters=filters,
+		fields=[
+			"sum(location_based_etco2eq) as lb",
+			"sum(market_based_etco2eq) as mb",
+		],
+	)
+	row = totals[0] if totals else {}
+	return {"lb": float(row.get("lb") or 0), "mb": float(row.get("mb") or 0)}
 
 
 def _append_scope2_dual_lines(doc, company: str, year: int, start_date=None, end_date=None) -> None:
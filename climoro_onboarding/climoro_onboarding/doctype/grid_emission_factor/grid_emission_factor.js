@@ -0,0 +1,8 @@
+// Copyright (c) 2025, climoro and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Grid Emission Factor", {
+// 	refresh(frm) {
+
+// 	},
+// });
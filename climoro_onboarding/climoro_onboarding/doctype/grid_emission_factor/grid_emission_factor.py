@@ -0,0 +1,11 @@
+# Copyright (c) 2025, climoro and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class GridEmissionFactor(Document):
+	def validate(self):
+		if (self.location_based_ef or 0) < 0 or (self.residual_mix_ef or 0) < 0:
+			frappe.throw("Emission factors cannot be negative")
@@ -79,8 +79,20 @@ frappe.ui.form.on('Onboarding Form', {
 		console.log('Admin role check:', hasAdminRole);
 		console.log('Both conditions met:', frm.doc.status === 'Submitted' && hasAdminRole);
 		
+		// Background approval: progress, and a retry from the last completed stage
+		if (['Queued', 'Running'].includes(frm.doc.approval_status)) {
+			frm.dashboard.set_headline(__('Approval in progress (last completed stage: {0})', [frm.doc.approval_stage || __('none')]));
+			followApprovalProgress(frm);
+		} else if (frm.doc.approval_status === 'Failed' && hasAdminRole) {
+			frm.dashboard.set_headline(__('Approval failed: {0}', [frm.doc.approval_error || '']), 'red');
+			frm.add_custom_button(__('Retry Approval'), function() {
+				queueApproval(frm);
+			}, __('Actions'));
+		}
+
 		if (
 			frm.doc.status === 'Submitted' &&
+			!['Queued', 'Running', 'Failed'].includes(frm.doc.approval_status) &&
 			hasAdminRole
 		) {
 			console.log('=== DEBUG: Adding Approve/Reject buttons ===');
@@ -88,53 +100,7 @@ frappe.ui.form.on('Onboarding Form', {
 			// Add Approve button
 			frm.add_custom_button(__('Approve'), function() {
 				console.log('=== DEBUG: Approve button clicked ===');
-				
-				// Show loading popup using helper function
-				const processingPopup = showProcessingPopup(
-					'Processing Onboarding Approval',
-					'Creating company and user accounts...',
-					'#007bff'
-				);
-				
-				frappe.call({
-					method: 'climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.approve_application',
-					args: { docname: frm.doc.name },
-					callback: function(r) {
-						console.log('=== DEBUG: Approve callback response ===', r);
-						console.log('=== DEBUG: Response message ===', r.message);
-						console.log('=== DEBUG: Response success ===', r.message && r.message.success);
-						console.log('=== DEBUG: Response exc ===', r.exc);
-						
-						// Hide loading popup and spinner
-						processingPopup.hide();
-						
-						if (!r.exc && r.message && r.message.success) {
-							frappe.show_alert({ 
-								message: __('🎉 Application Approved Successfully! Company and users have been created.'), 
-								indicator: 'green' 
-							});
-							// Force reload the document to show updated status
-							frm.reload_doc();
-						} else {
-							console.error('=== DEBUG: Approve failed ===', r.exc || (r.message && r.message.message));
-							frappe.show_alert({ 
-								message: __('❌ Approval failed: ' + (r.exc || (r.message && r.message.message))), 
-								indicator: 'red' 
-							});
-						}
-					},
-					error: function(xhr, status, error) {
-						console.error('=== DEBUG: Approve error ===', {xhr, status, error});
-						
-						// Hide loading popup and spinner
-						processingPopup.hide();
-						
-						frappe.show_alert({ 
-							message: __('❌ Approval failed: ' + error), 
-							indicator: 'red' 
-						});
-					}
-				});
+				queueApproval(frm);
 			}, __('Actions'));
 
 			// Add Reject button
@@ -1048,6 +1014,57 @@ function getUserRoleBadgeClass(userRole) {
 	}
 }
 
+// Queue the approval pipeline and follow its progress over realtime
+function queueApproval(frm) {
+	frappe.call({
+		method: 'climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.approve_application',
+		args: { docname: frm.doc.name },
+		callback: function(r) {
+			if (!r.exc && r.message && r.message.success) {
+				frappe.show_alert({
+					message: __('Approval queued. Company, users and access are being set up in the background.'),
+					indicator: 'blue'
+				});
+				followApprovalProgress(frm);
+				frm.reload_doc();
+			} else {
+				frappe.show_alert({
+					message: __('❌ Approval failed: ' + (r.exc || (r.message && r.message.message))),
+					indicator: 'red'
+				});
+			}
+		}
+	});
+}
+
+function followApprovalProgress(frm) {
+	if (frm._approval_progress_bound) return;
+	frm._approval_progress_bound = true;
+	const title = __('Approving {0}', [frm.doc.company_name || frm.doc.name]);
+	frappe.realtime.on('onboarding_approval_progress', function(data) {
+		if (!data || data.docname !== frm.doc.name) return;
+		if (data.state === 'running') {
+			frappe.show_progress(title, data.completed, data.total, __('Stage: {0}', [data.stage]));
+			return;
+		}
+		frappe.hide_progress();
+		frappe.realtime.off('onboarding_approval_progress');
+		frm._approval_progress_bound = false;
+		if (data.state === 'completed') {
+			frappe.show_alert({
+				message: __('🎉 Application Approved Successfully! Company and users have been created.'),
+				indicator: 'green'
+			});
+		} else {
+			frappe.show_alert({
+				message: __('❌ Approval failed at {0}: {1}', [data.stage, data.error || '']),
+				indicator: 'red'
+			});
+		}
+		frm.reload_doc();
+	});
+}
+
 // Helper function to show loading popup with spinner
 function showProcessingPopup(title, subtitle, spinnerColor = '#007bff') {
 	// Show loading popup
@@ -1,27 +1,58 @@
+import json
+
 import frappe
 from frappe import _
-from frappe.utils import now
+from frappe.utils import cint, now
 from frappe.model.document import Document
 from datetime import datetime
 
+from climoro_onboarding.climoro_onboarding.onboarding_drafts import clear_draft_snapshot
+
+# Approval runs as a background pipeline. Each stage is idempotent and the last
+# completed one is checkpointed on the form, so a retry resumes after it.
+APPROVAL_STAGES = ("Company", "Users", "Access", "Notifications")
+APPROVAL_MAX_ATTEMPTS = 3
+APPROVAL_PROGRESS_EVENT = "onboarding_approval_progress"
+
+# Company.abbr is unique in the database (see ensure_company_abbr_index);
+# losing an abbreviation to a concurrent approval retries with the next one
+COMPANY_ABBR_CONSTRAINT = "unique_company_abbr"
+COMPANY_ABBR_RETRIES = 5
+
+# Composite indexes for the lookups that run on every /apply call (by email,
+# latest first) and when planning access or GHG reports (by company)
+ONBOARDING_FORM_INDEXES = {
+    # Drafts by email and status, latest modified first; email-only lookups use the prefix
+    "email_status_modified_index": ["email", "status", "modified"],
+    # Latest application by email (step saves, saved data)
+    "email_creation_index": ["email", "creation"],
+    # Latest approved form of a company (access plans)
+    "company_name_status_modified_index": ["company_name", "status", "modified"],
+    # Latest form of a company by docstatus (GHG report boundaries)
+    "company_name_docstatus_modified_index": ["company_name", "docstatus", "modified"],
+}
+
 class OnboardingForm(Document):
-    def on_update(self):
-        """Whenever the form is updated, if it's Approved, resync roles/visibility
-        for users of this company so changes to scopes/sub-options take effect.
-        """
-        try:
-            if getattr(self, "status", "") == "Approved" and getattr(self, "company_name", None):
-                from climoro_onboarding.climoro_onboarding.ghg_workspace_access import assign_roles_for_company_based_on_onboarding
-                assign_roles_for_company_based_on_onboarding(self.company_name)
-        except Exception as e:
-            frappe.log_error(f"Error syncing onboarding selection on update for {self.name}: {str(e)}")
+    # Role/visibility resync on update is handled by the `on_update` doc event
+    # (ghg_workspace_access.sync_onboarding_selection), which debounces it into
+    # one background job per company.
     def before_insert(self):
         """Set creation timestamp"""
         self.created_at = datetime.now()
     
     def before_save(self):
-        """Set modification timestamp"""
+        """Set modification timestamp, the stored summary counters and the draft version"""
         self.modified_at = datetime.now()
+        self.update_summary_fields()
+        # Step saves from /apply compare against this to detect concurrent edits
+        self.draft_version = cint(self.draft_version) + 1
+    
+    def on_update(self):
+        """Drop the cached draft snapshots served to /apply"""
+        clear_draft_snapshot(self.name)
+    
+    def on_trash(self):
+        clear_draft_snapshot(self.name)
     
     def validate(self):
         """Validate the application data"""
@@ -31,40 +62,8 @@ class OnboardingForm(Document):
         self.validate_sub_industry_type()
     
     def update_summary_fields(self):
-        """Update the summary fields with current data"""
-        try:
-            # Calculate total units
-            self.total_units = len(self.units) if self.units else 0
-            
-            # Calculate total users across all units
-            total_users = 0
-            units_summary_parts = []
-            
-            if self.units:
-                for unit in self.units:
-                    unit_users = len(unit.assigned_users) if unit.assigned_users else 0
-                    total_users += unit_users
-                    
-                    # Create summary for this unit
-                    unit_summary = f"{unit.name_of_unit} ({unit.type_of_unit})"
-                    if unit_users > 0:
-                        unit_summary += f" - {unit_users} users"
-                    units_summary_parts.append(unit_summary)
-            
-            self.total_users = total_users
-            
-            # Create units summary text
-            if units_summary_parts:
-                self.units_summary = " | ".join(units_summary_parts)
-            else:
-                self.units_summary = "No units added"
-                
-        except Exception as e:
-            frappe.log_error(f"Error updating summary fields: {str(e)}")
-            # Set default values if calculation fails
-            self.total_units = 0
-            self.total_users = 0
-            self.units_summary = "Error calculating summary"
+        """Update the stored counters from the child tables (sortable and filterable in the list view)"""
+        self.update(get_summary_counters(self.units or [], self.assigned_users or []))
     
     def validate_email(self):
         """Validate email format"""
@@ -137,20 +136,34 @@ class OnboardingForm(Document):
             frappe.log_error(f"Error sending admin notification: {str(e)}")
 
     def approve_application(self, approver=None):
-        """Approve the onboarding application, create company and users, send approval email, and update status"""
-        self.status = "Approved"
-        self.approved_at = datetime.now()
-        self.approved_by = approver or frappe.session.user
-        self.create_company_and_users()
-        # Assign GHG workspace roles to all company users based on selections
-        try:
+        """Queue the approval pipeline (company, users, access, notifications).
+
+        Calling it again after a failure resumes after the last completed stage.
+        """
+        if self.approval_status in ("Running", "Completed"):
+            return
+        self.db_set({
+            "approval_status": "Queued",
+            "approval_attempts": 0,
+            "approval_error": None,
+            "approved_by": approver or frappe.session.user,
+        }, update_modified=False)
+        enqueue_approval(self.name)
+
+    def run_approval_stage(self, stage):
+        """Run one approval stage; safe to re-run after a partial failure"""
+        if stage == "Company":
+            self._create_company()
+        elif stage == "Users":
+            self._create_users(self.company_name)
+        elif stage == "Access":
+            # The access engine plans from the latest *approved* form
+            self.db_set({"status": "Approved", "approved_at": datetime.now()})
+            clear_draft_snapshot(self.name)
             from climoro_onboarding.climoro_onboarding.ghg_workspace_access import assign_roles_for_company_based_on_onboarding
             assign_roles_for_company_based_on_onboarding(self.company_name)
-        except Exception as e:
-            frappe.log_error(f"Error assigning GHG workspace roles: {str(e)}")
-        self.send_approval_email()
-        self.save()
-        frappe.db.commit()
+        elif stage == "Notifications":
+            self.send_approval_email()
 
     def reject_application(self, reason=None, approver=None):
         """Reject the onboarding application, send rejection email, and update status"""
@@ -167,374 +180,257 @@ class OnboardingForm(Document):
         try:
             # Create company first
             company_name = self._create_company()
-            
-            # Create user for the form submitter (contact details from Step 1)
-            self._create_main_user(company_name)
-            
-            # Create users for each assigned user in each unit
-            self._create_unit_users(company_name)
-            
+            self._create_users(company_name)
             frappe.db.commit()
             
         except Exception as e:
             frappe.log_error(f"Error creating company and users: {str(e)}")
             frappe.throw(f"Error creating company and users: {str(e)}")
 
-    def _create_company(self):
-        """Create company from onboarding form data"""
-        company_name = self.company_name
-        
-        # Check if company already exists
-        if frappe.db.exists("Company", company_name):
-            return company_name
-        
-        # Generate company abbreviation
-        abbr = self._generate_company_abbr(company_name)
-        
-        # Create the company
-        company_doc = frappe.get_doc({
-            "doctype": "Company",
-            "company_name": company_name,
-            "abbr": abbr,
-            "default_currency": "INR",
-            "country": "India",
-            "domain": "Manufacturing",
-            "email": self.email,
-            "phone_no": self.phone_number,
-            "company_description": f"Company created from onboarding application {self.name}",
-        })
-        
-        company_doc.insert(ignore_permissions=True)
-        frappe.logger().info(f"Created company: {company_name}")
-        return company_name
+    def _create_users(self, company_name):
+        """Create or update the submitter and all unit users, then their module blocks.
 
-    def _create_main_user(self, company_name):
-        """Create user for the form submitter with Super Admin role"""
-        email = self.email
+        Existing users are fetched in one query and only get their missing roles
+        (one bulk insert) and, when they have none yet, the company (one UPDATE).
+        New users are inserted with their roles attached; their welcome emails are
+        queued.
+        """
+        wanted = self._get_wanted_users()
+        user_names = list(wanted)
+        existing = set(frappe.get_all("User", filters={"name": ["in", user_names]}, pluck="name"))
         
-        # Check if user already exists
-        if frappe.db.exists("User", email):
-            user_doc = frappe.get_doc("User", email)
-            
-            # Add Super Admin role if not already present
-            existing_roles = [role.role for role in user_doc.roles]
-            if "Super Admin" not in existing_roles:
-                user_doc.append("roles", {"role": "Super Admin"})
-            
-            # Assign the company to the user
-            user_doc.company = company_name
-            
-            # Block all modules for existing user
-            self._block_all_modules_for_user(user_doc)
-            
-            user_doc.save(ignore_permissions=True)
-        else:
-            # Create new user with Super Admin role
-            # Use the first_name from form, or generate a proper name from email
-            if self.first_name and self.first_name.strip():
-                first_name = self.first_name.strip()
-                # Take only the first part if it contains spaces
-                if ' ' in first_name:
-                    first_name = first_name.split(' ')[0]
-            else:
-                # Generate a proper name from email prefix
-                email_prefix = email.split('@')[0]
-                # Convert to title case and replace common prefixes
-                first_name = email_prefix.replace('_', ' ').replace('-', ' ').title()
-                # Take only the first part if it contains spaces
-                if ' ' in first_name:
-                    first_name = first_name.split(' ')[0]
-            
-            user_doc = frappe.get_doc({
+        self._update_existing_users(company_name, {name: wanted[name] for name in user_names if name in existing})
+        
+        new_users = []
+        for email in user_names:
+            if email in existing:
+                continue
+            frappe.get_doc({
                 "doctype": "User",
                 "email": email,
-                "first_name": first_name,
+                "first_name": wanted[email]["first_name"],
                 "company": company_name,
                 "user_type": "System User",
-                "send_welcome_email": 1,
+                # Sent from the queue once the approval stage commits
+                "send_welcome_email": 0,
                 "enabled": 1,
-                "roles": [
-                    {"role": "Super Admin"},
-                ]
-            })
-            
-            # Block all modules for new user
-            self._block_all_modules_for_user(user_doc)
-            
-            user_doc.insert(ignore_permissions=True)
+                "roles": [{"role": role} for role in wanted[email]["roles"]],
+            }).insert(ignore_permissions=True)
+            new_users.append(email)
         
-        frappe.logger().info(f"Created main user: {email} with Super Admin role (all modules blocked)")
-        return email
+        # Write every user's final module blocks in one go
+        self._provision_module_blocks(company_name, user_names, existing)
+        
+        if new_users:
+            frappe.enqueue(
+                "climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.send_welcome_emails",
+                queue="short",
+                enqueue_after_commit=True,
+                user_names=new_users,
+            )
+        frappe.logger().info(
+            f"Provisioned {len(user_names)} users for {company_name} ({len(new_users)} new, {len(existing)} existing)"
+        )
+        return user_names
+
+    def _get_wanted_users(self):
+        """Map of user name (email) to first name and roles, for the submitter
+        (Super Admin) and every assigned unit user, in form order
+        """
+        wanted = {}
+        
+        def want(email, first_name, role):
+            email = (email or "").strip().lower()
+            if not email:
+                return
+            user = wanted.setdefault(email, {"first_name": _get_user_first_name(first_name, email), "roles": []})
+            if role and role not in user["roles"]:
+                user["roles"].append(role)
+        
+        want(self.email, self.first_name, "Super Admin")
+        for assigned_user in self.assigned_users or []:
+            want(assigned_user.email, assigned_user.first_name, assigned_user.user_role)
+        return wanted
 
-    def _create_unit_users(self, company_name):
-        """Create users for each assigned user in each unit"""
-        if not self.assigned_users:
+    def _update_existing_users(self, company_name, users):
+        """Add missing roles and set the company for existing users without loading them.
+
+        Users already linked to another company keep it.
+        """
+        if not users:
             return
+        user_names = list(users)
+        current_roles = {name: set() for name in user_names}
+        max_idx = {name: 0 for name in user_names}
+        for row in frappe.get_all(
+            "Has Role",
+            filters={"parenttype": "User", "parent": ["in", user_names]},
+            fields=["parent", "role", "idx"],
+        ):
+            current_roles[row.parent].add(row.role)
+            max_idx[row.parent] = max(max_idx[row.parent], row.idx or 0)
         
-        for assigned_user in self.assigned_users:
-            # Find the corresponding unit for this assigned user
-            unit_name = assigned_user.assigned_unit
-            unit = None
-            
-            # Find the unit by name
-            if self.units:
-                for u in self.units:
-                    if u.name_of_unit == unit_name:
-                        unit = u
-                        break
-            
-            self._create_single_unit_user(assigned_user, company_name, unit)
+        timestamp = now()
+        session_user = frappe.session.user
+        values = []
+        for name, user in users.items():
+            for role in user["roles"]:
+                if role in current_roles[name]:
+                    continue
+                max_idx[name] += 1
+                values.append((
+                    frappe.generate_hash(length=10), name, "User", "roles", max_idx[name], role,
+                    session_user, timestamp, timestamp, session_user, 0,
+                ))
+        if values:
+            frappe.db.bulk_insert(
+                "Has Role",
+                fields=["name", "parent", "parenttype", "parentfield", "idx", "role", "owner", "creation", "modified", "modified_by", "docstatus"],
+                values=values,
+            )
+        
+        companies = dict(frappe.get_all("User", filters={"name": ["in", user_names]}, fields=["name", "company"], as_list=True))
+        unlinked = [name for name in user_names if not companies.get(name)]
+        if unlinked:
+            frappe.db.set_value("User", {"name": ["in", unlinked]}, "company", company_name)
+        for name in user_names:
+            if companies.get(name) and companies[name] != company_name:
+                frappe.logger().info(f"User {name} stays linked to {companies[name]}, not {company_name}")
 
-    def _create_single_unit_user(self, assigned_user, company_name, unit):
-        """Create a single user for an assigned user in a unit"""
-        email = assigned_user.email
-        user_role = assigned_user.user_role
+    def _create_company(self):
+        """Create company from onboarding form data"""
+        company_name = self.company_name
         
-        # Check if user already exists
-        if frappe.db.exists("User", email):
-            user_doc = frappe.get_doc("User", email)
-            
-            # Add the role if not already present
-            existing_roles = [role.role for role in user_doc.roles]
-            if user_role not in existing_roles:
-                user_doc.append("roles", {"role": user_role})
-            
-            # Assign the company to the user
-            user_doc.company = company_name
-            
-            # Block all modules for existing user
-            self._block_all_modules_for_user(user_doc)
-            
-            user_doc.save(ignore_permissions=True)
-        else:
-            # Create new user with the specified role
-            # Use the first_name from assigned_user, or generate a proper name from email
-            if assigned_user.first_name and assigned_user.first_name.strip():
-                first_name = assigned_user.first_name.strip()
-                # Take only the first part if it contains spaces
-                if ' ' in first_name:
-                    first_name = first_name.split(' ')[0]
-            else:
-                # Generate a proper name from email prefix
-                email_prefix = email.split('@')[0]
-                # Convert to title case and replace common prefixes
-                first_name = email_prefix.replace('_', ' ').replace('-', ' ').title()
-                # Take only the first part if it contains spaces
-                if ' ' in first_name:
-                    first_name = first_name.split(' ')[0]
-            
-            user_doc = frappe.get_doc({
-                "doctype": "User",
-                "email": email,
-                "first_name": first_name,
-                "company": company_name,
-                "user_type": "System User",
-                "send_welcome_email": 1,
-                "enabled": 1,
-                "roles": [
-                    {"role": user_role},
-                ]
+        # Check if company already exists
+        if frappe.db.exists("Company", company_name):
+            return company_name
+        
+        # Abbreviations already taken, fetched once for every candidate
+        base_abbr = _get_company_abbr_base(company_name)
+        taken = _get_taken_company_abbrs(base_abbr)
+        
+        for _ in range(COMPANY_ABBR_RETRIES):
+            abbr = self._generate_company_abbr(company_name, taken)
+            
+            # Create the company
+            company_doc = frappe.get_doc({
+                "doctype": "Company",
+                "company_name": company_name,
+                "abbr": abbr,
+                "default_currency": "INR",
+                "country": "India",
+                "domain": "Manufacturing",
+                "email": self.email,
+                "phone_no": self.phone_number,
+                "company_description": f"Company created from onboarding application {self.name}",
             })
             
-            # Block all modules for new user
-            self._block_all_modules_for_user(user_doc)
-            
-            user_doc.insert(ignore_permissions=True)
+            frappe.db.savepoint("climoro_company_abbr")
+            try:
+                company_doc.insert(ignore_permissions=True)
+            except frappe.ValidationError as e:
+                # A concurrent approval claimed the abbreviation first: either the unique
+                # index caught it, or Company.validate_abbr saw its committed row
+                frappe.db.rollback(save_point="climoro_company_abbr")
+                taken = _get_taken_company_abbrs(base_abbr)
+                if COMPANY_ABBR_CONSTRAINT not in str(e) and abbr.upper() not in taken:
+                    raise
+                taken.add(abbr.upper())
+                continue
+            
+            frappe.logger().info(f"Created company: {company_name}")
+            return company_name
         
-        frappe.logger().info(f"Created unit user: {email} with role {user_role} (all modules blocked)")
+        frappe.throw(f"Could not allocate an abbreviation for company {company_name}")
 
-    def _block_all_modules_for_user(self, user_doc):
-        """Block all available modules for a user"""
+    def _provision_module_blocks(self, company_name, user_names, existing_users=None):
+        """Block every module for the new users except the ones their access plan
+        unblocks; existing users only lose their blocks on those modules
+        """
         try:
-            # Get all available modules from the system
-            from frappe.config import get_modules_from_all_apps
-            all_modules = get_modules_from_all_apps()
-            
-            # Clear existing blocked modules
-            user_doc.set("block_modules", [])
-            
-            # Add all modules to blocked modules
-            for module_data in all_modules:
-                module_name = module_data.get("module_name")
-                if module_name:
-                    user_doc.append("block_modules", {"module": module_name})
-            
-            frappe.logger().info(f"Blocked {len(all_modules)} modules for user {user_doc.email}")
+            from climoro_onboarding.climoro_onboarding.ghg_workspace_access import (
+                plan_from_onboarding,
+                provision_module_blocks,
+            )
+            plan = plan_from_onboarding(company_name, self)
+            provision_module_blocks(user_names, plan, existing_users)
+            frappe.logger().info(f"Provisioned module blocks for {len(user_names)} users of {company_name}")
             
         except Exception as e:
-            frappe.log_error(f"Error blocking modules for user {user_doc.email}: {str(e)}")
+            frappe.log_error(f"Error blocking modules for users of {company_name}: {str(e)}")
             # Continue with user creation even if module blocking fails
 
-    def _generate_company_abbr(self, company_name):
-        """Generate unique company abbreviation"""
-        # Take first letter of each word, max 3 characters
-        words = company_name.split()
-        base_abbr = ''.join(word[0].upper() for word in words[:3])
-        base_abbr = base_abbr[:3] if base_abbr else company_name[:3].upper()
-        
-        # Ensure we have at least something
-        if not base_abbr:
-            base_abbr = "COM"
-        
-        # Check if base abbreviation is available
-        if not frappe.db.exists("Company", {"abbr": base_abbr}):
-            return base_abbr
-        
-        # If base abbreviation exists, try variations with numbers
-        counter = 1
-        while counter <= 99:  # Limit to prevent infinite loop
-            variant_abbr = f"{base_abbr[:2]}{counter}"  # Keep first 2 chars + number
-            if not frappe.db.exists("Company", {"abbr": variant_abbr}):
-                return variant_abbr
-            counter += 1
+    def _generate_company_abbr(self, company_name, taken=None):
+        """Generate unique company abbreviation
+
+        Checks the candidates in order against the taken abbreviations, which are
+        read in one query when not given: the initials (max 3 characters), the
+        first 2 characters plus 1-99, plus a letter, then the first character
+        plus two digits.
+        """
+        base_abbr = _get_company_abbr_base(company_name)
+        if taken is None:
+            taken = _get_taken_company_abbrs(base_abbr)
         
-        # If all variations from 1-99 are taken, try different approach
-        # Use first 2 characters + random suffix
-        import random
-        import string
-        for _ in range(10):  # Try 10 random combinations
-            random_suffix = random.choice(string.ascii_uppercase)
-            variant_abbr = f"{base_abbr[:2]}{random_suffix}"
-            if not frappe.db.exists("Company", {"abbr": variant_abbr}):
-                return variant_abbr
+        for candidate in _get_company_abbr_candidates(base_abbr):
+            if candidate not in taken:
+                return candidate
         
-        # Last resort: use timestamp-based suffix
-        from frappe.utils import now_datetime
-        timestamp_suffix = str(now_datetime().microsecond)[-2:]
-        return f"{base_abbr[:1]}{timestamp_suffix}"
+        frappe.throw(f"No free abbreviation left for company {company_name}")
 
     def send_approval_email(self):
-        """Send approval email to applicant"""
+        """Queue the approval email to the applicant and the internal team"""
         try:
-            # Get created users info for email
-            created_users_info = self._get_created_users_info()
-            
-            frappe.sendmail(
-                recipients=[self.email],
-                subject=f"🎉 Climoro Onboarding Approved - {self.company_name}",
-                message=f"""
-                <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                    <h2 style="color: #28a745;">🎉 Congratulations! Your Climoro Onboarding has been Approved!</h2>
-                    
-                    <p>Dear {self.first_name},</p>
-                    
-                    <p>We are pleased to inform you that your onboarding application has been <strong>approved</strong>!</p>
-                    
-                    <div style="background: #d4edda; padding: 20px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #28a745;">
-                        <h3 style="margin-top: 0; color: #155724;">Application Details</h3>
-                        <table style="width: 100%; border-collapse: collapse;">
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold; width: 40%;">Application ID:</td>
-                                <td style="padding: 8px 0;">{self.name}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Company Created:</td>
-                                <td style="padding: 8px 0;">{self.company_name}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Your Account:</td>
-                                <td style="padding: 8px 0;">{self.email} (Super Admin)</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Units Created:</td>
-                                <td style="padding: 8px 0;">{len(self.units) if self.units else 0}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Users Created:</td>
-                                <td style="padding: 8px 0;">{created_users_info['total_users']}</td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 8px 0; font-weight: bold;">Approved By:</td>
-                                <td style="padding: 8px 0;">{frappe.get_value('User', self.approved_by, 'full_name') or self.approved_by}</td>
-                            </tr>
-                        </table>
-                    </div>
-                    
-                    {created_users_info['users_details']}
-                    
-                    <h3>Next Steps:</h3>
-                    <ol>
-                        <li>You will receive a welcome email with login credentials</li>
-                        <li>Access your Climoro dashboard</li>
-                        <li>Complete the onboarding process</li>
-                        <li>Start managing your units and users</li>
-                    </ol>
-                    
-                    <p>Welcome to Climoro!</p>
-                    
-                    <p>Best regards,<br>Climoro Onboarding Team</p>
-                </div>
-                """,
-                now=True
+            from climoro_onboarding.climoro_onboarding.onboarding_emails import queue_email
+            
+            args = {
+                "application_id": self.name,
+                "first_name": self.first_name,
+                "company_name": self.company_name,
+                "email": self.email,
+                "units_count": len(self.units) if self.units else 0,
+                "total_users": self.get_users_count(),
+                "approved_by": frappe.get_value('User', self.approved_by, 'full_name') or self.approved_by,
+                "users_by_unit": self._get_users_by_unit(),
+            }
+            queue_email(
+                [self.email],
+                f"🎉 Climoro Onboarding Approved - {self.company_name}",
+                "onboarding_approved",
+                args,
             )
             
             # Email to internal team
-            frappe.sendmail(
-                recipients=["admin@climoro.com"],
-                subject=f"Climoro Onboarding Approved - {self.company_name}",
-                message=f"""
-                <h3>Climoro Onboarding Approved & Processed</h3>
-                <p><strong>Application ID:</strong> {self.name}</p>
-                <p><strong>Company Created:</strong> {self.company_name}</p>
-                <p><strong>Main User Created:</strong> {self.email} (Super Admin)</p>
-                <p><strong>Units Created:</strong> {len(self.units) if self.units else 0}</p>
-                <p><strong>Total Users Created:</strong> {created_users_info['total_users']}</p>
-                <p><strong>Approved By:</strong> {frappe.get_value('User', self.approved_by, 'full_name') or self.approved_by}</p>
-                <p><strong>Contact Email:</strong> {self.email}</p>
-                """,
-                now=True
+            queue_email(
+                ["admin@climoro.com"],
+                f"Climoro Onboarding Approved - {self.company_name}",
+                "onboarding_approved_admin",
+                args,
             )
         except Exception as e:
             frappe.log_error(f"Failed to send approval email: {str(e)}")
 
-    def _get_created_users_info(self):
-        """Get information about created users for email"""
-        total_users = 1  # Main user
-        users_details = ""
-        
-        if self.assigned_users:
-            total_users += len(self.assigned_users)
-            
-            # Group users by unit
-            unit_users = {}
-            for assigned_user in self.assigned_users:
-                unit_name = assigned_user.assigned_unit
-                if unit_name not in unit_users:
-                    unit_users[unit_name] = []
-                unit_users[unit_name].append(assigned_user)
-            
-            # Create details for each unit
-            for unit_name, users in unit_users.items():
-                users_details += f"<h4>Unit: {unit_name}</h4><ul>"
-                for assigned_user in users:
-                    users_details += f"<li>{assigned_user.email} ({assigned_user.user_role})</li>"
-                users_details += "</ul>"
-        
-        if users_details:
-            users_details = f"""
-            <h3>Created Users:</h3>
-            <h4>Main User:</h4>
-            <ul><li>{self.email} (Super Admin)</li></ul>
-            {users_details}
-            """
-        
-        return {
-            'total_users': total_users,
-            'users_details': users_details
-        }
+    def _get_users_by_unit(self):
+        """Assigned users grouped by unit, as (unit name, users) pairs in form order"""
+        users_by_unit = {}
+        for assigned_user in self.assigned_users or []:
+            users_by_unit.setdefault(assigned_user.assigned_unit, []).append(assigned_user)
+        return list(users_by_unit.items())
 
     def send_rejection_email(self):
         """Send rejection email to applicant"""
         try:
-            frappe.sendmail(
-                recipients=[self.email],
-                subject=f"Climoro Onboarding Rejected: {self.company_name}",
-                message=f"""
-                We regret to inform you that your onboarding application has been rejected.<br><br>
-                Reason: {self.rejection_reason}<br>
-                Company: {self.company_name}<br>
-                Application ID: {self.name}<br>
-                """
+            from climoro_onboarding.climoro_onboarding.onboarding_emails import queue_email
+            
+            queue_email(
+                [self.email],
+                f"Climoro Onboarding Rejected: {self.company_name}",
+                "onboarding_rejected",
+                {
+                    "application_id": self.name,
+                    "company_name": self.company_name,
+                    "rejection_reason": self.rejection_reason,
+                },
             )
         except Exception as e:
             frappe.log_error(f"Failed to send rejection email: {str(e)}")
@@ -580,22 +476,40 @@ class OnboardingForm(Document):
         
         return summary
 
+def on_doctype_update():
+    for index_name, fields in ONBOARDING_FORM_INDEXES.items():
+        frappe.db.add_index("Onboarding Form", fields, index_name=index_name)
+
+def ensure_company_abbr_index():
+    """Create the unique index on Company.abbr when it is missing; runs after
+    install and after every migrate.
+
+    Approvals rely on it to detect a concurrently claimed abbreviation, so
+    existing duplicates fail the migrate with the companies to fix instead of
+    leaving the index out.
+    """
+    if not frappe.db.table_exists("Company") or frappe.db.has_index("tabCompany", COMPANY_ABBR_CONSTRAINT):
+        return
+    duplicates = frappe.db.sql(
+        "select abbr, group_concat(name order by creation separator ', ') from `tabCompany`"
+        " group by abbr having count(*) > 1"
+    )
+    if duplicates:
+        frappe.throw(
+            _(
+                "Cannot add the unique index on Company abbreviation, these companies share one: {0}."
+                " Give all but one of each group a new abbreviation and run the migrate again."
+            ).format("; ".join(f"{abbr}: {names}" for abbr, names in duplicates)),
+            title=_("Duplicate Company Abbreviations"),
+        )
+    frappe.db.add_unique("Company", ["abbr"], constraint_name=COMPANY_ABBR_CONSTRAINT)
+
 @frappe.whitelist()
 def refresh_all_summaries():
-    """Refresh summary fields for all Onboarding Form documents"""
+    """Recompute the summary counters of all Onboarding Form documents"""
+    frappe.only_for("System Manager")
     try:
-        forms = frappe.get_all("Onboarding Form", fields=["name"])
-        updated_count = 0
-        
-        for form in forms:
-            try:
-                doc = frappe.get_doc("Onboarding Form", form.name)
-                # Removed update_summary_fields() call
-                doc.save(ignore_permissions=True)
-                updated_count += 1
-            except Exception as e:
-                frappe.log_error(f"Error updating summary for {form.name}: {str(e)}")
-        
+        updated_count = update_all_summary_counters()
         frappe.db.commit()
         return f"Updated {updated_count} forms"
         
@@ -603,21 +517,186 @@ def refresh_all_summaries():
         frappe.log_error(f"Error in refresh_all_summaries: {str(e)}")
         return f"Error: {str(e)}"
 
+def get_summary_counters(units, assigned_users):
+    """Stored counters for the given unit and assigned user rows (documents or dicts)"""
+    users_per_unit = {}
+    for assigned_user in assigned_users:
+        unit_name = assigned_user.get("assigned_unit") or ""
+        users_per_unit[unit_name] = users_per_unit.get(unit_name, 0) + 1
+    return {
+        "total_units": len(units),
+        # Main user (form submitter) plus all unit users
+        "total_users": 1 + len(assigned_users),
+        "users_per_unit": json.dumps(users_per_unit, sort_keys=True),
+    }
+
+def update_all_summary_counters():
+    """Set total_units, total_users and users_per_unit for every form from its
+    child tables, as one set-based UPDATE. Returns the number of forms.
+    """
+    frappe.db.sql("""
+        update `tabOnboarding Form` form
+        left join (
+            select parent, count(*) as units
+            from `tabCompany Unit`
+            where parenttype = 'Onboarding Form' and parentfield = 'units'
+            group by parent
+        ) unit_counts on unit_counts.parent = form.name
+        left join (
+            select parent, sum(users) as users, json_objectagg(unit_name, users) as per_unit
+            from (
+                select parent, coalesce(assigned_unit, '') as unit_name, count(*) as users
+                from `tabAssigned User`
+                where parenttype = 'Onboarding Form' and parentfield = 'assigned_users'
+                group by parent, coalesce(assigned_unit, '')
+            ) per_unit_counts
+            group by parent
+        ) user_counts on user_counts.parent = form.name
+        set
+            form.total_units = coalesce(unit_counts.units, 0),
+            form.total_users = coalesce(user_counts.users, 0) + 1,
+            form.users_per_unit = coalesce(user_counts.per_unit, '{}')
+    """)
+    return frappe.db.count("Onboarding Form")
+
 @frappe.whitelist()
 def approve_application(docname):
-    """Approve the onboarding application"""
+    """Queue approval of the onboarding application (also retries a failed one)"""
     try:
-        print(f"=== DEBUG: Starting approval for {docname} ===")
         doc = frappe.get_doc("Onboarding Form", docname)
-        print(f"=== DEBUG: Current status before approval: {doc.status} ===")
+        doc.check_permission("write")
         doc.approve_application()
-        print(f"=== DEBUG: Status after approval: {doc.status} ===")
-        return {"success": True, "message": "Application approved successfully"}
+        return {"success": True, "message": "Approval queued", "stage": doc.approval_stage}
     except Exception as e:
-        print(f"=== DEBUG: Error in approval: {str(e)} ===")
         frappe.log_error(f"Error approving application {docname}: {str(e)}")
         return {"success": False, "message": str(e)}
 
+def _get_company_abbr_base(company_name):
+    # Take first letter of each word, max 3 characters
+    words = company_name.split()
+    base_abbr = ''.join(word[0].upper() for word in words[:3])
+    base_abbr = base_abbr[:3] if base_abbr else company_name[:3].upper()
+    
+    # Ensure we have at least something
+    return base_abbr or "COM"
+
+def _get_taken_company_abbrs(base_abbr):
+    """Upper-cased abbreviations sharing the first character, i.e. every candidate's prefix"""
+    return {
+        (abbr or "").upper()
+        for abbr in frappe.get_all(
+            "Company",
+            filters={"abbr": ["like", f"{base_abbr[:1]}%"]},
+            pluck="abbr",
+        )
+    }
+
+def _get_company_abbr_candidates(base_abbr):
+    import string
+    
+    yield base_abbr
+    for counter in range(1, 100):
+        yield f"{base_abbr[:2]}{counter}"
+    for letter in string.ascii_uppercase:
+        yield f"{base_abbr[:2]}{letter}"
+    for counter in range(100):
+        yield f"{base_abbr[:1]}{counter:02d}"
+
+def _get_user_first_name(first_name, email):
+    """First word of the given first name, or a name derived from the email prefix"""
+    if first_name and first_name.strip():
+        first_name = first_name.strip()
+    else:
+        # Generate a proper name from email prefix
+        first_name = email.split('@')[0].replace('_', ' ').replace('-', ' ').title()
+    # Take only the first part if it contains spaces
+    return first_name.split(' ')[0]
+
+def send_welcome_emails(user_names):
+    """Background job: send the welcome/set-password email to newly provisioned users"""
+    for user_name in user_names:
+        try:
+            frappe.get_doc("User", user_name).send_welcome_mail_to_user()
+        except Exception as e:
+            frappe.log_error(f"Error sending welcome email to {user_name}: {str(e)}")
+
+def _approval_job_id(docname):
+    return f"climoro_onboarding_approval::{docname}"
+
+def enqueue_approval(docname):
+    frappe.enqueue(
+        "climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.run_approval_pipeline",
+        queue="long",
+        job_id=_approval_job_id(docname),
+        deduplicate=True,
+        enqueue_after_commit=True,
+        docname=docname,
+    )
+
+def run_approval_pipeline(docname):
+    """Background job: run the approval stages after the last checkpoint.
+
+    Every completed stage is committed together with its checkpoint, so a
+    failure or a worker restart only repeats the stage that was interrupted.
+    """
+    doc = frappe.get_doc("Onboarding Form", docname)
+    if doc.approval_status == "Completed":
+        return
+    done = APPROVAL_STAGES.index(doc.approval_stage) + 1 if doc.approval_stage in APPROVAL_STAGES else 0
+    doc.db_set({
+        "approval_status": "Running",
+        "approval_attempts": cint(doc.approval_attempts) + 1,
+    }, update_modified=False, commit=True)
+
+    stage = None
+    try:
+        for stage in APPROVAL_STAGES[done:]:
+            _publish_approval_progress(doc, stage, "running")
+            doc.run_approval_stage(stage)
+            doc.db_set("approval_stage", stage, update_modified=False)
+            frappe.db.commit()
+        doc.db_set({"approval_status": "Completed", "approval_error": None}, update_modified=False, commit=True)
+        _publish_approval_progress(doc, None, "completed")
+    except Exception as e:
+        frappe.db.rollback()
+        doc.db_set({"approval_status": "Failed", "approval_error": f"{stage}: {str(e)}"}, update_modified=False, commit=True)
+        frappe.log_error(f"Approval of {docname} failed at stage {stage}: {str(e)}")
+        _publish_approval_progress(doc, stage, "failed", error=str(e))
+
+def _publish_approval_progress(doc, stage, state, error=None):
+    completed = APPROVAL_STAGES.index(doc.approval_stage) + 1 if doc.approval_stage in APPROVAL_STAGES else 0
+    frappe.publish_realtime(
+        APPROVAL_PROGRESS_EVENT,
+        {
+            "docname": doc.name,
+            "stage": stage,
+            "state": state,
+            "completed": completed,
+            "total": len(APPROVAL_STAGES),
+            "error": error,
+        },
+        doctype=doc.doctype,
+        docname=doc.name,
+    )
+
+def retry_stalled_approvals():
+    """Scheduler: re-queue failed approvals that have attempts left, and queued or
+    running ones whose job is gone (e.g. the worker restarted mid-stage).
+    """
+    from frappe.utils.background_jobs import is_job_enqueued
+    
+    approvals = frappe.get_all(
+        "Onboarding Form",
+        filters={"approval_status": ["in", ["Queued", "Running", "Failed"]]},
+        fields=["name", "approval_status", "approval_attempts"],
+    )
+    for approval in approvals:
+        if is_job_enqueued(_approval_job_id(approval.name)):
+            continue
+        if approval.approval_status == "Failed" and cint(approval.approval_attempts) >= APPROVAL_MAX_ATTEMPTS:
+            continue
+        enqueue_approval(approval.name)
+
 @frappe.whitelist()
 def reject_application(docname, reason=None):
     """Reject the onboarding application"""
@@ -0,0 +1,29 @@
+# Copyright (c) 2025, climoro and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+
+import frappe
+from frappe.model.document import Document
+
+# Redis key every worker compares against its loaded config version
+CONFIG_VERSION_KEY = "climoro_workspace_access_config_version"
+
+
+class WorkspaceAccessSettings(Document):
+	def validate(self):
+		try:
+			config = json.loads(self.config_json or "{}")
+		except ValueError as e:
+			frappe.throw(f"Access Configuration is not valid JSON: {str(e)}")
+		if not isinstance(config, dict):
+			frappe.throw("Access Configuration must be a JSON object")
+		self.config_version = hashlib.sha1(
+			json.dumps(config, sort_keys=True).encode()
+		).hexdigest()
+
+	def on_update(self):
+		# Publish after commit so workers that see the new version also read the new config
+		version = self.config_version
+		frappe.db.after_commit.add(lambda: frappe.cache().set_value(CONFIG_VERSION_KEY, version))
@@ -2,6 +2,10 @@ import frappe
 from typing import List, Set, Dict, Optional
 import json
 
+from climoro_onboarding.climoro_onboarding.doctype.workspace_access_settings.workspace_access_settings import CONFIG_VERSION_KEY
+
+SETTINGS_DOCTYPE = "Workspace Access Settings"
+
 class WorkspaceAccessManager:
     """
     Enhanced workspace access management system for the Climoro onboarding app.
@@ -9,20 +13,61 @@ class WorkspaceAccessManager:
     """
     
     def __init__(self):
-        # Load configuration from a JSON file for better extensibility
-        self.config = self._load_config()
-        
+        # Loaded lazily and reloaded whenever the cluster-wide config version moves
+        self._config = None
+        self._version = None
+    
+    @property
+    def config(self) -> Dict:
+        """Current configuration; reloaded only when another worker published a new version"""
+        version = self._current_version()
+        if self._config is None or version != self._version:
+            self._config = self._load_config()
+            self._version = version
+        return self._config
+    
+    def _current_version(self) -> str:
+        """Cluster-wide config version, read from Redis at most once per request"""
+        version = getattr(frappe.local, "climoro_access_config_version", None)
+        if version is None:
+            version = frappe.cache().get_value(CONFIG_VERSION_KEY)
+            if version is None:
+                version = self._stored_version()
+                frappe.cache().set_value(CONFIG_VERSION_KEY, version)
+            frappe.local.climoro_access_config_version = version
+        return version
+    
+    def _stored_version(self) -> str:
+        try:
+            return frappe.db.get_single_value(SETTINGS_DOCTYPE, "config_version") or ""
+        except Exception:
+            # Settings DocType not migrated yet
+            return ""
+    
     def _load_config(self) -> Dict:
-        """Load workspace access configuration from file or use defaults"""
+        """Load workspace access configuration from settings, the legacy file, or defaults"""
+        try:
+            config_json = frappe.db.get_single_value(SETTINGS_DOCTYPE, "config_json")
+        except Exception:
+            # Settings DocType not migrated yet
+            config_json = None
+        if config_json:
+            try:
+                return json.loads(config_json)
+            except json.JSONDecodeError as e:
+                frappe.log_error(f"Invalid {SETTINGS_DOCTYPE} configuration: {str(e)}")
+        return self._load_file_config()
+    
+    def _load_file_config(self) -> Dict:
+        """Load the bundled configuration file or use defaults"""
         try:
-            # Try to load from a configuration file first
             config_path = frappe.get_app_path("climoro_onboarding", "config", "workspace_access_config.json")
             with open(config_path, 'r') as f:
                 return json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
             # Fall back to default configuration
             return self._get_default_config()
-    
+        
     def _get_default_config(self) -> Dict:
         """Default configuration for workspace access control"""
         return {
@@ -79,6 +124,22 @@ class WorkspaceAccessManager:
                 "Scope 2 Access": ["Electricity"]
             },
             
+            # Sub-option roles only apply when their parent scope is selected
+            "role_parents": {
+                "Scope 3 Upstream Access": "Scope 3 Access",
+                "Scope 3 Downstream Access": "Scope 3 Access",
+                "Scope 1 Stationary Access": "Scope 1 Access",
+                "Scope 1 Mobile Access": "Scope 1 Access",
+                "Scope 1 Fugitives Access": "Scope 1 Access",
+                "Scope 1 Process Access": "Scope 1 Access",
+                "Reduction Energy Efficiency Access": "Reduction Factor Access",
+                "Reduction Solar Access": "Reduction Factor Access",
+                "Reduction Process Optimization Access": "Reduction Factor Access",
+                "Reduction Waste Manage Access": "Reduction Factor Access",
+                "Reduction Transportation Access": "Reduction Factor Access",
+                "Reduction Methane Recovery Access": "Reduction Factor Access",
+            },
+            
             "module_mappings": {
                 "Scope 1 Access": ["Scope 1", "Setup"],
                 "Scope 2 Access": ["Scope 2", "Setup"],
@@ -203,26 +264,24 @@ class WorkspaceAccessManager:
             return False
     
     def _save_config(self):
-        """Save configuration to file"""
+        """Save configuration to Workspace Access Settings and publish its version"""
         try:
-            config_dir = frappe.get_app_path("climoro_onboarding", "config")
-            frappe.create_folder(config_dir)
-            
-            config_path = frappe.get_app_path("climoro_onboarding", "config", "workspace_access_config.json")
-            with open(config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            settings = frappe.get_single(SETTINGS_DOCTYPE)
+            settings.config_json = json.dumps(self.config, indent=2)
+            settings.save(ignore_permissions=True)
+            # This worker already holds the saved config
+            self._version = settings.config_version
+            frappe.local.climoro_access_config_version = settings.config_version
         except Exception as e:
             frappe.log_error(f"Error saving workspace access config: {str(e)}")
     
+    # The access pipeline itself lives in ghg_workspace_access; the methods below
+    # delegate to it so both entry points apply the same rules from this config.
+
     def derive_roles_from_onboarding(self, onboarding_doc) -> Set[str]:
         """Derive access roles based on onboarding form selections"""
-        roles: Set[str] = set()
-        
-        for form_field, role_name in self.config['role_mappings'].items():
-            if getattr(onboarding_doc, form_field, 0):
-                roles.add(role_name)
-        
-        return roles
+        from climoro_onboarding.climoro_onboarding import ghg_workspace_access
+        return ghg_workspace_access._derive_roles_from_onboarding(onboarding_doc, ghg_workspace_access._access_config())
     
     def get_workspaces_for_roles(self, roles: Set[str]) -> Set[str]:
         """Get workspace labels for given roles"""
@@ -241,138 +300,23 @@ class WorkspaceAccessManager:
     
     def get_modules_for_roles(self, roles: Set[str]) -> Set[str]:
         """Get modules to unblock for given roles"""
-        modules = set()
-        
-        for role in roles:
-            role_modules = self.config['module_mappings'].get(role, [])
-            modules.update(role_modules)
-        
-        return modules
+        from climoro_onboarding.climoro_onboarding import ghg_workspace_access
+        return ghg_workspace_access._get_modules_for_roles(set(roles), ghg_workspace_access._access_config())
     
     def ensure_roles_exist(self, role_names: Set[str]):
         """Ensure all required roles exist in the system"""
-        for role_name in role_names:
-            if not frappe.db.exists("Role", role_name):
-                role_doc = frappe.new_doc("Role")
-                role_doc.role_name = role_name
-                role_doc.desk_access = 1
-                role_doc.module = "Climoro Onboarding"
-                role_doc.save(ignore_permissions=True)
+        from climoro_onboarding.climoro_onboarding.ghg_workspace_access import _ensure_roles_exist
+        _ensure_roles_exist(set(role_names))
     
     def apply_workspace_restrictions(self, selected_roles: Set[str]):
         """Apply workspace role restrictions based on selected roles"""
-        all_possible_roles = set(self.config['role_mappings'].values())
-        always_allowed = set(self.config['always_allowed_roles'])
-        
-        # Ensure each workspace has correct role restrictions
-        for role_name in selected_roles.union(always_allowed):
-            workspace_label = self.config['workspace_mappings'].get(role_name)
-            if not workspace_label:
-                continue
-            
-            workspace_list = frappe.get_all(
-                "Workspace",
-                filters={"label": workspace_label},
-                fields=["name"]
-            )
-            
-            if not workspace_list:
-                continue
-            
-            ws = frappe.get_doc("Workspace", workspace_list[0]["name"])
-            
-            # Update workspace roles
-            allowed_roles = selected_roles.union(always_allowed)
-            ws.set("roles", [{"role": role} for role in allowed_roles if role in [role_name] + list(always_allowed)])
-            
-            # Ensure the required role is present
-            current_roles = {row.role for row in ws.roles or []}
-            if role_name not in current_roles:
-                ws.append("roles", {"role": role_name})
-            
-            ws.save(ignore_permissions=True)
+        from climoro_onboarding.climoro_onboarding.ghg_workspace_access import _sync_workspace_restrictions
+        _sync_workspace_restrictions(set(selected_roles))
     
     def assign_roles_for_company(self, company_name: str):
         """Main method to assign roles for a company based on onboarding"""
-        onboarding = self._get_latest_onboarding_for_company(company_name)
-        if not onboarding:
-            return
-        
-        selected_roles = self.derive_roles_from_onboarding(onboarding)
-        if not selected_roles:
-            return
-        
-        self.ensure_roles_exist(selected_roles)
-        modules_to_unblock = self.get_modules_for_roles(selected_roles)
-        
-        # Update all company users
-        users = frappe.get_all(
-            "User",
-            filters={"company": company_name, "enabled": 1},
-            fields=["name"]
-        )
-        
-        for user in users:
-            user_doc = frappe.get_doc("User", user["name"])
-            self._sync_user_scope_roles(user_doc, selected_roles)
-            self._unblock_modules_for_user(user_doc, modules_to_unblock)
-        
-        # Apply workspace restrictions
-        self.apply_workspace_restrictions(selected_roles)
-    
-    def _get_latest_onboarding_for_company(self, company_name: str):
-        """Get the latest approved onboarding form for a company"""
-        if not company_name:
-            return None
-        
-        record = frappe.get_all(
-            "Onboarding Form",
-            filters={"company_name": company_name, "status": "Approved"},
-            fields=["name"],
-            order_by="modified desc",
-            limit=1
-        )
-        
-        if not record:
-            return None
-        
-        return frappe.get_doc("Onboarding Form", record[0]["name"])
-    
-    def _sync_user_scope_roles(self, user_doc, desired_scope_roles: Set[str]):
-        """Sync user roles with desired scope roles"""
-        current_roles = {row.role for row in user_doc.roles or []}
-        all_scope_roles = set(self.config['role_mappings'].values())
-        
-        # Remove obsolete scope roles
-        to_remove = (current_roles & all_scope_roles) - desired_scope_roles
-        if to_remove:
-            user_doc.set("roles", [row for row in user_doc.roles or [] if row.role not in to_remove])
-        
-        # Add missing desired roles
-        current_roles_after_remove = {row.role for row in user_doc.roles or []}
-        to_add = desired_scope_roles - current_roles_after_remove
-        for role in to_add:
-            user_doc.append("roles", {"role": role})
-        
-        if to_remove or to_add:
-            user_doc.save(ignore_permissions=True)
-    
-    def _unblock_modules_for_user(self, user_doc, modules_to_unblock: Set[str]):
-        """Unblock specified modules for a user"""
-        if not modules_to_unblock:
-            return
-        
-        initial_count = len(user_doc.block_modules or [])
-        remaining = []
-        
-        for row in user_doc.block_modules or []:
-            if row.module in modules_to_unblock:
-                continue
-            remaining.append(row)
-        
-        if len(remaining) != initial_count:
-            user_doc.set("block_modules", remaining)
-            user_doc.save(ignore_permissions=True)
+        from climoro_onboarding.climoro_onboarding.ghg_workspace_access import assign_roles_for_company_based_on_onboarding
+        assign_roles_for_company_based_on_onboarding(company_name)
 
 # Global instance
 workspace_access_manager = WorkspaceAccessManager()
@@ -423,18 +367,15 @@ def assign_roles_for_company_based_on_onboarding(company_name: str):
     return workspace_access_manager.assign_roles_for_company(company_name)
 
 def assign_roles_to_new_user(doc, method=None):
-    """Hook for new user creation"""
-    try:
-        company_name = getattr(doc, "company", None)
-        if company_name:
-            workspace_access_manager.assign_roles_for_company(company_name)
-    except Exception as e:
-        frappe.log_error(f"Error in assign_roles_to_new_user: {str(e)}")
+    """Hook for new user creation (kept for sites still wiring it; delegates to the single engine)"""
+    from climoro_onboarding.climoro_onboarding.ghg_workspace_access import assign_roles_to_new_user as _assign
+    _assign(doc, method)
 
 def sync_onboarding_selection(doc, method=None):
-    """Hook for onboarding form updates"""
+    """Hook for onboarding form updates; runs in the shared debounced company job"""
     try:
         if getattr(doc, "status", "") == "Approved" and getattr(doc, "company_name", None):
-            workspace_access_manager.assign_roles_for_company(doc.company_name)
+            from climoro_onboarding.climoro_onboarding.ghg_workspace_access import enqueue_company_access_sync
+            enqueue_company_access_sync(doc.company_name)
     except Exception as e:
         frappe.log_error(f"Error in sync_onboarding_selection: {str(e)}")
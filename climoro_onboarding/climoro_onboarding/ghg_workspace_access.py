@@ -1,307 +1,877 @@
+import hashlib
+import json
+import pickle
+import time
+from contextlib import contextmanager
+
 import frappe
-from typing import List, Set, Dict
-
-
-# Central mapping of selections -> role names and workspaces
-ROLE_MAP = {
-	"scopes_to_report_scope1": "Scope 1 Access",
-	"scopes_to_report_scope2": "Scope 2 Access",
-	"scopes_to_report_scope3": "Scope 3 Access",
-	"scopes_to_report_reductions": "Reduction Factor Access",
-	# Scope 3 sub-options
-	"scope_3_options_upstream": "Scope 3 Upstream Access",
-	"scope_3_options_downstream": "Scope 3 Downstream Access",
-	# Scope 1 sub-options
-	"scope_1_options_stationary": "Scope 1 Stationary Access",
-	"scope_1_options_mobile": "Scope 1 Mobile Access",
-	"scope_1_options_fugitive": "Scope 1 Fugitives Access",
-	"scope_1_options_process": "Scope 1 Process Access",
-	# Reduction sub-options
-	"reduction_options_energy_efficiency": "Reduction Energy Efficiency Access",
-	"reduction_options_renewable_energy": "Reduction Solar Access",
-	"reduction_options_process_optimization": "Reduction Process Optimization Access",
-	"reduction_options_waste_management": "Reduction Waste Manage Access",
-	"reduction_options_transportation": "Reduction Transportation Access",
-	"reduction_options_other": "Reduction Methane Recovery Access",
-}
-
-WORKSPACE_BY_ROLE = {
-	"Scope 1 Access": "Scope 1",
-	"Scope 2 Access": "Scope 2",
-	"Scope 3 Access": "Scope 3",
-	"Reduction Factor Access": "Reduction Factor",
-	"Scope 3 Upstream Access": "Upstream",
-	"Scope 3 Downstream Access": "Downstream",
-	# Scope 1 children
-	"Scope 1 Stationary Access": "Stationary Emissions",
-	"Scope 1 Mobile Access": "Mobile Combustion",
-	"Scope 1 Fugitives Access": "Fugitives",
-	"Scope 1 Process Access": "Process",
-	# Reduction children
-	"Reduction Energy Efficiency Access": "Energy Efficiency",
-	"Reduction Solar Access": "Solar",
-	"Reduction Process Optimization Access": "Process Optimization",
-	"Reduction Waste Manage Access": "Waste Manage",
-	"Reduction Transportation Access": "Transportation-Upstream",
-	"Reduction Methane Recovery Access": "Methane Recovery",
-}
-
-# Additional static workspace-role links that should follow parent scope access
-EXTRA_WORKSPACES_BY_ROLE = {
-	"Scope 2 Access": {"Electricity"},
-}
-
-# Some Workspaces are stored under module "Setup", but the site also defines
-# dedicated Module Def entries named "Scope 1", "Scope 2", "Scope 3",
-# and "Reduction Factor". If those modules are blocked, the sidebar may hide
-# the corresponding entries. Explicitly map roles to those Module Defs too.
-MODULES_BY_ROLE = {
-	"Scope 1 Access": {"Scope 1", "Setup"},
-	"Scope 2 Access": {"Scope 2", "Setup"},
-	"Scope 3 Access": {"Scope 3", "Setup"},
-	"Reduction Factor Access": {"Reduction Factor", "Setup"},
-	"Scope 3 Upstream Access": {"climoro onboarding"},
-	"Scope 3 Downstream Access": {"climoro onboarding"},
-}
-
-# Doctypes that must be readable by users for the workflows to function
-READONLY_DOCTYPES = {
-	# Emission factors
-	"Emission Factor Master",
-	# Scope 1 → Fugitives
-	"Fugitive Simple",
-	"Fugitive Screening",
-	"Fugitive Scale Base",
-	# GWP reference list used by fugitives
-	"GWP Reference",
-}
-
-# Always-allowed roles for workspaces. Keep empty to enforce company selections for everyone.
-ALWAYS_ALLOWED_ROLES = set()
-
-# Hidden role used to block unmanaged workspaces without relying on is_hidden global flag
-HIDDEN_ROLE = "Climoro Hidden"
+from typing import List, Set, Dict, Optional
+
+
+# Fallback when the access config does not name a hidden role
+DEFAULT_HIDDEN_ROLE = "Climoro Hidden"
+
+
+def _access_config() -> frappe._dict:
+	"""Normalized view of the workspace access config.
+
+	The JSON config managed by `WorkspaceAccessManager` is the single source of
+	selection -> role -> workspace/module mappings for every access path.
+	"""
+	from climoro_onboarding.climoro_onboarding.enhanced_workspace_access import workspace_access_manager
+
+	config = workspace_access_manager.config
+	role_parents = {}
+	# Older configs only recorded sub-scopes as parent -> [child roles]
+	for parent, children in (config.get("scope_dependencies") or {}).items():
+		parent_role = parent if parent.endswith(" Access") else f"{parent} Access"
+		for child in children or []:
+			role_parents[child] = parent_role
+	role_parents.update(config.get("role_parents") or {})
+	return frappe._dict(
+		role_map=dict(config.get("role_mappings") or {}),
+		role_parents=role_parents,
+		workspace_by_role=dict(config.get("workspace_mappings") or {}),
+		extra_workspaces_by_role={
+			role: set(labels) for role, labels in (config.get("extra_workspace_mappings") or {}).items()
+		},
+		modules_by_role={
+			role: set(modules) for role, modules in (config.get("module_mappings") or {}).items()
+		},
+		readonly_doctypes=set(config.get("readonly_doctypes") or []),
+		always_allowed_roles=set(config.get("always_allowed_roles") or []),
+		hidden_role=config.get("hidden_role") or DEFAULT_HIDDEN_ROLE,
+		managed_modules=set(config.get("managed_modules") or []),
+	)
 
 
 def _ensure_roles_exist(role_names: Set[str]) -> None:
-	for role_name in role_names.union(ALWAYS_ALLOWED_ROLES):
-		if not frappe.db.exists("Role", role_name):
-			role_doc = frappe.new_doc("Role")
-			role_doc.role_name = role_name
-			role_doc.desk_access = 1
-			role_doc.save(ignore_permissions=True)
-
-
-def _derive_roles_from_onboarding(onboarding_doc) -> Set[str]:
-	roles: Set[str] = set()
-	# Parent scopes
-	s1 = bool(getattr(onboarding_doc, "scopes_to_report_scope1", 0))
-	s2 = bool(getattr(onboarding_doc, "scopes_to_report_scope2", 0))
-	s3 = bool(getattr(onboarding_doc, "scopes_to_report_scope3", 0))
-	red = bool(getattr(onboarding_doc, "scopes_to_report_reductions", 0))
-
-	if s1:
-		roles.add("Scope 1 Access")
-		# Scope 1 sub-options
-		if getattr(onboarding_doc, "scope_1_options_stationary", 0):
-			roles.add("Scope 1 Stationary Access")
-		if getattr(onboarding_doc, "scope_1_options_mobile", 0):
-			roles.add("Scope 1 Mobile Access")
-		if getattr(onboarding_doc, "scope_1_options_fugitive", 0):
-			roles.add("Scope 1 Fugitives Access")
-		if getattr(onboarding_doc, "scope_1_options_process", 0):
-			roles.add("Scope 1 Process Access")
-
-	if s2:
-		roles.add("Scope 2 Access")
-
-	if s3:
-		roles.add("Scope 3 Access")
-		
-		# Handle Scope 3 sub-options - only grant access to specifically selected options
-		has_upstream = getattr(onboarding_doc, "scope_3_options_upstream", 0)
-		has_downstream = getattr(onboarding_doc, "scope_3_options_downstream", 0)
-		
-		if has_upstream:
-			roles.add("Scope 3 Upstream Access")
-		if has_downstream:
-			roles.add("Scope 3 Downstream Access")
-
-	if red:
-		roles.add("Reduction Factor Access")
-		if getattr(onboarding_doc, "reduction_options_energy_efficiency", 0):
-			roles.add("Reduction Energy Efficiency Access")
-		if getattr(onboarding_doc, "reduction_options_renewable_energy", 0):
-			roles.add("Reduction Solar Access")
-		if getattr(onboarding_doc, "reduction_options_process_optimization", 0):
-			roles.add("Reduction Process Optimization Access")
-		if getattr(onboarding_doc, "reduction_options_waste_management", 0):
-			roles.add("Reduction Waste Manage Access")
-		if getattr(onboarding_doc, "reduction_options_transportation", 0):
-			roles.add("Reduction Transportation Access")
-		if getattr(onboarding_doc, "reduction_options_other", 0):
-			roles.add("Reduction Methane Recovery Access")
-
-	return roles
+	_create_roles(_missing_roles(role_names))
+
+
+def _missing_roles(role_names: Set[str]) -> List[str]:
+	"""Roles from the set that do not exist yet, in one query."""
+	if not role_names:
+		return []
+	existing = set(frappe.get_all("Role", filters={"name": ["in", list(role_names)]}, pluck="name"))
+	return sorted(set(role_names) - existing)
+
+
+def _create_roles(role_names: List[str], hidden_role: Optional[str] = None) -> None:
+	for role_name in role_names:
+		role_doc = frappe.new_doc("Role")
+		role_doc.role_name = role_name
+		# The hidden role only gates workspaces; it never grants desk access
+		role_doc.desk_access = 0 if role_name == hidden_role else 1
+		role_doc.save(ignore_permissions=True)
+
+
+def _derive_roles_from_onboarding(onboarding_doc, config: frappe._dict) -> Set[str]:
+	"""Roles for every selected form field. A sub-option role only counts when
+	its parent scope role (see `role_parents`) is selected as well.
+	"""
+	roles = {role for field, role in config.role_map.items() if getattr(onboarding_doc, field, 0)}
+	return {role for role in roles if _parents_selected(role, roles, config.role_parents)}
+
+
+def _parents_selected(role: str, roles: Set[str], role_parents: Dict[str, str]) -> bool:
+	seen = {role}
+	parent = role_parents.get(role)
+	while parent and parent not in seen:
+		if parent not in roles:
+			return False
+		seen.add(parent)
+		parent = role_parents.get(parent)
+	return True
 
 
 def _get_latest_onboarding_for_company(company_name: str):
+	form = _get_latest_approved_form(company_name)
+	if not form:
+		return None
+	return frappe.get_doc("Onboarding Form", form.name)
+
+
+class AccessPlan:
+	"""Complete access state for one company, computed from the access config.
+
+	Building a plan only reads. `apply_access_plan` then writes roles, read-only
+	docperms, user roles and module blocks, workspace gating and private pages
+	in one pass. Applied plans are cached per company (see `get_cached_access_plan`)
+	so new users only need their own delta.
+	"""
+
+	def __init__(
+		self,
+		company_name: str,
+		form_name: str,
+		form_modified: str,
+		selected_roles: Set[str],
+		unit_type_by_email: Dict[str, str],
+		config: frappe._dict,
+		modules_to_unblock: Optional[Set[str]] = None,
+		workspaces: Optional["_WorkspaceState"] = None,
+	):
+		self.company_name = company_name
+		self.form_name = form_name
+		self.form_modified = form_modified
+		self.config = config
+		self.scope_roles = set(config.role_map.values())
+		self.selected_roles = set(selected_roles)
+		self.unit_type_by_email = unit_type_by_email
+		self.required_roles = self.selected_roles | self.scope_roles | config.always_allowed_roles
+		self.docperm_roles = self.selected_roles | config.always_allowed_roles
+		self._workspaces = workspaces
+		# Prepared by `prepare_access_plan`, executed by `apply_access_plan`
+		self.diff = None
+		if modules_to_unblock is None:
+			modules_to_unblock = (
+				_get_modules_for_roles(self.selected_roles, config, self.workspaces) if self.selected_roles else set()
+			)
+		self.modules_to_unblock = set(modules_to_unblock)
+
+	@property
+	def workspaces(self) -> "_WorkspaceState":
+		"""Workspace index shared by every step of the sweep, loaded on first use."""
+		if self._workspaces is None:
+			self._workspaces = _WorkspaceState()
+		return self._workspaces
+
+	@property
+	def version(self) -> List[str]:
+		return [self.form_name, self.form_modified, _config_fingerprint(self.config)]
+
+	def as_cache(self) -> Dict:
+		return {
+			"version": self.version,
+			"selected_roles": sorted(self.selected_roles),
+			"modules_to_unblock": sorted(self.modules_to_unblock),
+			"unit_type_by_email": self.unit_type_by_email,
+		}
+
+
+def _config_fingerprint(config: frappe._dict) -> str:
+	# Sets (top-level and nested) serialize as sorted lists
+	return hashlib.sha1(json.dumps(config, sort_keys=True, default=sorted).encode()).hexdigest()
+
+
+def _access_plan_cache_key(company_name: str) -> str:
+	return f"climoro_access_plan:{company_name}"
+
+
+def _get_latest_approved_form(company_name: str) -> Optional[Dict]:
 	if not company_name:
 		return None
 	record = frappe.get_all(
 		"Onboarding Form",
 		filters={"company_name": company_name, "status": "Approved"},
-		fields=["name"],
+		fields=["name", "modified"],
 		order_by="modified desc",
 		limit=1,
 	)
-	if not record:
+	return record[0] if record else None
+
+
+def build_access_plan(company_name: str) -> Optional[AccessPlan]:
+	"""Plan for the company's latest approved Onboarding Form, or None when
+	there is no approved form or it selects no scopes.
+	"""
+	onboarding = _get_latest_onboarding_for_company(company_name)
+	if not onboarding:
 		return None
-	return frappe.get_doc("Onboarding Form", record[0]["name"])
+	return plan_from_onboarding(company_name, onboarding)
+
+
+def plan_from_onboarding(company_name: str, onboarding) -> Optional[AccessPlan]:
+	"""Plan for the given (possibly not yet saved) Onboarding Form document."""
+	config = _access_config()
+	selected_roles = _derive_roles_from_onboarding(onboarding, config)
+	if not selected_roles:
+		return None
+	return AccessPlan(
+		company_name,
+		onboarding.name,
+		str(onboarding.modified),
+		selected_roles,
+		_build_unit_type_index(onboarding),
+		config,
+	)
 
 
-def _sync_user_scope_roles(user_doc, desired_scope_roles: Set[str]) -> None:
-	"""Ensure the user's scope-related roles match the desired set.
-	Non-scope roles are preserved. Removes obsolete scope roles and adds missing ones.
+def get_cached_access_plan(company_name: str) -> Optional[AccessPlan]:
+	"""The company's last applied plan, if it still matches the latest approved
+	form (name and modified) and the current access config.
 	"""
-	current_roles = {row.role for row in (user_doc.roles or [])}
-	all_scope_roles = set(ROLE_MAP.values())
-	# Remove obsolete scope roles
-	to_remove = (current_roles & all_scope_roles) - desired_scope_roles
-	if to_remove:
-		user_doc.set(
-			"roles",
-			[row for row in (user_doc.roles or []) if row.role not in to_remove]
+	form = _get_latest_approved_form(company_name)
+	if not form:
+		return None
+	cached = frappe.cache().get_value(_access_plan_cache_key(company_name))
+	if not cached:
+		return None
+	config = _access_config()
+	if cached.get("version") != [form.name, str(form.modified), _config_fingerprint(config)]:
+		return None
+	return AccessPlan(
+		company_name,
+		form.name,
+		str(form.modified),
+		set(cached["selected_roles"]),
+		cached.get("unit_type_by_email") or {},
+		config,
+		modules_to_unblock=set(cached["modules_to_unblock"]),
+	)
+
+
+def invalidate_access_plan(company_name: str) -> None:
+	if company_name:
+		frappe.cache().delete_value(_access_plan_cache_key(company_name))
+
+
+def prepare_access_plan(plan: AccessPlan, users: Optional[List[Dict]] = None, force: bool = False) -> frappe._dict:
+	"""Compute every change `apply_access_plan` would write, without writing.
+
+	The diff is kept on the plan (`plan.diff`), so applying the plan afterwards
+	does not recompute anything. The workspace part lives in the plan's
+	workspace index as pending changes.
+	"""
+	config = plan.config
+	if users is None:
+		users = frappe.get_all(
+			"User",
+			filters={"company": plan.company_name, "enabled": 1},
+			fields=["name", "email"],
 		)
-	# Add missing desired roles
-	to_add = desired_scope_roles - {row.role for row in (user_doc.roles or [])}
-	for role in to_add:
-		user_doc.append("roles", {"role": role})
-	if to_remove or to_add:
-		user_doc.save(ignore_permissions=True)
+	user_names = [u["name"] for u in users]
 
+	roles_to_create = _missing_roles(plan.required_roles | {config.hidden_role})
+	docperms_to_add = _missing_readonly_docperms(plan.docperm_roles, config, set(roles_to_create))
+	user_diff = _diff_company_users(users, plan)
+
+	# Workspace gating is mutated in the index only; skipped when the fingerprint matches
+	sweep_fingerprint = _plan_workspace_restrictions(plan.selected_roles, config, plan.workspaces, force)
+	if not sweep_fingerprint and config.hidden_role in roles_to_create:
+		roles_to_create.remove(config.hidden_role)
+
+	private_pages = _find_disallowed_private_pages(user_names, plan.selected_roles, config, plan.workspaces)
+
+	plan.diff = frappe._dict(
+		users=user_names,
+		roles_to_create=roles_to_create,
+		docperms_to_add=docperms_to_add,
+		user=user_diff,
+		sweep_fingerprint=sweep_fingerprint,
+		private_pages=private_pages,
+	)
+	return plan.diff
+
+
+def apply_access_plan(plan: AccessPlan, users: Optional[List[Dict]] = None) -> None:
+	"""Apply the plan to the given users (default: all enabled company users).
+
+	A diff prepared earlier with `prepare_access_plan` is executed as-is.
+	"""
+	diff = plan.diff
+	if diff is None or (users is not None and diff.users != [u["name"] for u in users]):
+		diff = prepare_access_plan(plan, users)
+
+	_create_roles(diff.roles_to_create, plan.config.hidden_role)
+	_insert_readonly_docperms(diff.docperms_to_add)
+	_write_user_diff(diff.user)
+	plan.workspaces.commit()
+	if diff.sweep_fingerprint:
+		frappe.db.set_global(WORKSPACE_SWEEP_FINGERPRINT_KEY, diff.sweep_fingerprint)
+	if _bulk_delete_private_pages(diff.private_pages):
+		plan.workspaces.forget([p["name"] for p in diff.private_pages])
+	plan.diff = None
+
+	# Company-wide parts are in place; later users only need their own delta
+	frappe.cache().set_value(
+		_access_plan_cache_key(plan.company_name),
+		plan.as_cache(),
+		expires_in_sec=ACCESS_PLAN_CACHE_TTL,
+	)
+
+
+def access_plan_report(plan: AccessPlan) -> Dict:
+	"""Human-readable summary of a prepared plan: every diff applying it would
+	write and the rows and statements that takes.
+	"""
+	diff = plan.diff
+	if diff is None:
+		diff = prepare_access_plan(plan)
+	return {
+		"company": plan.company_name,
+		"onboarding_form": plan.form_name,
+		"selected_roles": sorted(plan.selected_roles),
+		"roles_to_create": list(diff.roles_to_create),
+		"docperms_to_add": [{"doctype": doctype, "role": role} for doctype, role in diff.docperms_to_add],
+		"user_roles": diff.user.role_changes,
+		"modules_to_unblock": diff.user.module_changes,
+		"workspace_sweep": bool(diff.sweep_fingerprint),
+		"workspaces": plan.workspaces.change_report(),
+		"private_pages_to_delete": [p["name"] for p in diff.private_pages],
+		"writes": access_plan_writes(plan),
+	}
 
-def _ensure_workspace_role_restrictions(all_possible_roles: Set[str]) -> None:
-	# Ensure each workspace has at least its mapped role + admin roles
-	roles_with_admin = all_possible_roles.union(ALWAYS_ALLOWED_ROLES)
-	for role_name in roles_with_admin:
-		workspace_label = WORKSPACE_BY_ROLE.get(role_name)
-		if not workspace_label:
-			continue
 
-		workspace_list = frappe.get_all(
+def access_plan_writes(plan: AccessPlan) -> Dict:
+	"""Rows and write statements `apply_access_plan` issues for the prepared diff,
+	taken from the diff itself.
+	"""
+	diff = plan.diff
+	if diff is None:
+		diff = prepare_access_plan(plan)
+	workspaces = plan.workspaces
+	role_changes, hidden_changes = workspaces.changes()
+	workspace_role_inserts = sum(len(roles) for roles in role_changes.values())
+	workspace_role_deletes = sum(len(workspaces._original_roles.get(name, ())) for name in role_changes)
+	private_pages = len(diff.private_pages)
+
+	statements = len(diff.roles_to_create)
+	statements += 1 if diff.docperms_to_add else 0
+	statements += sum(
+		1 for rows in (diff.user.role_rows_to_delete, diff.user.role_rows_to_insert, diff.user.block_rows_to_delete) if rows
+	)
+	if role_changes:
+		# One delete, plus one bulk insert unless every role was removed
+		statements += 1 + (1 if workspace_role_inserts else 0)
+	statements += len(hidden_changes)
+	statements += 1 if diff.sweep_fingerprint else 0
+	if private_pages:
+		# One delete per child table plus the workspaces themselves
+		statements += len(frappe.get_meta("Workspace").get_table_fields()) + 1
+	return {
+		"roles_created": len(diff.roles_to_create),
+		"custom_docperm_inserts": len(diff.docperms_to_add),
+		"has_role_inserts": len(diff.user.role_rows_to_insert) + workspace_role_inserts,
+		"has_role_deletes": len(diff.user.role_rows_to_delete) + workspace_role_deletes,
+		"block_module_deletes": len(diff.user.block_rows_to_delete),
+		"workspaces_touched": len(set(role_changes) | set(hidden_changes)),
+		"private_page_deletes": private_pages,
+		"statements": statements,
+	}
+
+
+@contextmanager
+def _counting_queries():
+	"""Count the SQL statements issued inside the block: yields a dict whose
+	`queries` is filled in as they run.
+	"""
+	counter = {"queries": 0}
+	sql = frappe.db.sql
+
+	def counted_sql(*args, **kwargs):
+		counter["queries"] += 1
+		return sql(*args, **kwargs)
+
+	frappe.db.sql = counted_sql
+	try:
+		yield counter
+	finally:
+		# Drop the instance attribute; the class method is back
+		del frappe.db.sql
+
+
+def _access_state_signature(plan: AccessPlan, workspaces: Optional["_WorkspaceState"] = None) -> str:
+	"""Hash of the state an access plan diffs against: the company's enabled
+	users with their roles and module blocks, the read-only docperms of the
+	configured doctypes, and every workspace's roles and hidden flag (as loaded
+	into `workspaces`, or read fresh).
+	"""
+	users = sorted(frappe.get_all("User", filters={"company": plan.company_name, "enabled": 1}, pluck="name"))
+	user_roles = frappe.get_all(
+		"Has Role",
+		filters={"parenttype": "User", "parent": ["in", users or [""]]},
+		fields=["parent", "role"],
+		order_by="parent asc, role asc",
+		as_list=True,
+	)
+	module_blocks = frappe.get_all(
+		"Block Module",
+		filters={"parenttype": "User", "parent": ["in", users or [""]]},
+		fields=["parent", "module"],
+		order_by="parent asc, module asc",
+		as_list=True,
+	)
+	docperms = frappe.get_all(
+		"Custom DocPerm",
+		filters={"parent": ["in", sorted(plan.config.readonly_doctypes) or [""]], "permlevel": 0},
+		fields=["parent", "role"],
+		order_by="parent asc, role asc",
+		as_list=True,
+	)
+	if workspaces is None:
+		workspaces = _WorkspaceState()
+	workspace_state = sorted(
+		(name, sorted(roles), workspaces._original_hidden.get(name, 0))
+		for name, roles in workspaces._original_roles.items()
+	)
+	return hashlib.sha1(
+		json.dumps(
+			[users, *([list(row) for row in rows] for rows in (user_roles, module_blocks, docperms)), workspace_state],
+			default=list,
+		).encode()
+	).hexdigest()
+
+
+def apply_user_delta(plan: AccessPlan, users: List[Dict]) -> None:
+	"""Apply an already-applied company plan to new users: only their scope
+	roles and module blocks change; roles, docperms and workspaces are shared.
+	"""
+	_batch_sync_company_users(users, plan)
+
+
+def _batch_sync_company_users(users: List[Dict], plan: AccessPlan) -> None:
+	"""Sync scope roles and module blocks for many users without loading User docs."""
+	_write_user_diff(_diff_company_users(users, plan))
+
+
+def _diff_company_users(users: List[Dict], plan: AccessPlan) -> frappe._dict:
+	"""Compute the scope-role and module-block changes for many users.
+
+	Reads the current `Has Role` and `Block Module` rows of all users in one query each
+	and computes the per-user diff in memory.
+	"""
+	diff = frappe._dict(
+		role_rows_to_delete=[],
+		role_rows_to_insert=[],
+		block_rows_to_delete=[],
+		role_changes={},
+		module_changes={},
+		changed_users=set(),
+	)
+	if not users:
+		return diff
+	user_names = [u["name"] for u in users]
+	email_by_user = {u["name"]: (u.get("email") or u["name"]) for u in users}
+	selected_roles = plan.selected_roles
+	modules_to_unblock = plan.modules_to_unblock
+	unit_type_by_email = plan.unit_type_by_email
+
+	role_rows = frappe.get_all(
+		"Has Role",
+		filters={"parenttype": "User", "parent": ["in", user_names]},
+		fields=["name", "parent", "role", "idx"],
+	)
+	current_roles: Dict[str, Dict[str, str]] = {u: {} for u in user_names}
+	max_idx: Dict[str, int] = {u: 0 for u in user_names}
+	for row in role_rows:
+		current_roles[row.parent][row.role] = row.name
+		max_idx[row.parent] = max(max_idx[row.parent], row.idx or 0)
+
+	now = frappe.utils.now()
+	session_user = frappe.session.user
+	for user in user_names:
+		user_roles = set(current_roles[user])
+		desired = _filter_roles_for_user(email_by_user[user], user_roles, selected_roles, unit_type_by_email)
+		to_remove = (user_roles & plan.scope_roles) - desired
+		to_add = desired - user_roles
+		for role in to_remove:
+			diff.role_rows_to_delete.append(current_roles[user][role])
+		for role in sorted(to_add):
+			max_idx[user] += 1
+			diff.role_rows_to_insert.append((
+				frappe.generate_hash(length=10), user, "User", "roles", max_idx[user], role,
+				session_user, now, now, session_user, 0,
+			))
+		if to_remove or to_add:
+			diff.changed_users.add(user)
+			diff.role_changes[user] = {"add": sorted(to_add), "remove": sorted(to_remove)}
+
+	if modules_to_unblock:
+		block_rows = frappe.get_all(
+			"Block Module",
+			filters={"parenttype": "User", "parent": ["in", user_names], "module": ["in", list(modules_to_unblock)]},
+			fields=["name", "parent", "module"],
+		)
+		for row in block_rows:
+			diff.block_rows_to_delete.append(row.name)
+			diff.changed_users.add(row.parent)
+			diff.module_changes.setdefault(row.parent, []).append(row.module)
+	return diff
+
+
+def _write_user_diff(diff: frappe._dict) -> None:
+	"""Apply a user diff as one bulk insert plus one bulk delete per child table,
+	then clear the user caches once.
+	"""
+	if diff.role_rows_to_delete:
+		frappe.db.delete("Has Role", {"name": ["in", diff.role_rows_to_delete]})
+	if diff.role_rows_to_insert:
+		frappe.db.bulk_insert(
+			"Has Role",
+			fields=["name", "parent", "parenttype", "parentfield", "idx", "role", "owner", "creation", "modified", "modified_by", "docstatus"],
+			values=diff.role_rows_to_insert,
+		)
+	if diff.block_rows_to_delete:
+		frappe.db.delete("Block Module", {"name": ["in", diff.block_rows_to_delete]})
+
+	_clear_user_caches(diff.changed_users)
+
+
+MODULE_CATALOGUE_CACHE_KEY = "climoro_module_catalogue"
+
+
+def get_module_catalogue() -> List[str]:
+	"""Names of all modules of the installed apps, cached until the next deploy.
+
+	The cache is cleared after migrate and also rebuilt when the set of
+	installed apps changes.
+	"""
+	installed_apps = frappe.get_installed_apps()
+	cached = frappe.cache().get_value(MODULE_CATALOGUE_CACHE_KEY)
+	if cached and cached.get("apps") == installed_apps:
+		return cached["modules"]
+
+	from frappe.config import get_modules_from_all_apps
+
+	modules = [m.get("module_name") for m in get_modules_from_all_apps() if m.get("module_name")]
+	frappe.cache().set_value(MODULE_CATALOGUE_CACHE_KEY, {"apps": installed_apps, "modules": modules})
+	return modules
+
+
+def clear_module_catalogue() -> None:
+	frappe.cache().delete_value(MODULE_CATALOGUE_CACHE_KEY)
+
+
+def provision_module_blocks(
+	user_names: List[str], plan: Optional[AccessPlan] = None, existing_users: Optional[Set[str]] = None
+) -> None:
+	"""Replace the `Block Module` rows of the given users with their final block
+	list: every catalogue module except the ones the access plan unblocks.
+
+	Users in `existing_users` already have access set up, possibly for another
+	company: their blocks are merged instead, only the modules the plan unblocks
+	are unblocked for them. Written as two deletes plus one bulk insert for all users.
+	"""
+	# The submitter may also be listed as a unit user
+	user_names = list(dict.fromkeys(u for u in user_names if u))
+	if not user_names:
+		return
+	unblocked = plan.modules_to_unblock if plan else set()
+	blocked = [module for module in get_module_catalogue() if module not in unblocked]
+	existing_users = set(existing_users or ()) & set(user_names)
+	new_users = [user for user in user_names if user not in existing_users]
+
+	if new_users:
+		frappe.db.delete("Block Module", {"parenttype": "User", "parent": ["in", new_users]})
+	if existing_users and unblocked:
+		frappe.db.delete(
+			"Block Module",
+			{"parenttype": "User", "parent": ["in", list(existing_users)], "module": ["in", list(unblocked)]},
+		)
+	now = frappe.utils.now()
+	session_user = frappe.session.user
+	values = []
+	for user in new_users:
+		for idx, module in enumerate(blocked, start=1):
+			values.append((
+				frappe.generate_hash(length=10), user, "User", "block_modules", idx, module,
+				session_user, now, now, session_user, 0,
+			))
+	if values:
+		frappe.db.bulk_insert(
+			"Block Module",
+			fields=["name", "parent", "parenttype", "parentfield", "idx", "module", "owner", "creation", "modified", "modified_by", "docstatus"],
+			values=values,
+		)
+	_clear_user_caches(set(user_names))
+
+
+def _clear_user_caches(user_names: Set[str]) -> None:
+	"""Drop cached roles/boot info for the given users in one round of HDELs."""
+	if not user_names:
+		return
+	from frappe.cache_manager import user_cache_keys
+
+	names = list(user_names)
+	for key in user_cache_keys:
+		frappe.cache().hdel(key, names)
+
+
+# Admin-type roles that are stripped from managed workspaces unless always-allowed
+ADMIN_ROLES = {"Super Admin", "System Manager", "Administrator"}
+
+# Background access sync: edits within this window are coalesced into one run
+ACCESS_SYNC_DEBOUNCE_SECONDS = 5
+# Upper bound for one company sweep; the single-flight lock expires after this
+ACCESS_SYNC_LOCK_TIMEOUT = 900
+# Deletes the due key only if it still holds the due time the sweep started from
+DELETE_IF_UNCHANGED_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+	return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+_delete_if_unchanged = None
+
+# Applied company plans are reused for new users for up to a day
+ACCESS_PLAN_CACHE_TTL = 24 * 60 * 60
+
+# Global default holding the fingerprint of the last applied workspace sweep
+WORKSPACE_SWEEP_FINGERPRINT_KEY = "climoro_workspace_sweep_fingerprint"
+
+
+class _WorkspaceState:
+	"""In-memory index of Workspace rows and their role gating for one sweep.
+
+	Loaded with two queries (workspaces, workspace roles) and shared by every
+	access helper of the sweep: label lookups, modules, parent pages and private
+	pages. Sweep helpers mutate this state instead of saving Workspace docs;
+	`commit()` then writes only the workspaces whose roles or hidden flag
+	actually changed.
+	"""
+
+	def __init__(self):
+		self.rows = frappe.get_all(
 			"Workspace",
-			filters={"label": workspace_label},
-			fields=["name"],
+			fields=[
+				"name", "label", "title", "icon", "sequence_id", "module", "parent_page",
+				"public", "is_hidden", "for_user", "modified",
+			],
+			order_by="modified desc",
 		)
-		if not workspace_list:
+		self.by_name: Dict[str, Dict] = {row.name: row for row in self.rows}
+		self.by_label: Dict[str, str] = {}
+		self.private_by_user: Dict[str, List[Dict]] = {}
+		for row in self.rows:
+			if row.for_user:
+				self.private_by_user.setdefault(row.for_user, []).append(row)
+			else:
+				self.by_label.setdefault(row.label, row.name)
+		self.roles: Dict[str, Set[str]] = {row.name: set() for row in self.rows}
+		for row in frappe.get_all(
+			"Has Role",
+			filters={"parenttype": "Workspace"},
+			fields=["parent", "role"],
+		):
+			if row.parent in self.roles:
+				self.roles[row.parent].add(row.role)
+		self.hidden = {row.name: int(row.is_hidden or 0) for row in self.rows}
+		self._original_roles = {name: set(roles) for name, roles in self.roles.items()}
+		self._original_hidden = dict(self.hidden)
+
+	def find(self, label: Optional[str]) -> Optional[str]:
+		return self.by_label.get(label) if label else None
+
+	def module_of(self, label: Optional[str]) -> Optional[str]:
+		name = self.find(label)
+		return self.by_name[name].module if name else None
+
+	def public_rows(self) -> List[Dict]:
+		return [row for row in self.rows if row.public]
+
+	def private_rows(self, users: List[str]) -> List[Dict]:
+		rows: List[Dict] = []
+		for user in users:
+			rows.extend(self.private_by_user.get(user, []))
+		return rows
+
+	def forget(self, names: List[str]) -> None:
+		"""Drop deleted (private) workspaces from the index."""
+		gone = set(names)
+		self.rows = [row for row in self.rows if row.name not in gone]
+		for name in gone:
+			self.by_name.pop(name, None)
+		for user, rows in self.private_by_user.items():
+			self.private_by_user[user] = [row for row in rows if row.name not in gone]
+
+	def signature(self) -> List[str]:
+		"""Cheap fingerprint of the Workspace table as loaded: row count and last modified."""
+		last_modified = max((row.modified for row in self.rows), default=None)
+		return [len(self.rows), str(last_modified)]
+
+	def get_roles(self, name: str) -> Set[str]:
+		return set(self.roles.get(name, set()))
+
+	def set_roles(self, name: str, roles: Set[str]) -> None:
+		self.roles[name] = set(roles)
+
+	def set_hidden(self, name: str, value: int) -> None:
+		self.hidden[name] = int(value)
+
+	def changes(self):
+		role_changes = {n: r for n, r in self.roles.items() if r != self._original_roles.get(n)}
+		hidden_changes = {n: v for n, v in self.hidden.items() if v != self._original_hidden.get(n)}
+		return role_changes, hidden_changes
+
+	def change_report(self) -> Dict[str, Dict]:
+		"""Pending changes per workspace: roles added/removed and the new hidden flag."""
+		role_changes, hidden_changes = self.changes()
+		report: Dict[str, Dict] = {}
+		for name, roles in role_changes.items():
+			original = self._original_roles.get(name, set())
+			report[name] = {"add_roles": sorted(roles - original), "remove_roles": sorted(original - roles)}
+		for name, value in hidden_changes.items():
+			report.setdefault(name, {})["is_hidden"] = value
+		return report
+
+	def commit(self) -> int:
+		"""Write the differing rows and clear the desk cache once. Returns the number of workspaces touched."""
+		role_changes, hidden_changes = self.changes()
+		if role_changes:
+			frappe.db.delete("Has Role", {"parenttype": "Workspace", "parent": ["in", list(role_changes)]})
+			now = frappe.utils.now()
+			values = []
+			for ws_name, roles in role_changes.items():
+				for idx, role in enumerate(sorted(roles), start=1):
+					values.append((
+						frappe.generate_hash(length=10), ws_name, "Workspace", "roles", idx, role,
+						frappe.session.user, now, now, frappe.session.user, 0,
+					))
+			if values:
+				frappe.db.bulk_insert(
+					"Has Role",
+					fields=["name", "parent", "parenttype", "parentfield", "idx", "role", "owner", "creation", "modified", "modified_by", "docstatus"],
+					values=values,
+				)
+		for ws_name, value in hidden_changes.items():
+			frappe.db.set_value("Workspace", ws_name, "is_hidden", value, update_modified=False)
+
+		touched = set(role_changes) | set(hidden_changes)
+		if touched:
+			for ws_name in touched:
+				frappe.clear_document_cache("Workspace", ws_name)
+			frappe.cache().delete_key("bootinfo")
+			invalidate_sidebar_cache()
+		self._original_roles = {name: set(roles) for name, roles in self.roles.items()}
+		self._original_hidden = dict(self.hidden)
+		return len(touched)
+
+
+def _ensure_hidden_role_exists(config: frappe._dict) -> None:
+	if not frappe.db.exists("Role", config.hidden_role):
+		role_doc = frappe.new_doc("Role")
+		role_doc.role_name = config.hidden_role
+		role_doc.desk_access = 0
+		role_doc.save(ignore_permissions=True)
+
+
+def _workspace_sweep_fingerprint(selected_roles: Set[str], config: frappe._dict, state: _WorkspaceState) -> str:
+	"""Hash of everything the workspace sweep depends on: the mappings, the
+	company selection and a cheap signature of the Workspace table.
+	"""
+	payload = {
+		"workspace_by_role": config.workspace_by_role,
+		"extra": {k: sorted(v) for k, v in config.extra_workspaces_by_role.items()},
+		"scope_roles": sorted(config.role_map.values()),
+		"always_allowed": sorted(config.always_allowed_roles),
+		"hidden_role": config.hidden_role,
+		"managed_modules": sorted(config.managed_modules),
+		"selected": sorted(selected_roles),
+		"workspaces": state.signature(),
+	}
+	return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _sync_workspace_restrictions(
+	selected_roles: Set[str],
+	config: Optional[frappe._dict] = None,
+	state: Optional[_WorkspaceState] = None,
+	force: bool = False,
+) -> int:
+	"""Bring workspace role gating and hidden flags in line with the selection.
+
+	Skipped entirely when the stored fingerprint matches. Returns the number of
+	workspaces written.
+	"""
+	config = config or _access_config()
+	state = state or _WorkspaceState()
+	fingerprint = _plan_workspace_restrictions(selected_roles, config, state, force)
+	if not fingerprint:
+		return 0
+
+	_ensure_hidden_role_exists(config)
+	touched = state.commit()
+	frappe.db.set_global(WORKSPACE_SWEEP_FINGERPRINT_KEY, fingerprint)
+	return touched
+
+
+def _plan_workspace_restrictions(
+	selected_roles: Set[str],
+	config: frappe._dict,
+	state: _WorkspaceState,
+	force: bool = False,
+) -> Optional[str]:
+	"""Apply the workspace rules to the in-memory index without writing.
+
+	Returns the fingerprint to store once the changes are committed, or None
+	when the stored fingerprint matches and the sweep can be skipped.
+	"""
+	fingerprint = _workspace_sweep_fingerprint(selected_roles, config, state)
+	if not force and frappe.db.get_global(WORKSPACE_SWEEP_FINGERPRINT_KEY) == fingerprint:
+		return None
+
+	_ensure_workspace_role_restrictions(state, set(config.role_map.values()), config)
+	_lockdown_unmanaged_workspaces(state, config)
+	# Normalize global workspace visibility; rely on role gating
+	_reset_global_hidden_flags(state, config)
+	_hide_home_workspace_for_all(state)
+	_lockdown_by_parent_page(state, selected_roles, config)
+	return fingerprint
+
+
+def _ensure_workspace_role_restrictions(state: _WorkspaceState, all_possible_roles: Set[str], config: frappe._dict) -> None:
+	# Ensure each workspace has at least its mapped role + admin roles
+	always_allowed = config.always_allowed_roles
+	roles_with_admin = all_possible_roles.union(always_allowed)
+	excluded_admin_roles = ADMIN_ROLES - always_allowed
+	for role_name in roles_with_admin:
+		ws_name = state.find(config.workspace_by_role.get(role_name))
+		if not ws_name:
 			# Workspace may not exist on this site; skip
 			continue
-
-		ws = frappe.get_doc("Workspace", workspace_list[0]["name"])
-		ws_roles = {row.role for row in (ws.roles or [])}
 		# Start with only roles we manage: scope roles + always-allowed
-		allowed_set = all_possible_roles.union(ALWAYS_ALLOWED_ROLES)
-		ws.set("roles", [r for r in (ws.roles or []) if r.role in allowed_set])
-		ws_roles = {row.role for row in (ws.roles or [])}
-		# Add required role for this workspace
-		if role_name not in ws_roles:
-			ws.append("roles", {"role": role_name})
-		# Ensure admin roles present if configured
-		for admin_role in ALWAYS_ALLOWED_ROLES:
-			if admin_role not in ws_roles:
-				ws.append("roles", {"role": admin_role})
+		roles = state.get_roles(ws_name) & roles_with_admin
+		# Add required role for this workspace and admin roles if configured
+		roles.add(role_name)
+		roles |= always_allowed
 		# Explicitly remove admin-type roles if not in always-allowed
-		if "Super Admin" not in ALWAYS_ALLOWED_ROLES:
-			ws.set("roles", [r for r in (ws.roles or []) if r.role != "Super Admin"])
-		if "System Manager" not in ALWAYS_ALLOWED_ROLES:
-			ws.set("roles", [r for r in (ws.roles or []) if r.role != "System Manager"])
-		if "Administrator" not in ALWAYS_ALLOWED_ROLES:
-			ws.set("roles", [r for r in (ws.roles or []) if r.role != "Administrator"])
-		ws.save(ignore_permissions=True)
+		state.set_roles(ws_name, roles - excluded_admin_roles)
 
 	# Ensure extra workspace-role links (e.g., Electricity -> Scope 2 Access)
-	for role_name, labels in EXTRA_WORKSPACES_BY_ROLE.items():
+	for role_name, labels in config.extra_workspaces_by_role.items():
 		for label in labels:
-			ws_list = frappe.get_all("Workspace", filters={"label": label}, fields=["name"])
-			if not ws_list:
+			ws_name = state.find(label)
+			if not ws_name:
 				continue
-			ws = frappe.get_doc("Workspace", ws_list[0]["name"])
-			ws_roles = {row.role for row in (ws.roles or [])}
 			# Keep only managed roles here as well
-			allowed_set = all_possible_roles.union(ALWAYS_ALLOWED_ROLES).union({role_name})
-			ws.set("roles", [r for r in (ws.roles or []) if r.role in allowed_set])
-			if role_name not in ws_roles:
-				ws.append("roles", {"role": role_name})
-			# Remove admin-type roles
-			if "Super Admin" not in ALWAYS_ALLOWED_ROLES:
-				ws.set("roles", [r for r in (ws.roles or []) if r.role != "Super Admin"])
-			if "System Manager" not in ALWAYS_ALLOWED_ROLES:
-				ws.set("roles", [r for r in (ws.roles or []) if r.role != "System Manager"])
-			if "Administrator" not in ALWAYS_ALLOWED_ROLES:
-				ws.set("roles", [r for r in (ws.roles or []) if r.role != "Administrator"])
-			ws.save(ignore_permissions=True)
-
-
-def _lockdown_unmanaged_workspaces() -> None:
+			roles = state.get_roles(ws_name) & roles_with_admin.union({role_name})
+			roles.add(role_name)
+			state.set_roles(ws_name, roles - excluded_admin_roles)
+
+
+def _lockdown_unmanaged_workspaces(state: _WorkspaceState, config: frappe._dict) -> None:
 	"""For workspaces under our managed modules but not in our managed label set,
 	assign a hidden role so they don't appear to anyone by default.
 	"""
-	managed_modules = {"Scope 1", "Scope 2", "Scope 3", "Reduction Factor", "climoro onboarding"}
-	managed_labels = set(WORKSPACE_BY_ROLE.values())
-	managed_labels.update({"Scope 1", "Scope 2", "Scope 3", "Reduction Factor", "Electricity"})
-	# Ensure hidden role exists
-	if not frappe.db.exists("Role", HIDDEN_ROLE):
-		role_doc = frappe.new_doc("Role")
-		role_doc.role_name = HIDDEN_ROLE
-		role_doc.desk_access = 0
-		role_doc.save(ignore_permissions=True)
+	managed_modules = config.managed_modules
+	managed_labels = set(config.workspace_by_role.values())
+	for labels in config.extra_workspaces_by_role.values():
+		managed_labels.update(labels)
 	# Sweep all public workspaces in managed modules
-	pages = frappe.get_all(
-		"Workspace",
-		fields=["name", "label", "module", "public"],
-		filters={"public": 1},
-	)
-	for p in pages:
+	for p in state.public_rows():
 		if not p.get("module") or p.get("module") not in managed_modules:
 			continue
-		label = p.get("label")
-		if label in managed_labels:
+		if p.get("label") in managed_labels:
 			continue
-		ws = frappe.get_doc("Workspace", p["name"])
 		# Replace roles with only hidden role
-		ws.set("roles", [])
-		ws.append("roles", {"role": HIDDEN_ROLE})
-		ws.save(ignore_permissions=True)
+		state.set_roles(p["name"], {config.hidden_role})
 
 
-def _lockdown_by_parent_page(selected_roles: Set[str]) -> None:
+def _lockdown_by_parent_page(state: _WorkspaceState, selected_roles: Set[str], config: frappe._dict) -> None:
 	"""Lock down any public workspaces whose parent_page is a managed root,
 	but label is not in the selected/allowed set.
 	Enhanced to handle nested hierarchies like Scope 3 -> Upstream/Downstream -> children.
 	"""
-	# Ensure hidden role exists
-	if not frappe.db.exists("Role", HIDDEN_ROLE):
-		role_doc = frappe.new_doc("Role")
-		role_doc.role_name = HIDDEN_ROLE
-		role_doc.desk_access = 0
-		role_doc.save(ignore_permissions=True)
-	
 	managed_parents = {"Scope 1", "Scope 2", "Scope 3", "Reduction Factor", "Upstream", "Downstream"}
 
 	# Compute allowed labels strictly from selected roles
-	allowed_labels = {WORKSPACE_BY_ROLE[r] for r in selected_roles if r in WORKSPACE_BY_ROLE}
-	allowed_labels.update(EXTRA_WORKSPACES_BY_ROLE.get("Scope 2 Access", set()))
-
-	# Get all workspaces to process
-	pages = frappe.get_all(
-		"Workspace",
-		fields=["name", "label", "parent_page", "public"],
-		filters={"public": 1},
-	)
-	
+	allowed_labels = {config.workspace_by_role[r] for r in selected_roles if r in config.workspace_by_role}
+	allowed_labels.update(config.extra_workspaces_by_role.get("Scope 2 Access", set()))
+
 	# Enhanced logic to handle nested hierarchies
-	for p in pages:
+	for p in state.public_rows():
 		parent = p.get("parent_page")
 		label = p.get("label")
 		
@@ -330,11 +900,8 @@ def _lockdown_by_parent_page(selected_roles: Set[str]) -> None:
 				parent_roles = ["Scope 3 Access", "Scope 3 Downstream Access"]
 			
 			if parent_roles:
-				should_be_accessible = True
 				# Grant access to the child workspace
-				ws = frappe.get_doc("Workspace", p["name"])
-				ws.set("roles", [{"role": role} for role in parent_roles])
-				ws.save(ignore_permissions=True)
+				state.set_roles(p["name"], set(parent_roles))
 				continue
 		
 		# Case 4: Upstream/Downstream workspaces themselves
@@ -342,121 +909,270 @@ def _lockdown_by_parent_page(selected_roles: Set[str]) -> None:
 			# Only grant access if user has the specific access role for this workspace
 			if (label == "Upstream" and "Scope 3 Upstream Access" in selected_roles) or \
 			   (label == "Downstream" and "Scope 3 Downstream Access" in selected_roles):
-				should_be_accessible = True
 				# Grant appropriate access
-				ws = frappe.get_doc("Workspace", p["name"])
 				if label == "Upstream":
-					ws.set("roles", [{"role": "Scope 3 Access"}, {"role": "Scope 3 Upstream Access"}])
+					state.set_roles(p["name"], {"Scope 3 Access", "Scope 3 Upstream Access"})
 				else:  # Downstream
-					ws.set("roles", [{"role": "Scope 3 Access"}, {"role": "Scope 3 Downstream Access"}])
-				ws.save(ignore_permissions=True)
+					state.set_roles(p["name"], {"Scope 3 Access", "Scope 3 Downstream Access"})
 				continue
 		
 		# If workspace should not be accessible, hide it
 		if not should_be_accessible:
-			ws = frappe.get_doc("Workspace", p["name"])
-			ws.set("roles", [])
-			ws.append("roles", {"role": HIDDEN_ROLE})
-			ws.save(ignore_permissions=True)
+			state.set_roles(p["name"], {config.hidden_role})
+
 
+# Managed roots whose private copies can expose scopes the company did not select
+PRIVATE_PAGE_MANAGED_PARENTS = {"Scope 1", "Scope 2", "Scope 3", "Reduction Factor"}
 
-def _delete_private_pages_for_users(company_name: str, selected_roles: Set[str]) -> None:
-	"""Remove private workspaces for company users that would expose disallowed pages.
-	Private pages bypass role gating in the sidebar, so we delete the ones under managed parents
-	that are not part of the selection.
+
+def _find_disallowed_private_pages(
+	users: List[str],
+	selected_roles: Set[str],
+	config: frappe._dict,
+	state: Optional[_WorkspaceState] = None,
+) -> List[Dict]:
+	"""Private workspaces of the given users that sit under a managed parent but
+	are not part of the selection. Uses the sweep's workspace index when given,
+	otherwise one query over `for_user IN (...)`.
 	"""
-	users = frappe.get_all("User", filters={"company": company_name, "enabled": 1}, pluck="name")
 	if not users:
-		return
+		return []
 	# Build allow set like in parent lockdown
-	allowed_labels = {WORKSPACE_BY_ROLE[r] for r in selected_roles if r in WORKSPACE_BY_ROLE}
-	allowed_labels.update(EXTRA_WORKSPACES_BY_ROLE.get("Scope 2 Access", set()))
-	managed_parents = {"Scope 1", "Scope 2", "Scope 3", "Reduction Factor"}
-	for uname in users:
-		privs = frappe.get_all(
+	allowed_labels = {config.workspace_by_role[r] for r in selected_roles if r in config.workspace_by_role}
+	allowed_labels.update(config.extra_workspaces_by_role.get("Scope 2 Access", set()))
+	if state is not None:
+		candidates = [p for p in state.private_rows(users) if p.get("parent_page") in PRIVATE_PAGE_MANAGED_PARENTS]
+	else:
+		candidates = frappe.get_all(
 			"Workspace",
-			fields=["name", "title", "label", "parent_page"],
-			filters={"for_user": uname},
+			filters={
+				"for_user": ["in", users],
+				"parent_page": ["in", list(PRIVATE_PAGE_MANAGED_PARENTS)],
+			},
+			fields=["name", "title", "label", "parent_page", "for_user"],
 		)
-		for p in privs:
-			parent = p.get("parent_page")
-			label = p.get("label") or p.get("title")
-			if parent in managed_parents and label not in allowed_labels and label != parent:
-				try:
-					frappe.delete_doc("Workspace", p["name"], ignore_permissions=True, force=True)
-				except Exception:
-					pass
-
-
-def _ensure_readonly_docperms_for_roles(role_names: Set[str]) -> None:
-	for doctype in READONLY_DOCTYPES:
-		for role in role_names.union(ALWAYS_ALLOWED_ROLES):
-			try:
-				# Skip if role does not exist
-				if not frappe.db.exists("Role", role):
-					continue
-				exists = frappe.get_all(
-					"Custom DocPerm",
-					filters={"parent": doctype, "role": role, "permlevel": 0},
-					limit=1,
-				)
-				if not exists:
-					c = frappe.new_doc("Custom DocPerm")
-					c.parent = doctype
-					c.parenttype = "DocType"
-					c.parentfield = "permissions"
-					c.role = role
-					c.permlevel = 0
-					c.read = 1
-					c.print = 1
-					c.report = 1
-					c.write = 0
-					c.create = 0
-					c.delete = 0
-					c.submit = 0
-					c.email = 0
-					c.share = 0
-					c.save(ignore_permissions=True)
-			except Exception as e:
-				frappe.log_error(f"Error ensuring readonly perms for {doctype}/{role}: {str(e)}")
+	pages = []
+	for p in candidates:
+		label = p.get("label") or p.get("title")
+		if label not in allowed_labels and label != p.get("parent_page"):
+			pages.append(p)
+	return pages
 
 
-def assign_roles_for_company_based_on_onboarding(company_name: str) -> None:
-	onboarding = _get_latest_onboarding_for_company(company_name)
-	if not onboarding:
-		return
+def _bulk_delete_private_pages(pages: List[Dict]) -> int:
+	"""Delete private workspaces and their child rows with one statement per table."""
+	if not pages:
+		return 0
+	names = [p["name"] for p in pages]
+	for table_field in frappe.get_meta("Workspace").get_table_fields():
+		frappe.db.delete(table_field.options, {"parenttype": "Workspace", "parent": ["in", names]})
+	frappe.db.delete("Workspace", {"name": ["in", names]})
+	for name in names:
+		frappe.clear_document_cache("Workspace", name)
+	frappe.cache().delete_key("bootinfo")
+	_clear_user_caches({p["for_user"] for p in pages if p.get("for_user")})
+	return len(names)
 
-	selected_roles = _derive_roles_from_onboarding(onboarding)
-	if not selected_roles:
-		return
 
-	_ensure_roles_exist(selected_roles)
-	# Ensure all managed workspaces have role restrictions
-	all_scope_roles = set(ROLE_MAP.values())
-	_ensure_roles_exist(all_scope_roles)
-	_ensure_workspace_role_restrictions(all_scope_roles)
-	_lockdown_unmanaged_workspaces()
-	_ensure_readonly_docperms_for_roles(selected_roles)
+@frappe.whitelist()
+def cleanup_private_workspaces(company_name: str, dry_run=1):
+	"""Report (and unless dry_run, delete) private workspaces of a company's users
+	that expose scopes outside its approved selection.
+	"""
+	frappe.only_for("System Manager")
+	try:
+		plan = build_access_plan(company_name)
+		if not plan:
+			return {
+				"success": False,
+				"message": f"No approved onboarding selection found for {company_name}"
+			}
+		users = frappe.get_all("User", filters={"company": company_name, "enabled": 1}, pluck="name")
+		pages = _find_disallowed_private_pages(users, plan.selected_roles, plan.config)
+		dry_run = frappe.utils.cint(dry_run)
+		deleted = 0 if dry_run else _bulk_delete_private_pages(pages)
+		return {
+			"success": True,
+			"dry_run": bool(dry_run),
+			"users_checked": len(users),
+			"deleted": deleted,
+			"pages": [
+				{
+					"name": p["name"],
+					"for_user": p.get("for_user"),
+					"label": p.get("label") or p.get("title"),
+					"parent_page": p.get("parent_page"),
+				}
+				for p in pages
+			],
+		}
+	except Exception as e:
+		frappe.log_error(f"Error cleaning up private workspaces for {company_name}: {str(e)}")
+		return {
+			"success": False,
+			"message": f"Error cleaning up private workspaces: {str(e)}"
+		}
+
+
+ACCESS_PREVIEW_TTL = 900
+
 
-	modules_to_unblock = _get_modules_for_roles(selected_roles)
+def _access_preview_cache_key(preview_id: str) -> str:
+	return f"climoro_access_preview:{preview_id}"
 
-	users = frappe.get_all(
-		"User",
-		filters={"company": company_name, "enabled": 1},
-		fields=["name"],
+
+@frappe.whitelist()
+def preview_company_access(company_name: str):
+	"""Plan a company's access sync without writing and report the role,
+	workspace, module and docperm diffs, the rows and write statements applying
+	them takes, and the queries planning took.
+
+	The prepared plan is kept for `ACCESS_PREVIEW_TTL` seconds so it can be
+	applied with `apply_company_access_preview` without recomputing it.
+	"""
+	frappe.only_for("System Manager")
+	try:
+		with _counting_queries() as counter:
+			plan = build_access_plan(company_name)
+			if plan:
+				prepare_access_plan(plan)
+		if not plan:
+			return {
+				"success": False,
+				"message": f"No approved onboarding selection found for {company_name}"
+			}
+		# The rows the plan was diffed against; apply refuses if they move
+		state_signature = _access_state_signature(plan, plan.workspaces)
+		preview_id = frappe.generate_hash(length=12)
+		frappe.cache().set_value(
+			_access_preview_cache_key(preview_id),
+			{"plan": plan, "state_signature": state_signature},
+			expires_in_sec=ACCESS_PREVIEW_TTL,
+		)
+		report = access_plan_report(plan)
+		report["planning_queries"] = counter["queries"]
+		return {"success": True, "preview_id": preview_id, "plan": report}
+	except Exception as e:
+		frappe.log_error(f"Error previewing access for {company_name}: {str(e)}")
+		return {
+			"success": False,
+			"message": f"Error previewing access: {str(e)}"
+		}
+
+
+@frappe.whitelist(methods=["POST"])
+def apply_company_access_preview(preview_id: str):
+	"""Apply a plan prepared by `preview_company_access`. Refuses stale previews:
+	the onboarding form, the access configuration, the company's users, their
+	roles or module blocks, the read-only docperms or the workspace roles
+	changed since planning.
+	"""
+	frappe.only_for("System Manager")
+	key = _access_preview_cache_key(preview_id)
+	preview = frappe.cache().get_value(key)
+	if not preview:
+		return {"success": False, "message": "Preview not found or expired"}
+	plan = preview["plan"]
+	try:
+		latest = _get_latest_approved_form(plan.company_name)
+		if not latest or plan.version != [latest.name, str(latest.modified), _config_fingerprint(_access_config())]:
+			frappe.cache().delete_value(key)
+			return {"success": False, "message": "Onboarding selection or access configuration changed; preview again"}
+		if _access_state_signature(plan) != preview["state_signature"]:
+			frappe.cache().delete_value(key)
+			return {
+				"success": False,
+				"message": "Company users, their roles or module blocks, docperms or workspace roles changed; preview again",
+			}
+		report = access_plan_report(plan)
+		with _counting_queries() as counter:
+			apply_access_plan(plan)
+		report["queries"] = counter["queries"]
+		frappe.cache().delete_value(key)
+		return {"success": True, "applied": report}
+	except Exception as e:
+		frappe.log_error(f"Error applying access preview {preview_id}: {str(e)}")
+		return {
+			"success": False,
+			"message": f"Error applying access preview: {str(e)}"
+		}
+
+
+def _ensure_readonly_docperms_for_roles(role_names: Set[str], config: frappe._dict) -> int:
+	"""Grant read/print/report on the read-only doctypes to the given roles.
+	Returns the number of Custom DocPerm rows inserted.
+	"""
+	try:
+		missing = _missing_readonly_docperms(role_names, config)
+		_insert_readonly_docperms(missing)
+		return len(missing)
+	except Exception as e:
+		frappe.log_error(f"Error ensuring readonly perms for {', '.join(sorted(config.readonly_doctypes))}: {str(e)}")
+		return 0
+
+
+def _missing_readonly_docperms(role_names: Set[str], config: frappe._dict, pending_roles: Optional[Set[str]] = None) -> List[tuple]:
+	"""(doctype, role) pairs that still need a read-only Custom DocPerm.
+
+	Reads existing roles and permissions with one query each. Roles in
+	`pending_roles` are about to be created and count as existing.
+	"""
+	roles = set(role_names) | config.always_allowed_roles
+	doctypes = sorted(config.readonly_doctypes)
+	if not roles or not doctypes:
+		return []
+	# Skip roles that do not exist
+	existing_roles = set(frappe.get_all("Role", filters={"name": ["in", list(roles)]}, pluck="name"))
+	existing_roles |= roles & (pending_roles or set())
+	if not existing_roles:
+		return []
+	existing = {
+		(row.parent, row.role)
+		for row in frappe.get_all(
+			"Custom DocPerm",
+			filters={"parent": ["in", doctypes], "role": ["in", list(existing_roles)], "permlevel": 0},
+			fields=["parent", "role"],
+		)
+	}
+	return [
+		(doctype, role)
+		for doctype in doctypes
+		for role in sorted(existing_roles)
+		if (doctype, role) not in existing
+	]
+
+
+def _insert_readonly_docperms(missing: List[tuple]) -> None:
+	"""Insert the permissions in one bulk insert and clear each affected doctype's cache once."""
+	if not missing:
+		return
+	now = frappe.utils.now()
+	session_user = frappe.session.user
+	frappe.db.bulk_insert(
+		"Custom DocPerm",
+		fields=[
+			"name", "parent", "parenttype", "parentfield", "role", "permlevel",
+			"read", "print", "report", "write", "create", "delete", "submit", "email", "share",
+			"owner", "creation", "modified", "modified_by", "docstatus",
+		],
+		values=[
+			(
+				frappe.generate_hash(length=10), doctype, "DocType", "permissions", role, 0,
+				1, 1, 1, 0, 0, 0, 0, 0, 0,
+				session_user, now, now, session_user, 0,
+			)
+			for doctype, role in missing
+		],
 	)
-	for u in users:
-		user_doc = frappe.get_doc("User", u["name"])
-		# Apply unit-based role filtering for non-Super Admin users
-		user_selected_roles = _filter_roles_by_unit_assignment(user_doc, selected_roles, onboarding)
-		_sync_user_scope_roles(user_doc, user_selected_roles)
-		_unblock_modules_for_user(user_doc, modules_to_unblock)
+	for doctype in sorted({doctype for doctype, _ in missing}):
+		frappe.clear_cache(doctype=doctype)
 
-	# Normalize global workspace visibility; rely on role gating
-	_reset_global_hidden_flags()
-	_hide_home_workspace_for_all()
-	_lockdown_by_parent_page(selected_roles)
-	_delete_private_pages_for_users(company_name, selected_roles)
+
+def assign_roles_for_company_based_on_onboarding(company_name: str) -> None:
+	plan = build_access_plan(company_name)
+	if not plan:
+		return
+	apply_access_plan(plan)
 
 
 def assign_roles_to_new_user(doc, method=None):
@@ -467,130 +1183,99 @@ def assign_roles_to_new_user(doc, method=None):
 		company_name = getattr(doc, "company", None)
 		if not company_name:
 			return
-		onboarding = _get_latest_onboarding_for_company(company_name)
-		if not onboarding:
+		users = [{"name": doc.name, "email": doc.email}]
+		plan = get_cached_access_plan(company_name)
+		if plan:
+			apply_user_delta(plan, users)
 			return
-		selected_roles = _derive_roles_from_onboarding(onboarding)
-		if not selected_roles:
+		plan = build_access_plan(company_name)
+		if not plan:
 			return
-		_ensure_roles_exist(selected_roles)
-		all_scope_roles = set(ROLE_MAP.values())
-		_ensure_roles_exist(all_scope_roles)
-		_ensure_workspace_role_restrictions(all_scope_roles)
-		_lockdown_unmanaged_workspaces()
-		_ensure_readonly_docperms_for_roles(selected_roles)
-
-		user_doc = frappe.get_doc("User", doc.name)
-		_sync_user_scope_roles(user_doc, selected_roles)
-		modules_to_unblock = _get_modules_for_roles(selected_roles)
-		_unblock_modules_for_user(user_doc, modules_to_unblock)
-		# Normalize global visibility
-		_reset_global_hidden_flags()
-		_hide_home_workspace_for_all()
-		_lockdown_by_parent_page(selected_roles)
+		apply_access_plan(plan, users=users)
 	except Exception as e:
 		frappe.log_error(f"Error in assign_roles_to_new_user: {str(e)}")
 
 
 def setup_workspace_roles_for_all():
 	"""Utility: ensure that workspaces have correct role restrictions for all
-	possible roles defined by ROLE_MAP. Can be called manually if needed.
+	possible roles defined by the access config. Can be called manually if needed.
 	"""
-	all_roles = set(ROLE_MAP.values())
-	_ensure_roles_exist(all_roles)
-	_ensure_workspace_role_restrictions(all_roles)
-	_ensure_readonly_docperms_for_roles(all_roles)
+	config = _access_config()
+	all_roles = set(config.role_map.values())
+	_ensure_roles_exist(all_roles | config.always_allowed_roles)
+	state = _WorkspaceState()
+	_ensure_workspace_role_restrictions(state, all_roles, config)
+	if state.commit():
+		# Partial sweep changed the state the stored fingerprint describes
+		frappe.db.set_global(WORKSPACE_SWEEP_FINGERPRINT_KEY, "")
+	_ensure_readonly_docperms_for_roles(all_roles, config)
 
 
-def _get_modules_for_roles(role_names: Set[str]) -> Set[str]:
+def _get_modules_for_roles(role_names: Set[str], config: frappe._dict, state: Optional[_WorkspaceState] = None) -> Set[str]:
+	state = state or _WorkspaceState()
 	modules: Set[str] = set()
 	for role in role_names:
-		ws_label = WORKSPACE_BY_ROLE.get(role)
+		ws_label = config.workspace_by_role.get(role)
 		if not ws_label:
 			continue
-		ws_list = frappe.get_all("Workspace", filters={"label": ws_label}, fields=["name", "module"])
-		if ws_list:
-			ws_doc = frappe.get_doc("Workspace", ws_list[0]["name"])
-			if ws_doc.module:
-				modules.add(ws_doc.module)
+		ws_module = state.module_of(ws_label)
+		if ws_module:
+			modules.add(ws_module)
 		# Add explicit module mapping if present
-		explicit = MODULES_BY_ROLE.get(role)
+		explicit = config.modules_by_role.get(role)
 		if explicit:
 			modules.update(explicit)
 	# Always ensure parent module for Scope 3 children is included if present
 	return modules
 
 
-def _unblock_modules_for_user(user_doc, modules_to_unblock: Set[str]) -> None:
-	if not modules_to_unblock:
-		return
-	initial_count = len(user_doc.block_modules or [])
-	remaining = []
-	for row in user_doc.block_modules or []:
-		if row.module in modules_to_unblock:
-			continue
-		remaining.append(row)
-	if len(remaining) != initial_count:
-		user_doc.set("block_modules", remaining)
-		user_doc.save(ignore_permissions=True)
-
-
-def _reset_global_hidden_flags():
-	"""Ensure standard workspaces are visible globally (except 'Home' handled separately),
+def _reset_global_hidden_flags(state: _WorkspaceState, config: frappe._dict):
+	"""Ensure managed workspaces are visible globally (except 'Home' handled separately),
 	so that role restrictions drive visibility per user/company.
 	"""
-	labels = [
-		"Scope 1", "Scope 2", "Scope 3", "Reduction Factor",
-		"Stationary Emissions", "Mobile Combustion", "Fugitives", "Process",
-		"Upstream", "Downstream",
-		"Energy Efficiency", "Solar", "Process Optimization", "Waste Manage", "Transportation-Upstream", "Methane Recovery",
-	]
-	for label in labels:
-		ws = frappe.get_all("Workspace", filters={"label": label}, fields=["name","is_hidden"], limit=1)
-		if not ws:
-			continue
-		doc = frappe.get_doc("Workspace", ws[0]["name"])
-		if int(doc.is_hidden or 0) != 0:
-			doc.is_hidden = 0
-			doc.save(ignore_permissions=True)
+	for label in sorted(set(config.workspace_by_role.values())):
+		ws_name = state.find(label)
+		if ws_name:
+			state.set_hidden(ws_name, 0)
 
 
-def _hide_home_workspace_for_all():
-	ws = frappe.get_all("Workspace", filters={"label": "Home"}, fields=["name","is_hidden"], limit=1)
-	if not ws:
+def _hide_home_workspace_for_all(state: _WorkspaceState):
+	ws_name = state.find("Home")
+	if not ws_name:
 		return
-	doc = frappe.get_doc("Workspace", ws[0]["name"])
 	# Hide globally and clear roles so it won't appear for anyone
-	doc.is_hidden = 1
-	doc.set("roles", [])
-	doc.save(ignore_permissions=True)
+	state.set_hidden(ws_name, 1)
+	state.set_roles(ws_name, set())
 
 
 def _filter_roles_by_unit_assignment(user_doc, selected_roles: Set[str], onboarding_doc) -> Set[str]:
 	"""Filter roles based on user's unit assignment and unit type.
 	Super Admins get all selected roles, others get filtered based on their unit type."""
-	
-	# Check if user is Super Admin - they get everything
 	user_roles = {row.role for row in (user_doc.roles or [])}
+	return _filter_roles_for_user(
+		user_doc.email, user_roles, selected_roles, _build_unit_type_index(onboarding_doc)
+	)
+
+
+def _build_unit_type_index(onboarding_doc) -> Dict[str, str]:
+	"""Map assigned user email -> unit type for the onboarding form, in one pass."""
+	unit_types = {}
+	for unit in getattr(onboarding_doc, "units", None) or []:
+		unit_types.setdefault(unit.name_of_unit, getattr(unit, 'type_of_unit', None))
+	index: Dict[str, str] = {}
+	for assigned_user in getattr(onboarding_doc, "assigned_users", None) or []:
+		if assigned_user.email and assigned_user.email not in index:
+			index[assigned_user.email] = unit_types.get(assigned_user.assigned_unit)
+	return index
+
+
+def _filter_roles_for_user(user_email: str, user_roles: Set[str], selected_roles: Set[str], unit_type_by_email: Dict[str, str]) -> Set[str]:
+	# Check if user is Super Admin - they get everything
 	if "Super Admin" in user_roles:
 		return selected_roles
 	
 	# For non-Super Admin users, filter based on unit assignment
-	user_email = user_doc.email
-	user_unit_type = None
-	
-	# Find the user's unit assignment in the onboarding form
-	if hasattr(onboarding_doc, 'assigned_users') and onboarding_doc.assigned_users:
-		for assigned_user in onboarding_doc.assigned_users:
-			if assigned_user.email == user_email:
-				# Find the corresponding unit to get the unit type
-				unit_name = assigned_user.assigned_unit
-				if hasattr(onboarding_doc, 'units') and onboarding_doc.units:
-					for unit in onboarding_doc.units:
-						if unit.name_of_unit == unit_name:
-							user_unit_type = getattr(unit, 'unit_type', None)
-							break
-				break
+	user_unit_type = unit_type_by_email.get(user_email)
 	
 	if not user_unit_type:
 		# If no unit assignment found, return basic roles (no scope-specific restrictions)
@@ -616,12 +1301,158 @@ def _filter_roles_by_unit_assignment(user_doc, selected_roles: Set[str], onboard
 
 def sync_onboarding_selection(doc, method=None):
 	"""DocEvent hook: whenever Onboarding Form is updated, if it's Approved,
-	re-apply roles, and normalize global visibility to avoid cross-company impact.
+	schedule a background re-apply of roles and global visibility for its company.
 	"""
 	try:
+		# Any edit may change the company's selections; drop the cached plan
+		invalidate_access_plan(getattr(doc, "company_name", None))
 		if getattr(doc, "status", "") == "Approved" and getattr(doc, "company_name", None):
-			assign_roles_for_company_based_on_onboarding(doc.company_name)
+			enqueue_company_access_sync(doc.company_name)
 	except Exception as e:
 		frappe.log_error(f"Error in sync_onboarding_selection: {str(e)}")
 
 
+def _access_sync_due_key(company_name: str) -> str:
+	return f"climoro_access_sync_due:{company_name}"
+
+
+def enqueue_company_access_sync(company_name: str) -> None:
+	"""Schedule a debounced access sweep for the company.
+
+	Every call pushes the due time forward; the job is deduplicated per company,
+	so a burst of edits results in a single sweep once the burst settles.
+	"""
+	if not company_name:
+		return
+	frappe.cache().set_value(
+		_access_sync_due_key(company_name),
+		time.time() + ACCESS_SYNC_DEBOUNCE_SECONDS,
+		expires_in_sec=ACCESS_SYNC_LOCK_TIMEOUT,
+	)
+	frappe.enqueue(
+		"climoro_onboarding.climoro_onboarding.ghg_workspace_access.run_company_access_sync",
+		queue="short",
+		job_id=f"climoro_access_sync::{company_name}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		company_name=company_name,
+	)
+
+
+def run_company_access_sync(company_name: str) -> None:
+	"""Background job: wait out the debounce window, then sweep the company.
+
+	A Redis lock makes the sweep single-flight per company across workers. Edits
+	that arrive while a sweep is running move the due time again, and the lock
+	holder runs one more pass instead of a second worker starting in parallel:
+	the due key is only deleted if it still holds the due time the pass read.
+	"""
+	global _delete_if_unchanged
+	cache = frappe.cache()
+	due_key = cache.make_key(_access_sync_due_key(company_name))
+	if _delete_if_unchanged is None:
+		_delete_if_unchanged = cache.register_script(DELETE_IF_UNCHANGED_SCRIPT)
+	lock = cache.lock(
+		cache.make_key(f"climoro_access_sync_lock:{company_name}"),
+		timeout=ACCESS_SYNC_LOCK_TIMEOUT,
+	)
+	if not lock.acquire(blocking=False):
+		# Another worker owns this company; it will pick up the new due time
+		return
+	try:
+		while True:
+			# Raw read: the compare below needs the stored bytes, not the unpickled value
+			raw_due = cache.execute_command("GET", due_key)
+			due = pickle.loads(raw_due) if raw_due is not None else None
+			if due is not None and float(due) > time.time():
+				time.sleep(min(float(due) - time.time(), ACCESS_SYNC_DEBOUNCE_SECONDS))
+				continue
+			_run_company_access_sweep(company_name)
+			frappe.db.commit()
+			if raw_due is None or _delete_if_unchanged(keys=[due_key], args=[raw_due]):
+				break
+	finally:
+		try:
+			lock.release()
+		except Exception:
+			# Lock expired while sweeping; nothing left to release
+			pass
+
+
+def _run_company_access_sweep(company_name: str) -> None:
+	assign_roles_for_company_based_on_onboarding(company_name)
+
+
+# Cached sidebar payloads, one per role-set hash
+SIDEBAR_CACHE_PREFIX = "climoro_sidebar:"
+SIDEBAR_CACHE_TTL = 60 * 60
+
+
+def invalidate_sidebar_cache(doc=None, method=None) -> None:
+	"""Drop every cached sidebar payload. Called by access sweeps and as a
+	Workspace doc event, so desk edits show up without waiting for the TTL.
+	"""
+	frappe.cache().delete_keys(SIDEBAR_CACHE_PREFIX)
+
+
+def _visible_workspace_tree(roles: Set[str]) -> List[Dict]:
+	"""Public, non-hidden workspaces visible to the role set, nested by parent page."""
+	state = _WorkspaceState()
+	see_all = "Administrator" in roles
+	visible: Dict[str, Dict] = {}
+	for row in state.rows:
+		if row.for_user or not row.public or state.hidden.get(row.name):
+			continue
+		ws_roles = state.roles.get(row.name) or set()
+		if ws_roles and not see_all and not (ws_roles & roles):
+			continue
+		visible[row.name] = {
+			"name": row.name,
+			"label": row.label,
+			"title": row.title or row.label,
+			"icon": row.icon,
+			"parent_page": row.parent_page or None,
+			"sequence_id": row.sequence_id or 0,
+			"children": [],
+		}
+
+	by_label = {node["label"]: node for node in visible.values()}
+	tree: List[Dict] = []
+	for node in sorted(visible.values(), key=lambda n: (n["sequence_id"], n["label"] or "")):
+		parent = node["parent_page"]
+		if not parent:
+			tree.append(node)
+			continue
+		parent_node = visible.get(parent) or by_label.get(parent)
+		# Children of a page the role set cannot see stay hidden as well
+		if parent_node:
+			parent_node["children"].append(node)
+	return tree
+
+
+@frappe.whitelist()
+def get_visible_workspaces():
+	"""Workspace sidebar tree for the session user's role set.
+
+	Computed once per role set and cached until the next access sweep or
+	Workspace change. Honours If-None-Match and answers 304 when unchanged.
+	"""
+	roles = sorted(set(frappe.get_roles()))
+	role_hash = hashlib.sha1(json.dumps(roles).encode()).hexdigest()
+	cache_key = f"{SIDEBAR_CACHE_PREFIX}{role_hash}"
+	payload = frappe.cache().get_value(cache_key)
+	if not payload:
+		workspaces = _visible_workspace_tree(set(roles))
+		etag = hashlib.sha1(json.dumps([role_hash, workspaces], sort_keys=True).encode()).hexdigest()
+		payload = {"etag": f'"{etag}"', "workspaces": workspaces}
+		frappe.cache().set_value(cache_key, payload, expires_in_sec=SIDEBAR_CACHE_TTL)
+
+	response_headers = getattr(frappe.local, "response_headers", None)
+	if response_headers is not None:
+		response_headers.set("ETag", payload["etag"])
+		response_headers.set("Cache-Control", "private, no-cache")
+
+	if frappe.get_request_header("If-None-Match") == payload["etag"]:
+		frappe.local.response.http_status_code = 304
+		return None
+	return payload
@@ -0,0 +1,14 @@
+import frappe
+
+from climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form import (
+    ensure_company_abbr_index,
+)
+
+def execute():
+    """Enforce unique company abbreviations in the database, so concurrent
+    onboarding approvals cannot both claim the same abbreviation.
+
+    Also runs after install and every migrate, which covers new sites and
+    sites that had duplicates when this patch first ran.
+    """
+    ensure_company_abbr_index()
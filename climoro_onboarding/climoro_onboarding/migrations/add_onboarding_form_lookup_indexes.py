@@ -0,0 +1,11 @@
+import frappe
+
+def execute():
+    """Add the composite indexes for Onboarding Form lookups by email and by
+    company on existing sites; new installs get them from on_doctype_update.
+    """
+    from climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form import (
+        on_doctype_update,
+    )
+
+    on_doctype_update()
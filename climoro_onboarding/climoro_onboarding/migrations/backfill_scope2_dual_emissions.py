@@ -0,0 +1,21 @@
+import frappe
+
+def execute():
+    """Seed location/market-based Scope 2 totals on existing Electricity Purchased rows.
+
+    Rows saved before dual reporting have no grid region or contractual instrument,
+    so both methods equal the row's own ETCO2eq.
+    """
+    if not frappe.db.has_column("Electricity Purchased", "location_based_etco2eq"):
+        return
+
+    frappe.db.sql(
+        """
+        UPDATE `tabElectricity Purchased`
+        SET location_based_etco2eq = IFNULL(etco2eq, 0),
+            market_based_etco2eq = IFNULL(etco2eq, 0)
+        WHERE IFNULL(location_based_etco2eq, 0) = 0
+            AND IFNULL(market_based_etco2eq, 0) = 0
+        """
+    )
+    frappe.db.commit()
@@ -0,0 +1,33 @@
+import frappe
+
+def execute():
+    """Re-apply access for every approved company with the single access engine.
+
+    Sites that ran both the old and the enhanced sweeps can hold workspace roles
+    and sub-scope user roles written by either rule set. Clearing the sweep
+    fingerprint forces one full workspace pass, then each company's plan is
+    applied once so users and workspaces converge on the consolidated rules.
+    """
+    from climoro_onboarding.climoro_onboarding.ghg_workspace_access import (
+        WORKSPACE_SWEEP_FINGERPRINT_KEY,
+        apply_access_plan,
+        build_access_plan,
+    )
+
+    frappe.db.set_global(WORKSPACE_SWEEP_FINGERPRINT_KEY, "")
+
+    companies = frappe.get_all(
+        "Onboarding Form",
+        filters={"status": "Approved", "company_name": ["is", "set"]},
+        pluck="company_name",
+        distinct=True,
+    )
+    for company_name in companies:
+        try:
+            plan = build_access_plan(company_name)
+            if plan:
+                apply_access_plan(plan)
+                frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"Error re-applying access for {company_name}: {str(e)}")
@@ -0,0 +1,20 @@
+import json
+
+import frappe
+
+def execute():
+    """Move the workspace access config from the bundled JSON file into
+    Workspace Access Settings, so edits are shared by every worker.
+    """
+    from climoro_onboarding.climoro_onboarding.enhanced_workspace_access import (
+        SETTINGS_DOCTYPE,
+        WorkspaceAccessManager,
+    )
+
+    if frappe.db.get_single_value(SETTINGS_DOCTYPE, "config_json"):
+        return
+
+    settings = frappe.get_single(SETTINGS_DOCTYPE)
+    settings.config_json = json.dumps(WorkspaceAccessManager()._load_file_config(), indent=2)
+    settings.save(ignore_permissions=True)
+    frappe.db.commit()
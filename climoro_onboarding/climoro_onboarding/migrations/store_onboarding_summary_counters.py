@@ -0,0 +1,17 @@
+import frappe
+
+def execute():
+    """Replace the virtual units/users count columns with the stored, indexed
+    counters and fill them for existing forms in one UPDATE.
+    """
+    from climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form import (
+        update_all_summary_counters,
+    )
+
+    for fieldname in ("units_count", "users_count"):
+        custom_field = frappe.db.exists("Custom Field", {"dt": "Onboarding Form", "fieldname": fieldname})
+        if custom_field:
+            frappe.delete_doc("Custom Field", custom_field, ignore_permissions=True)
+
+    update_all_summary_counters()
+    frappe.db.commit()
@@ -0,0 +1,199 @@
+"""
+Onboarding draft buffer: write-behind storage for /apply wizard autosaves.
+
+Step saves from the wizard are kept in Redis, one hash per application with a
+field per step, and persisted to the Onboarding Form later as one write of the
+merged draft (see `onboarding_drafts.save_steps`). A draft is flushed when its
+oldest unsaved step is older than the flush interval and when the application
+is submitted. Until then draft snapshots overlay the buffered steps on the
+stored form.
+
+The buffer lives in the queue Redis rather than the cache: the cache evicts
+keys under memory pressure and is not persisted, while the queue instance
+keeps keys until they are deleted. Buffered applications are tracked in a
+sorted set scored by their first unsaved write, so a flush that was lost with
+a restarted worker is picked up by the next scheduler run.
+
+Site config:
+- `onboarding_draft_buffer`: 0 writes every step straight to the database
+- `onboarding_draft_flush_interval`: seconds a step may stay buffered (default 60)
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import cint
+from frappe.utils.background_jobs import get_redis_conn
+from redis.exceptions import WatchError
+
+from climoro_onboarding.climoro_onboarding.onboarding_drafts import (
+    STEP_FIELDS,
+    DraftConflictError,
+    _validate_step_values,
+    clear_draft_snapshot,
+    save_steps,
+)
+
+DRAFT_FLUSH_INTERVAL = 60
+# Buffered drafts outlive any flush interval; this only bounds abandoned keys
+DRAFT_BUFFER_TTL = 7 * 24 * 60 * 60
+DRAFT_FLUSH_BATCH = 200
+
+
+def is_enabled():
+    return bool(cint(frappe.conf.get("onboarding_draft_buffer", 1)))
+
+
+def buffer_step(name, step_number, step_data, expected_version=None, stored_version=0):
+    """Keep one wizard step of a draft in the buffer.
+
+    `stored_version` is the form's draft_version in the database; it seeds the
+    buffer's own version counter on the first buffered write. Returns
+    frappe._dict(current_step, draft_version), or None for steps the wizard does
+    not have, and raises DraftConflictError when `expected_version` is stale.
+    """
+    if step_number != 6 and step_number not in STEP_FIELDS:
+        return None
+    if step_number == 6:
+        payload = {
+            "units": step_data.get("units") or [],
+            "assigned_users": step_data.get("assigned_users") or [],
+        }
+    else:
+        payload = {field: step_data[field] for field in STEP_FIELDS[step_number] if field in step_data}
+        # Reject invalid values now; the flush happens after the guest has moved on
+        _validate_step_values({}, payload)
+
+    conn = get_redis_conn()
+    key = _buffer_key(name)
+    with conn.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                version = pipe.hget(key, "draft_version")
+                version = cint(version) if version is not None else cint(stored_version)
+                if expected_version not in (None, "") and cint(expected_version) != version:
+                    raise DraftConflictError(version)
+
+                pipe.multi()
+                pipe.hset(key, mapping={
+                    f"step:{step_number}": json.dumps(payload, default=str),
+                    "current_step": step_number,
+                    "draft_version": version + 1,
+                })
+                pipe.expire(key, DRAFT_BUFFER_TTL)
+                pipe.zadd(_dirty_key(), {name: time.time()}, nx=True)
+                pipe.execute()
+                clear_draft_snapshot(name)
+                return frappe._dict(current_step=step_number, draft_version=version + 1)
+            except WatchError:
+                # Another save of this draft landed in between; read it again
+                continue
+
+
+def get_buffered_draft(name):
+    """The unsaved part of a draft: frappe._dict(steps, current_step, draft_version), or None"""
+    entries = get_redis_conn().hgetall(_buffer_key(name))
+    if not entries:
+        return None
+    entries = {key.decode(): value for key, value in entries.items()}
+    steps = {
+        cint(key.split(":", 1)[1]): json.loads(value)
+        for key, value in entries.items()
+        if key.startswith("step:")
+    }
+    return frappe._dict(
+        steps=steps,
+        current_step=cint(entries.get("current_step")),
+        draft_version=cint(entries.get("draft_version")),
+    )
+
+
+def apply_buffered_draft(name, data):
+    """Overlay the unsaved steps of a draft on values read from the database"""
+    draft = get_buffered_draft(name)
+    if not draft:
+        return data
+    for payload in draft.steps.values():
+        data.update(payload)
+    data.update(current_step=draft.current_step, draft_version=draft.draft_version)
+    return data
+
+
+def flush_draft(name):
+    """Persist the buffered steps of a draft in one write of the Onboarding Form.
+
+    Commits, so call it before starting other writes. The buffer is cleared only
+    after a successful write, and only if nothing was buffered while flushing;
+    otherwise the newer steps stay for the next flush. A draft that cannot be
+    written (invalid, or the form was approved or deleted meanwhile) is logged
+    and set aside under a `failed` key, kept until the buffer TTL, so it is no
+    longer flushed or shown but can still be recovered.
+    """
+    draft = get_buffered_draft(name)
+    conn = get_redis_conn()
+    if not draft:
+        conn.zrem(_dirty_key(), name)
+        return None
+
+    error = None
+    try:
+        result = save_steps(name, draft.steps, draft.current_step, draft_version=draft.draft_version)
+        if result is None:
+            error = "the application was approved or deleted"
+        else:
+            frappe.db.commit()
+    except frappe.ValidationError as e:
+        result = None
+        error = str(e)
+    if error:
+        frappe.db.rollback()
+        frappe.log_error(
+            f"Error flushing draft {name}: {error}\n{json.dumps(draft, default=str)}",
+            "Onboarding Draft Buffer Error",
+        )
+
+    key = _buffer_key(name)
+    with conn.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if cint(pipe.hget(key, "draft_version")) == draft.draft_version:
+                pipe.multi()
+                if error:
+                    pipe.rename(key, _failed_key(name))
+                    pipe.expire(_failed_key(name), DRAFT_BUFFER_TTL)
+                else:
+                    pipe.delete(key)
+                pipe.zrem(_dirty_key(), name)
+                pipe.execute()
+                clear_draft_snapshot(name)
+        except WatchError:
+            pass
+    return result
+
+
+def flush_due_drafts():
+    """Scheduler: persist drafts whose oldest unsaved step is older than the flush interval"""
+    interval = cint(frappe.conf.get("onboarding_draft_flush_interval", DRAFT_FLUSH_INTERVAL))
+    due = get_redis_conn().zrangebyscore(_dirty_key(), 0, time.time() - interval, start=0, num=DRAFT_FLUSH_BATCH)
+    for name in due:
+        name = name.decode()
+        try:
+            flush_draft(name)
+        except Exception as e:
+            # Leave it in the buffer; the next run tries again
+            frappe.db.rollback()
+            frappe.log_error(f"Error flushing draft {name}: {str(e)}", "Onboarding Draft Buffer Error")
+
+
+def _buffer_key(name):
+    return f"{frappe.local.site}:climoro_draft:{name}"
+
+
+def _failed_key(name):
+    return f"{frappe.local.site}:climoro_draft:failed:{name}"
+
+
+def _dirty_key():
+    return f"{frappe.local.site}:climoro_draft:dirty"
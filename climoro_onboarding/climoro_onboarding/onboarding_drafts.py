@@ -0,0 +1,337 @@
+"""
+Onboarding drafts: step-by-step saves of the /apply wizard.
+
+A step save writes only the fields of that step that actually changed, as one
+UPDATE of the Onboarding Form row, instead of loading and re-saving the whole
+document. Step 6 diffs the units and assigned users against the stored rows.
+Concurrent saves are guarded by the form's `draft_version`: the row is locked
+while it is compared, and a stale version from the client is a conflict.
+
+Reads go through draft snapshots: the fields of the requested steps only,
+cached per form until its next save and tagged with the draft version so
+clients can revalidate with If-None-Match.
+"""
+
+import frappe
+from frappe.utils import cint, now, now_datetime
+from frappe.utils.data import cast
+
+# Fields saved by each wizard step; step 6 saves the units and users tables
+STEP_FIELDS = {
+    # Step 1: Contact Details
+    1: ["first_name", "middle_name", "last_name", "phone_number", "email", "position"],
+    # Step 2: Company Details
+    2: [
+        "company_name", "address", "gps_coordinates", "location_name", "cin",
+        "gst_number", "industry_type", "sub_industry_type", "website", "letter_of_authorisation"
+    ],
+    # Step 3: GHG Accounting
+    3: [
+        # Basic GHG fields
+        "purpose_of_reporting", "gases_to_report_co2", "gases_to_report_ch4",
+        "gases_to_report_n2o", "gases_to_report_hfcs", "gases_to_report_pfcs",
+        "gases_to_report_sf6", "gases_to_report_nf3", "scopes_to_report_scope1",
+        "scopes_to_report_scope2", "scopes_to_report_scope3", "scopes_to_report_reductions",
+
+        # Scope 1 Options
+        "scope_1_options_process", "scope_1_options_stationary", "scope_1_options_mobile", "scope_1_options_fugitive",
+
+        # Scope 2 Options
+        "scope_2_options_electricity",
+
+        # Scope 3 Options
+        "scope_3_options_upstream", "scope_3_options_downstream",
+
+        # Reduction Options
+        "reduction_options_energy_efficiency", "reduction_options_renewable_energy", "reduction_options_process_optimization",
+        "reduction_options_waste_management", "reduction_options_transportation", "reduction_options_other"
+    ],
+    # Step 4: Reduction Form
+    4: [
+        # Section A: Emissions Inventory Setup
+        "base_year", "base_year_reason",
+        "scopes_covered_scope1", "scopes_covered_scope2", "scopes_covered_scope3",
+        "ghg_boundary_approach_operational_control", "ghg_boundary_approach_financial_control", "ghg_boundary_approach_equity_share",
+        "scope_3_categories_purchased_goods", "scope_3_categories_capital_goods", "scope_3_categories_fuel_energy",
+        "scope_3_categories_transportation", "scope_3_categories_waste", "scope_3_categories_business_travel",
+        "scope_3_categories_use_sold_products", "scope_3_categories_end_life_treatment", "scope_3_categories_leased_assets",
+        "emissions_exclusions",
+
+        # Section B: Emissions Reduction Targets
+        "target_type", "scope_1_2_intensity_percentage", "scope_1_2_target_year",
+        "scope_3_intensity_percentage", "scope_3_target_year", "absolute_emissions_percentage",
+        "near_term_target_year", "long_term_target_year",
+
+        # Target Metrics
+        "target_metrics_absolute_emissions", "target_metrics_kgco2e_mwh", "target_metrics_kgco2e_tonne",
+        "target_metrics_kgco2e_unit_service", "target_metrics_kgco2e_usd_revenue", "target_metrics_kgco2e_stove_year",
+        "target_metrics_kgco2e_tonne_biochar", "target_metrics_kgco2e_km_travelled",
+
+        # Target Boundary
+        "target_boundary_scope1_2_95_percent", "target_boundary_scope3_90_percent_long_term",
+        "target_boundary_scope3_67_percent_near_term", "target_boundary_prioritize_relevance",
+
+        # Operational Emissions Reduction Strategies
+        "operational_emissions_energy_efficiency", "operational_emissions_onsite_renewable",
+        "operational_emissions_offsite_renewable", "operational_emissions_fuel_switching",
+        "operational_emissions_process_optimization",
+
+        # Value Chain Emissions Reduction Strategies
+        "value_chain_emissions_supplier_engagement", "value_chain_emissions_low_carbon_materials",
+        "value_chain_emissions_redesign_use_phase", "value_chain_emissions_optimize_logistics",
+        "value_chain_emissions_circular_economy",
+
+        # Land Sector Removals
+        "land_sector_removals_afforestation", "land_sector_removals_soil_carbon",
+        "land_sector_removals_urban_greening", "land_sector_removals_biochar",
+        "land_sector_removals_carbon_capture", "land_sector_removals_certified_removals",
+
+        # Residual Emissions
+        "residual_emissions_high_quality_credits", "residual_emissions_bvcm",
+        "residual_emissions_temporary_solutions",
+
+        # Monitoring and Assurance
+        "monitoring_frequency", "monitoring_frequency_other_text", "assurance_validation",
+        "ghg_tracking_tools_excel", "ghg_tracking_tools_software", "ghg_tracking_tools_software_name",
+        "ghg_tracking_tools_web_platform", "recalculation_policy_structural", "recalculation_policy_methodology",
+        "recalculation_policy_boundary", "progress_communication_esg_dashboard", "progress_communication_sustainability_report",
+        "progress_communication_cdp_disclosure", "progress_communication_sbti_registry"
+    ],
+    # Step 5: Method of Calculation
+    5: [
+        "method_of_calculation_option_a", "method_of_calculation_option_b",
+        "method_of_calculation_option_c", "method_of_calculation_option_d",
+        "method_of_calculation_option_e", "method_of_calculation_option_f",
+        "method_of_calculation_option_g"
+    ],
+}
+
+UNIT_FIELDS = [
+    "type_of_unit", "name_of_unit", "size_of_unit", "address", "gps_coordinates",
+    "location_name", "gst", "phone_number", "position"
+]
+ASSIGNED_USER_FIELDS = ["assigned_unit", "email", "first_name", "user_role"]
+
+# Returned with every snapshot, whatever steps are requested
+SNAPSHOT_FIELDS = ["name", "status", "current_step", "draft_version"]
+SNAPSHOT_CACHE_PREFIX = "climoro_draft_snapshot:"
+# Writes clear the snapshots; this only bounds those of abandoned drafts
+SNAPSHOT_CACHE_TTL = 24 * 60 * 60
+
+# Read on every step save, so the controller's validations see the full picture
+VALIDATED_FIELDS = ["email", "phone_number", "company_name", "cin", "gst_number", "industry_type", "sub_industry_type"]
+
+
+class DraftConflictError(frappe.ValidationError):
+    """The draft was saved elsewhere since the client loaded it"""
+
+    def __init__(self, draft_version):
+        super().__init__("This application was updated in another window. Please reload and try again.")
+        self.draft_version = draft_version
+
+
+def save_step(name, step_number, step_data, expected_version=None):
+    """Save one wizard step of the given Onboarding Form.
+
+    Returns frappe._dict(current_step, draft_version, changed), or None when the
+    form is approved and must go through a full document save (and its hooks).
+    Raises DraftConflictError when `expected_version` is stale.
+    """
+    if step_number != 6 and step_number not in STEP_FIELDS:
+        return None
+    return save_steps(name, {step_number: step_data}, step_number, expected_version)
+
+
+def save_steps(name, steps, current_step, expected_version=None, draft_version=None):
+    """Save several wizard steps, given as {step_number: step_data}, in one UPDATE.
+
+    `draft_version` is the version to store when the steps come from the draft
+    buffer, which numbers its own writes; it never moves the stored version back.
+    Returns and raises like `save_step`; None also when the form no longer exists.
+    """
+    meta = frappe.get_meta("Onboarding Form")
+    incoming = {
+        field: step_data[field]
+        for step_number, step_data in steps.items()
+        for field in STEP_FIELDS.get(step_number, [])
+        if field in step_data and meta.get_field(field)
+    }
+    current = frappe.db.get_value(
+        "Onboarding Form",
+        name,
+        list({*incoming, *VALIDATED_FIELDS, "status", "current_step", "draft_version"}),
+        as_dict=True,
+        for_update=True,
+    )
+    if not current or current.status == "Approved":
+        return None
+    version = cint(current.draft_version)
+    if expected_version not in (None, "") and cint(expected_version) != version:
+        raise DraftConflictError(version)
+
+    changes = {}
+    for field, value in incoming.items():
+        fieldtype = meta.get_field(field).fieldtype
+        if cast(fieldtype, value) != cast(fieldtype, current.get(field)):
+            changes[field] = value
+    if changes:
+        _validate_step_values(current, changes)
+
+    rows_changed = False
+    if 6 in steps:
+        units = steps[6].get("units") or []
+        assigned_users = steps[6].get("assigned_users") or []
+        rows_changed = _sync_child_rows(name, "units", "Company Unit", UNIT_FIELDS, units, _unit_key)
+        rows_changed |= _sync_child_rows(name, "assigned_users", "Assigned User", ASSIGNED_USER_FIELDS, assigned_users, _assigned_user_key)
+        if rows_changed:
+            from climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form import get_summary_counters
+            changes.update(get_summary_counters(units, assigned_users))
+
+    if cint(current.current_step) != current_step:
+        changes["current_step"] = current_step
+    if not changes and not rows_changed:
+        return frappe._dict(current_step=cint(current.current_step), draft_version=version, changed=False)
+
+    version = max(cint(draft_version), version + 1)
+    changes["draft_version"] = version
+    changes["modified_at"] = now_datetime()
+    frappe.db.set_value("Onboarding Form", name, changes)
+    clear_draft_snapshot(name)
+    return frappe._dict(current_step=current_step, draft_version=version, changed=True)
+
+
+def get_draft_snapshot(name, steps=None):
+    """The fields of the given wizard steps (all by default) of a form, with its
+    unsaved buffered steps applied, as a cached dict carrying an `etag`.
+    Returns None when the form does not exist.
+    """
+    steps = sorted({cint(step) for step in steps} & {*STEP_FIELDS, 6}) if steps else [*STEP_FIELDS, 6]
+    steps_key = ",".join(str(step) for step in steps)
+    cache_key = f"{SNAPSHOT_CACHE_PREFIX}{name}"
+    snapshot = frappe.cache().hget(cache_key, steps_key)
+    if snapshot is None:
+        snapshot = _build_draft_snapshot(name, steps)
+        if snapshot is None:
+            return None
+        status = (snapshot.status or "").replace(" ", "_").lower()
+        snapshot["etag"] = f'"{name}-{snapshot.draft_version}-{status}-{steps_key.replace(",", "")}"'
+        frappe.cache().hset(cache_key, steps_key, snapshot)
+        frappe.cache().expire(frappe.cache().make_key(cache_key), SNAPSHOT_CACHE_TTL)
+    return snapshot
+
+
+def clear_draft_snapshot(name):
+    """Drop the cached snapshots of a form; call after any write to it"""
+    frappe.cache().delete_value(f"{SNAPSHOT_CACHE_PREFIX}{name}")
+
+
+def _build_draft_snapshot(name, steps):
+    from climoro_onboarding.climoro_onboarding.onboarding_draft_buffer import get_buffered_draft
+
+    meta = frappe.get_meta("Onboarding Form")
+    fields = [field for step in steps for field in STEP_FIELDS.get(step, []) if meta.get_field(field)]
+    snapshot = frappe.db.get_value("Onboarding Form", name, list(dict.fromkeys([*SNAPSHOT_FIELDS, *fields])), as_dict=True)
+    if not snapshot:
+        return None
+    if 6 in steps:
+        snapshot.units = frappe.get_all(
+            "Company Unit",
+            filters={"parent": name, "parenttype": "Onboarding Form", "parentfield": "units"},
+            fields=UNIT_FIELDS,
+            order_by="idx asc",
+        )
+        snapshot.assigned_users = frappe.get_all(
+            "Assigned User",
+            filters={"parent": name, "parenttype": "Onboarding Form", "parentfield": "assigned_users"},
+            fields=ASSIGNED_USER_FIELDS,
+            order_by="idx asc",
+        )
+
+    draft = get_buffered_draft(name)
+    if draft:
+        for step, payload in draft.steps.items():
+            if step in steps:
+                snapshot.update(payload)
+        snapshot.update(current_step=draft.current_step, draft_version=draft.draft_version)
+    return snapshot
+
+
+def _validate_step_values(current, changes):
+    """Run the form's field validations on the stored values merged with the changes"""
+    doc = frappe.get_doc({"doctype": "Onboarding Form", **current, **changes})
+    doc.validate_email()
+    doc.validate_phone()
+    doc.validate_company_details()
+    doc.validate_sub_industry_type()
+    doc._validate_selects()
+    doc._validate_length()
+
+
+def _unit_key(row):
+    return row.get("name_of_unit") or ""
+
+
+def _assigned_user_key(row):
+    return ((row.get("email") or "").lower(), row.get("assigned_unit") or "")
+
+
+def _sync_child_rows(parent, parentfield, child_doctype, fields, incoming, key):
+    """Bring a child table in line with the incoming rows.
+
+    Rows are matched to stored rows by key; matched rows get one UPDATE of the
+    columns that changed (position included), new rows are bulk inserted and
+    unmatched stored rows deleted. Returns whether anything was written.
+    """
+    meta = frappe.get_meta(child_doctype)
+    stored = frappe.get_all(
+        child_doctype,
+        filters={"parent": parent, "parenttype": "Onboarding Form", "parentfield": parentfield},
+        fields=["name", "idx", *fields],
+        order_by="idx asc",
+    )
+    pool = {}
+    for row in stored:
+        pool.setdefault(key(row), []).append(row)
+
+    timestamp = now()
+    session_user = frappe.session.user
+    inserts = []
+    written = False
+    for idx, row in enumerate(incoming, start=1):
+        values = {field: row.get(field) for field in fields}
+        matches = pool.get(key(values))
+        if not matches:
+            inserts.append((
+                frappe.generate_hash(length=10), parent, "Onboarding Form", parentfield, idx,
+                session_user, timestamp, timestamp, session_user, 0,
+                *(values[field] for field in fields),
+            ))
+            continue
+        match = matches.pop(0)
+        changed = {
+            field: value
+            for field, value in values.items()
+            if cast(meta.get_field(field).fieldtype, value) != cast(meta.get_field(field).fieldtype, match.get(field))
+        }
+        if match.idx != idx:
+            changed["idx"] = idx
+        if changed:
+            frappe.db.set_value(child_doctype, match.name, changed, update_modified=False)
+            written = True
+
+    removed = [row.name for rows in pool.values() for row in rows]
+    if removed:
+        frappe.db.delete(child_doctype, {"name": ["in", removed]})
+        written = True
+    if inserts:
+        frappe.db.bulk_insert(
+            child_doctype,
+            fields=[
+                "name", "parent", "parenttype", "parentfield", "idx",
+                "owner", "creation", "modified", "modified_by", "docstatus",
+                *fields,
+            ],
+            values=inserts,
+        )
+        written = True
+    return written
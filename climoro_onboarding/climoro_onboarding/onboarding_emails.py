@@ -0,0 +1,132 @@
+"""
+Onboarding emails: templated messages sent through the Email Queue.
+
+Templates live in `climoro_onboarding/templates/emails/` and are compiled once
+per worker process. Nothing here sends over SMTP on the request path; the
+queue is flushed by Frappe's scheduler.
+
+Admin notifications about new applications are collected and sent as one
+digest when several applications arrive within the digest window. The window
+is set with `onboarding_admin_digest_window` (seconds) in site config; 0 sends
+one notification per application.
+"""
+
+import json
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+ADMIN_DIGEST_WINDOW = 300
+ADMIN_DIGEST_QUEUE_KEY = "climoro_admin_digest:pending"
+ADMIN_DIGEST_SENT_KEY = "climoro_admin_digest:sent"
+ADMIN_DIGEST_LOCK_TIMEOUT = 120
+
+# Compiled templates, shared by every request served by this process
+_templates = {}
+
+
+def render_email(template_name, args):
+    """Render `templates/emails/<template_name>.html` with the given args"""
+    template = _templates.get(template_name)
+    if template is None:
+        template = frappe.get_jenv().get_template(f"templates/emails/{template_name}.html")
+        # Re-read templates on every send while developing
+        if not frappe.conf.developer_mode:
+            _templates[template_name] = template
+    return template.render(args)
+
+
+def queue_email(recipients, subject, template_name, args, **kwargs):
+    """Render the template and put the message on the Email Queue"""
+    frappe.sendmail(
+        recipients=recipients,
+        subject=subject,
+        message=render_email(template_name, args),
+        **kwargs
+    )
+
+
+def get_admin_recipients():
+    """Recipients of new-application notifications"""
+    recipients = frappe.conf.get("onboarding_admin_emails")
+    if recipients:
+        return recipients if isinstance(recipients, list) else [recipients]
+    return [frappe.db.get_single_value("System Settings", "support_email") or "admin@example.com"]
+
+
+def queue_admin_notification(doc):
+    """Notify admins about a new application: now if none was sent within the
+    digest window, otherwise as part of the next digest
+    """
+    cache = frappe.cache()
+    cache.rpush(ADMIN_DIGEST_QUEUE_KEY, json.dumps({
+        "name": doc.name,
+        "first_name": doc.first_name,
+        "last_name": doc.last_name,
+        "email": doc.email,
+        "company_name": doc.company_name,
+        "phone_number": doc.phone_number,
+        "submitted_at": str(now_datetime()),
+    }))
+    if _get_digest_window() <= 0 or not cache.get_value(ADMIN_DIGEST_SENT_KEY):
+        frappe.enqueue(
+            "climoro_onboarding.climoro_onboarding.onboarding_emails.flush_admin_notifications",
+            queue="short",
+            job_id="climoro_admin_digest",
+            deduplicate=True,
+            enqueue_after_commit=True,
+        )
+
+
+def flush_due_admin_notifications():
+    """Scheduler: send the pending digest once the window since the last one has passed"""
+    if not frappe.cache().get_value(ADMIN_DIGEST_SENT_KEY):
+        flush_admin_notifications()
+
+
+def flush_admin_notifications():
+    """Send the pending applications as one notification, or as a digest when there are several"""
+    cache = frappe.cache()
+    lock = cache.lock(cache.make_key("climoro_admin_digest:lock"), timeout=ADMIN_DIGEST_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return
+    try:
+        entries = cache.lrange(ADMIN_DIGEST_QUEUE_KEY, 0, -1)
+        if not entries:
+            return
+        applications = [frappe._dict(json.loads(entry)) for entry in entries]
+
+        if len(applications) == 1:
+            application = applications[0]
+            queue_email(
+                get_admin_recipients(),
+                f"New Onboarding Application - {application.first_name}",
+                "onboarding_admin_notification",
+                {"application": application},
+            )
+        else:
+            queue_email(
+                get_admin_recipients(),
+                f"{len(applications)} New Onboarding Applications",
+                "onboarding_admin_digest",
+                {"applications": applications},
+            )
+        frappe.db.commit()
+        # Drop only what was queued; entries pushed meanwhile wait for the next flush
+        cache.ltrim(ADMIN_DIGEST_QUEUE_KEY, len(entries), -1)
+
+        window = _get_digest_window()
+        if window > 0:
+            cache.set_value(ADMIN_DIGEST_SENT_KEY, 1, expires_in_sec=window)
+    except Exception as e:
+        frappe.log_error(f"Error sending admin notification: {str(e)}", "Admin Notification Error")
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            # Lock expired while sending; nothing left to release
+            pass
+
+
+def _get_digest_window():
+    return cint(frappe.conf.get("onboarding_admin_digest_window", ADMIN_DIGEST_WINDOW))
@@ -0,0 +1,192 @@
+"""
+Onboarding rate limits: token buckets for the guest /apply endpoints.
+
+Each endpoint has a bucket per client IP and, where the request names an
+applicant, one per email. A call takes one token from every bucket it falls
+in and is refused with 429 when any of them is empty; buckets refill evenly
+over their period. The check is one Lua script in Redis, so it is atomic and
+shared by every web worker.
+
+Limits are (capacity, period in seconds) per endpoint and scope, and can be
+overridden in site config:
+
+    "onboarding_rate_limits": {"save_step_data": {"ip": [240, 60], "email": [120, 60]}}
+
+Set `onboarding_rate_limit_enabled` to 0 to switch the limits off. Allowed and
+refused calls are counted per endpoint; see `get_rate_limit_counters`.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+# endpoint -> scope -> (capacity, period in seconds)
+DEFAULT_RATE_LIMITS = {
+    # Wizard autosaves and reloads: generous, many applicants can share an office IP
+    "save_step_data": {"ip": (120, 60), "email": (60, 60)},
+    "get_saved_data": {"ip": (120, 60)},
+    "upload_file": {"ip": (30, 60)},
+    "submit_onboarding_form": {"ip": (10, 60), "email": (3, 60)},
+    # These send mail
+    "send_verification_email": {"ip": (20, 3600), "email": (5, 3600)},
+    "send_resume_email": {"ip": (20, 3600), "email": (5, 3600)},
+}
+RATE_LIMIT_PREFIX = "climoro_rate_limit:"
+RATE_LIMIT_COUNTERS_KEY = "climoro_rate_limit:counters"
+
+# KEYS: counters, bucket... ARGV: now (ms), endpoint, then per bucket: capacity, period (ms), scope
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+local limited = ""
+for i = 1, #KEYS - 1 do
+    local capacity = tonumber(ARGV[3 * i])
+    local period = tonumber(ARGV[3 * i + 1])
+    local bucket = redis.call("HMGET", KEYS[i + 1], "tokens", "ts")
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * capacity / period)
+    levels[i] = tokens
+    if tokens < 1 then
+        local needed = math.ceil((1 - tokens) * period / capacity)
+        if needed > wait then
+            wait = needed
+            limited = ARGV[3 * i + 2]
+        end
+    end
+end
+if wait > 0 then
+    redis.call("HINCRBY", KEYS[1], ARGV[2] .. ":limited:" .. limited, 1)
+    return {0, wait, limited}
+end
+for i = 1, #KEYS - 1 do
+    redis.call("HSET", KEYS[i + 1], "tokens", tostring(levels[i] - 1), "ts", now)
+    redis.call("PEXPIRE", KEYS[i + 1], tonumber(ARGV[3 * i + 1]))
+end
+redis.call("HINCRBY", KEYS[1], ARGV[2] .. ":allowed", 1)
+return {1, 0, ""}
+"""
+
+_token_bucket = None
+
+
+def rate_limited(endpoint, get_email=None):
+    """Apply the endpoint's token buckets to a guest endpoint.
+
+    `get_email` receives the call's arguments by name and returns the
+    applicant's email, for the per-email bucket. Place it below
+    `@frappe.whitelist`.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            email = None
+            if get_email:
+                try:
+                    email = get_email(signature.bind_partial(*args, **kwargs).arguments)
+                except Exception:
+                    # Malformed payloads are the endpoint's to report; the IP bucket still applies
+                    email = None
+            check_rate_limit(endpoint, email)
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def email_from_json(argname):
+    """`get_email` for endpoints that take a JSON payload with an `email` key"""
+    def get_email(arguments):
+        payload = arguments.get(argname) or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        return payload.get("email")
+
+    return get_email
+
+
+def email_argument(argname="email"):
+    """`get_email` for endpoints that take the email as an argument"""
+    return lambda arguments: arguments.get(argname)
+
+
+def check_rate_limit(endpoint, email=None):
+    """Take a token from the endpoint's buckets for this request; raise
+    frappe.TooManyRequestsError (HTTP 429) when one of them is empty
+    """
+    if not cint(frappe.conf.get("onboarding_rate_limit_enabled", 1)):
+        return
+    ip = getattr(frappe.local, "request_ip", None)
+    if not ip:
+        # Not a web request (console, background job)
+        return
+
+    limits = get_rate_limits(endpoint)
+    identities = {"ip": ip, "email": (email or "").strip().lower()}
+    cache = frappe.cache()
+    keys, args = [cache.make_key(RATE_LIMIT_COUNTERS_KEY)], [int(time.time() * 1000), endpoint]
+    for scope, (capacity, period) in limits.items():
+        if not identities.get(scope):
+            continue
+        identity = hashlib.sha1(identities[scope].encode()).hexdigest()
+        keys.append(cache.make_key(f"{RATE_LIMIT_PREFIX}{endpoint}:{scope}:{identity}"))
+        args.extend([capacity, int(period * 1000), scope])
+    if len(keys) == 1:
+        return
+
+    allowed, wait_ms, _scope = _get_token_bucket()(keys=keys, args=args)
+    if allowed:
+        return
+
+    retry_after = max(int(wait_ms) // 1000, 1)
+    response_headers = getattr(frappe.local, "response_headers", None)
+    if response_headers is not None:
+        response_headers.set("Retry-After", str(retry_after))
+    frappe.throw(
+        _("Too many requests. Please try again in {0} seconds.").format(retry_after),
+        frappe.TooManyRequestsError,
+        title=_("Slow down"),
+    )
+
+
+def get_rate_limits(endpoint):
+    """{scope: (capacity, period)} for the endpoint, with site config overrides applied"""
+    limits = dict(DEFAULT_RATE_LIMITS.get(endpoint) or {})
+    overrides = (frappe.conf.get("onboarding_rate_limits") or {}).get(endpoint) or {}
+    for scope, limit in overrides.items():
+        if limit:
+            limits[scope] = (cint(limit[0]), cint(limit[1]))
+        else:
+            # A falsy limit switches the scope off
+            limits.pop(scope, None)
+    return {scope: limit for scope, limit in limits.items() if limit[0] > 0 and limit[1] > 0}
+
+
+@frappe.whitelist()
+def get_rate_limit_counters():
+    """Allowed and refused calls per endpoint (refusals by the bucket that refused them)"""
+    frappe.only_for("System Manager")
+    counters = {}
+    # Raw HGETALL: the counters are plain integers written by the script, not pickled values
+    raw = frappe.cache().execute_command("HGETALL", frappe.cache().make_key(RATE_LIMIT_COUNTERS_KEY))
+    for field, count in raw.items():
+        endpoint, outcome = field.decode().split(":", 1)
+        counters.setdefault(endpoint, {})[outcome] = cint(count)
+    return {"limits": {endpoint: get_rate_limits(endpoint) for endpoint in DEFAULT_RATE_LIMITS}, "counters": counters}
+
+
+def _get_token_bucket():
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = frappe.cache().register_script(TOKEN_BUCKET_SCRIPT)
+    return _token_bucket
@@ -0,0 +1,116 @@
+"""
+Onboarding tokens: signed, expiring links for email verification and resume.
+
+A token is the base64url JSON of its claims and an HMAC-SHA256 signature of
+them, keyed from the site's encryption key. The claims carry the purpose,
+the applicant's email, the application id (when there is one), the expiry and
+a token id, so checking a token is CPU only. Claims are signed, not
+encrypted, so form data a token carries (the Step 1 answers of a verification
+link) is encrypted with the site's encryption key before it goes in. Nothing
+is stored per token; the only state is the revocation set of single-use
+tokens that were already used, kept in the cache until the token would have
+expired anyway.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import frappe
+from frappe.utils.password import decrypt, encrypt, get_encryption_key
+
+VERIFY_TOKEN_TTL = 24 * 60 * 60
+RESUME_TOKEN_TTL = 24 * 60 * 60
+REVOKED_TOKEN_PREFIX = "climoro_token_revoked:"
+
+
+class InvalidTokenError(frappe.ValidationError):
+    pass
+
+
+class ExpiredTokenError(InvalidTokenError):
+    pass
+
+
+def make_token(purpose, email, application_id=None, data=None, expires_in=VERIFY_TOKEN_TTL):
+    """Signed token for `purpose` ("verify" or "resume") carrying the given
+    claims; `data` is encrypted
+    """
+    claims = {
+        "p": purpose,
+        "e": email,
+        "x": int(time.time()) + expires_in,
+        "j": frappe.generate_hash(length=12),
+    }
+    if application_id:
+        claims["a"] = application_id
+    if data:
+        claims["d"] = encrypt(json.dumps(data, separators=(",", ":"), default=str))
+    payload = _encode(json.dumps(claims, separators=(",", ":"), default=str).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_token(token, purpose, check_revoked=False):
+    """The claims of a valid token as frappe._dict(email, application_id, data,
+    expires_at, token_id). Raises InvalidTokenError, or ExpiredTokenError once
+    it has expired. `check_revoked` also rejects revoked single-use tokens.
+    """
+    payload, _, signature = (token or "").partition(".")
+    if not payload or not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidTokenError("Invalid token")
+    try:
+        claims = json.loads(_decode(payload))
+    except ValueError:
+        raise InvalidTokenError("Invalid token")
+    if claims.get("p") != purpose or not claims.get("e"):
+        raise InvalidTokenError("Invalid token")
+    if claims["x"] < time.time():
+        raise ExpiredTokenError("Token has expired")
+    if check_revoked and frappe.cache().get_value(f"{REVOKED_TOKEN_PREFIX}{claims['j']}"):
+        raise InvalidTokenError("Token has already been used")
+    return frappe._dict(
+        email=claims["e"],
+        application_id=claims.get("a"),
+        data=_decrypt_data(claims.get("d")),
+        expires_at=claims["x"],
+        token_id=claims["j"],
+    )
+
+
+def revoke_token(claims):
+    """Reject the token from now on (for `read_token(..., check_revoked=True)`)"""
+    remaining = int(claims.expires_at - time.time())
+    if remaining > 0:
+        frappe.cache().set_value(f"{REVOKED_TOKEN_PREFIX}{claims.token_id}", 1, expires_in_sec=remaining)
+
+
+def _decrypt_data(value):
+    if not value:
+        return {}
+    try:
+        return json.loads(decrypt(value))
+    except Exception:
+        # decrypt throws when the site's encryption key changed since signing
+        raise InvalidTokenError("Invalid token")
+
+
+def _sign(payload):
+    return _encode(hmac.new(_get_signing_key(), payload.encode(), hashlib.sha256).digest())
+
+
+def _get_signing_key():
+    # Derived, so tokens and encrypted passwords never share a key
+    return hashlib.sha256(b"climoro_onboarding_tokens:" + get_encryption_key().encode()).digest()
+
+
+def _encode(value):
+    return base64.urlsafe_b64encode(value).rstrip(b"=").decode()
+
+
+def _decode(value):
+    try:
+        return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except (ValueError, TypeError):
+        raise InvalidTokenError("Invalid token")
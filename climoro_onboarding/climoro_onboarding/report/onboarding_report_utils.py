@@ -0,0 +1,64 @@
+# Copyright (c) 2025, climoro and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+
+import frappe
+from frappe.utils import add_days, cint, getdate
+
+REPORT_CACHE_TTL = 60
+DEFAULT_PAGE_LENGTH = 500
+MAX_PAGE_LENGTH = 5000
+
+
+def get_form_conditions(filters):
+	"""SQL conditions on `tabOnboarding Form` (aliased `form`) and their values.
+	The date range applies to the application's creation date.
+	"""
+	conditions, values = [], {}
+	if filters.get("status"):
+		conditions.append("form.status = %(status)s")
+		values["status"] = filters.status
+	if filters.get("industry_type"):
+		conditions.append("form.industry_type = %(industry_type)s")
+		values["industry_type"] = filters.industry_type
+	if filters.get("from_date"):
+		conditions.append("form.creation >= %(from_date)s")
+		values["from_date"] = getdate(filters.from_date)
+	if filters.get("to_date"):
+		# Half-open range keeps the creation index usable
+		conditions.append("form.creation < %(to_date)s")
+		values["to_date"] = add_days(getdate(filters.to_date), 1)
+	return conditions, values
+
+
+def get_page(filters):
+	"""(limit, offset) for the requested page; one extra row tells whether a next page exists"""
+	page_length = min(cint(filters.get("page_length")) or DEFAULT_PAGE_LENGTH, MAX_PAGE_LENGTH)
+	page = max(cint(filters.get("page")), 1)
+	return page_length, (page - 1) * page_length
+
+
+def paginate(rows, filters):
+	"""Trim the extra row fetched by `get_page` and describe the page shown"""
+	page_length, offset = get_page(filters)
+	has_more = len(rows) > page_length
+	rows = rows[:page_length]
+	if not rows:
+		return rows, None
+	message = f"Rows {offset + 1}-{offset + len(rows)}"
+	if has_more:
+		message += f"; more on page {max(cint(filters.get('page')), 1) + 1}"
+	return rows, message
+
+
+def get_cached_report(report_name, filters, compute):
+	"""Serve the report result from a short-lived cache keyed by its filters"""
+	digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+	key = f"climoro_report:{frappe.scrub(report_name)}:{digest}"
+	result = frappe.cache().get_value(key)
+	if result is None:
+		result = compute()
+		frappe.cache().set_value(key, result, expires_in_sec=REPORT_CACHE_TTL)
+	return result
@@ -1,9 +1,74 @@
 # Copyright (c) 2025, climoro and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
+from frappe import _
+
+from climoro_onboarding.climoro_onboarding.report.onboarding_report_utils import (
+	get_cached_report,
+	get_form_conditions,
+	get_page,
+	paginate,
+)
+
+UNIT_TYPES = ("Office", "Warehouse", "Factory", "Franchise")
 
 
 def execute(filters=None):
-	columns, data = [], []
-	return columns, data
+	filters = frappe._dict(filters or {})
+	data, message = get_cached_report("Simple Units Summary", filters, lambda: get_data(filters))
+	return get_columns(), data, message
+
+
+def get_columns():
+	columns = [
+		{"label": _("Application"), "fieldname": "application", "fieldtype": "Link", "options": "Onboarding Form", "width": 140},
+		{"label": _("Company"), "fieldname": "company_name", "fieldtype": "Data", "width": 200},
+		{"label": _("Status"), "fieldname": "status", "fieldtype": "Data", "width": 100},
+		{"label": _("Industry"), "fieldname": "industry_type", "fieldtype": "Data", "width": 180},
+		{"label": _("Created On"), "fieldname": "created_on", "fieldtype": "Datetime", "width": 160},
+		{"label": _("Units"), "fieldname": "units", "fieldtype": "Int", "width": 80},
+	]
+	for unit_type in UNIT_TYPES:
+		columns.append({"label": _(unit_type), "fieldname": frappe.scrub(unit_type), "fieldtype": "Int", "width": 90})
+	columns.append({"label": _("Users"), "fieldname": "users", "fieldtype": "Int", "width": 80})
+	return columns
+
+
+def get_data(filters):
+	"""One row per application with its unit counts by type, in a single grouped query"""
+	conditions, values = get_form_conditions(filters)
+	if filters.get("unit_type"):
+		conditions.append("""exists (
+			select 1 from `tabCompany Unit` typed
+			where typed.parent = form.name and typed.parenttype = 'Onboarding Form'
+				and typed.type_of_unit = %(unit_type)s
+		)""")
+		values["unit_type"] = filters.unit_type
+
+	type_columns = ",\n".join(
+		f"coalesce(sum(unit.type_of_unit = {frappe.db.escape(unit_type)}), 0) as `{frappe.scrub(unit_type)}`"
+		for unit_type in UNIT_TYPES
+	)
+	limit, offset = get_page(filters)
+	values.update(limit=limit + 1, offset=offset)
+
+	rows = frappe.db.sql(f"""
+		select
+			form.name as application,
+			form.company_name,
+			form.status,
+			form.industry_type,
+			form.creation as created_on,
+			count(unit.name) as units,
+			{type_columns},
+			form.total_users as users
+		from `tabOnboarding Form` form
+		left join `tabCompany Unit` unit
+			on unit.parent = form.name and unit.parenttype = 'Onboarding Form' and unit.parentfield = 'units'
+		{"where " + " and ".join(conditions) if conditions else ""}
+		group by form.name
+		order by form.creation desc
+		limit %(limit)s offset %(offset)s
+	""", values, as_dict=True)
+	return paginate(rows, filters)
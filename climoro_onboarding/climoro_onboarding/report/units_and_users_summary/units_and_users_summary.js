@@ -3,6 +3,46 @@
 
 frappe.query_reports["Units and Users Summary"] = {
 	"filters": [
-
+		{
+			"fieldname": "status",
+			"label": __("Status"),
+			"fieldtype": "Select",
+			"options": "\nDraft\nIn Progress\nSubmitted\nApproved\nRejected"
+		},
+		{
+			"fieldname": "industry_type",
+			"label": __("Industry Type"),
+			"fieldtype": "Select",
+			"options": "\nEnergy\nManufacturing\nConstruction\nTransportation & Logistics\nRetail & Consumer Goods\nChemical & Petrochemical\nFinancial & Insurance Services\nReal Estate & Property Management\nServices\nAgriculture, Forestry & Land Use\nWaste Management\nWater Supply & Treatment\nTelecommunications\nGovernment & Public Administration\nAviation & Aerospace\nMining & Quarrying\nFossil Fuel Supply Chain\nFisheries & Marine\nMedia, Entertainment & Culture\nCarbon Market & Climate Services"
+		},
+		{
+			"fieldname": "from_date",
+			"label": __("From Date"),
+			"fieldtype": "Date"
+		},
+		{
+			"fieldname": "to_date",
+			"label": __("To Date"),
+			"fieldtype": "Date"
+		},
+		{
+			"fieldname": "unit_type",
+			"label": __("Unit Type"),
+			"fieldtype": "Select",
+			"options": "\nOffice\nWarehouse\nFactory\nFranchise"
+		},
+		{
+			"fieldname": "page",
+			"label": __("Page"),
+			"fieldtype": "Int",
+			"default": 1
+		},
+		{
+			"fieldname": "page_length",
+			"label": __("Rows per Page"),
+			"fieldtype": "Select",
+			"options": "100\n500\n1000\n5000",
+			"default": "500"
+		}
 	]
 };
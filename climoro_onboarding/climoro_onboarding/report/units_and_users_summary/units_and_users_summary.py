@@ -1,9 +1,73 @@
 # Copyright (c) 2025, climoro and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
+from frappe import _
+
+from climoro_onboarding.climoro_onboarding.report.onboarding_report_utils import (
+	get_cached_report,
+	get_form_conditions,
+	get_page,
+	paginate,
+)
 
 
 def execute(filters=None):
-	columns, data = [], []
-	return columns, data
+	filters = frappe._dict(filters or {})
+	data, message = get_cached_report("Units and Users Summary", filters, lambda: get_data(filters))
+	return get_columns(), data, message
+
+
+def get_columns():
+	return [
+		{"label": _("Application"), "fieldname": "application", "fieldtype": "Link", "options": "Onboarding Form", "width": 140},
+		{"label": _("Company"), "fieldname": "company_name", "fieldtype": "Data", "width": 180},
+		{"label": _("Status"), "fieldname": "status", "fieldtype": "Data", "width": 100},
+		{"label": _("Industry"), "fieldname": "industry_type", "fieldtype": "Data", "width": 160},
+		{"label": _("Unit"), "fieldname": "unit_name", "fieldtype": "Data", "width": 180},
+		{"label": _("Unit Type"), "fieldname": "unit_type", "fieldtype": "Data", "width": 100},
+		{"label": _("Size"), "fieldname": "size_of_unit", "fieldtype": "Float", "width": 90},
+		{"label": _("Location"), "fieldname": "location_name", "fieldtype": "Data", "width": 160},
+		{"label": _("Users"), "fieldname": "users", "fieldtype": "Int", "width": 80},
+		{"label": _("Unit Managers"), "fieldname": "unit_managers", "fieldtype": "Int", "width": 110},
+		{"label": _("Data Analysts"), "fieldname": "data_analysts", "fieldtype": "Int", "width": 110},
+		{"label": _("User Emails"), "fieldname": "user_emails", "fieldtype": "Small Text", "width": 260},
+	]
+
+
+def get_data(filters):
+	"""One row per unit with its assigned users aggregated, in a single grouped query"""
+	conditions, values = get_form_conditions(filters)
+	conditions[:0] = ["unit.parenttype = 'Onboarding Form'", "unit.parentfield = 'units'"]
+	if filters.get("unit_type"):
+		conditions.append("unit.type_of_unit = %(unit_type)s")
+		values["unit_type"] = filters.unit_type
+
+	limit, offset = get_page(filters)
+	values.update(limit=limit + 1, offset=offset)
+
+	rows = frappe.db.sql(f"""
+		select
+			form.name as application,
+			form.company_name,
+			form.status,
+			form.industry_type,
+			unit.name_of_unit as unit_name,
+			unit.type_of_unit as unit_type,
+			unit.size_of_unit,
+			unit.location_name,
+			count(assigned.name) as users,
+			coalesce(sum(assigned.user_role = 'Unit Manager'), 0) as unit_managers,
+			coalesce(sum(assigned.user_role = 'Data Analyst'), 0) as data_analysts,
+			group_concat(assigned.email order by assigned.idx separator ', ') as user_emails
+		from `tabCompany Unit` unit
+		inner join `tabOnboarding Form` form on form.name = unit.parent
+		left join `tabAssigned User` assigned
+			on assigned.parent = unit.parent and assigned.parenttype = 'Onboarding Form'
+			and assigned.parentfield = 'assigned_users' and assigned.assigned_unit = unit.name_of_unit
+		where {" and ".join(conditions)}
+		group by unit.name
+		order by form.creation desc, unit.idx
+		limit %(limit)s offset %(offset)s
+	""", values, as_dict=True)
+	return paginate(rows, filters)
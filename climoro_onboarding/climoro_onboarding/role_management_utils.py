@@ -122,6 +122,10 @@ class RoleManagementUtils:
                     config['scope_dependencies'][parent_scope] = []
                 
                 config['scope_dependencies'][parent_scope].append(role_name)
+                
+                # The access engine gates sub-scope roles on their parent role
+                parent_role = parent_scope if parent_scope.endswith(" Access") else f"{parent_scope} Access"
+                config.setdefault('role_parents', {})[role_name] = parent_role
                 workspace_access_manager._save_config()
             
             return {
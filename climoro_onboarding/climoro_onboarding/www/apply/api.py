@@ -5,6 +5,8 @@ from frappe import _
 from frappe.utils import now_datetime, get_url
 import uuid
 
+from climoro_onboarding.climoro_onboarding.onboarding_emails import queue_admin_notification, queue_email
+
 @frappe.whitelist()
 def submit_onboarding_form(form_data):
     """Submit the complete onboarding form"""
@@ -176,15 +178,11 @@ def send_verification_email(email, data):
         # Send email
         verification_url = f"{get_url()}/apply?verify={token}"
         
-        frappe.sendmail(
-            recipients=[email],
-            subject="Verify Your Email - Climoro Onboarding",
-            message=f"""
-            <p>Please click the link below to verify your email address:</p>
-            <p><a href="{verification_url}">{verification_url}</a></p>
-            <p>This link will expire in 10 minutes.</p>
-            """,
-            now=True
+        queue_email(
+            [email],
+            "Verify Your Email - Climoro Onboarding",
+            "onboarding_verification",
+            {"verification_url": verification_url, "expires_in": "10 minutes"},
         )
         
         return {
@@ -307,23 +305,7 @@ def upload_file(file_data, filename):
 def send_admin_notification(doc):
     """Send notification to admin about new application"""
     try:
-        admin_email = frappe.db.get_single_value("System Settings", "support_email") or "admin@example.com"
-        
-        frappe.sendmail(
-            recipients=[admin_email],
-            subject=f"New Onboarding Application - {doc.first_name}",
-            message=f"""
-            <h3>New Onboarding Application Received</h3>
-            <p><strong>Applicant:</strong> {doc.first_name} {doc.last_name or ''}</p>
-            <p><strong>Email:</strong> {doc.email}</p>
-            <p><strong>Company:</strong> {doc.company_name}</p>
-            <p><strong>Phone:</strong> {doc.phone_number}</p>
-            <p><strong>Submitted:</strong> {doc.submitted_at}</p>
-            <br>
-            <p>Please review the application in the Frappe system.</p>
-            """,
-            now=True
-        )
+        queue_admin_notification(doc)
         
     except Exception as e:
-        frappe.log_error(f"Error sending admin notification: {str(e)}", "Admin Notification Error") 
\ No newline at end of file
+        frappe.log_error(f"Error sending admin notification: {str(e)}", "Admin Notification Error")
@@ -88,7 +88,15 @@ doctype_list_js = {
 # ------------
 
 # before_install = "climoro_onboarding.install.before_install"
-# after_install = "climoro_onboarding.install.after_install"
+# Patches are marked done on new sites, so the Company abbr index is created here too
+after_install = "climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.ensure_company_abbr_index"
+
+after_migrate = [
+    # A deploy may add or remove modules; rebuild the cached module catalogue
+    "climoro_onboarding.climoro_onboarding.ghg_workspace_access.clear_module_catalogue",
+    # Idempotent; fails the migrate while companies share an abbreviation
+    "climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.ensure_company_abbr_index",
+]
 
 # Uninstallation
 # ------------
@@ -150,16 +158,18 @@ doc_events = {
     "User": {
         # After insert: auto-assign roles based on company's onboarding selections
         "after_insert": [
-            "climoro_onboarding.climoro_onboarding.ghg_workspace_access.assign_roles_to_new_user",
-            "climoro_onboarding.climoro_onboarding.enhanced_workspace_access.assign_roles_to_new_user"
+            "climoro_onboarding.climoro_onboarding.ghg_workspace_access.assign_roles_to_new_user"
         ]
     },
     "Onboarding Form": {
         # Keep scopes/workspaces in sync if the approved form is edited later
-        "on_update": [
-            "climoro_onboarding.climoro_onboarding.ghg_workspace_access.sync_onboarding_selection",
-            "climoro_onboarding.climoro_onboarding.enhanced_workspace_access.sync_onboarding_selection"
-        ]
+        # (debounced background job per company)
+        "on_update": "climoro_onboarding.climoro_onboarding.ghg_workspace_access.sync_onboarding_selection"
+    },
+    "Workspace": {
+        # Cached sidebar payloads depend on workspace roles and hierarchy
+        "on_update": "climoro_onboarding.climoro_onboarding.ghg_workspace_access.invalidate_sidebar_cache",
+        "on_trash": "climoro_onboarding.climoro_onboarding.ghg_workspace_access.invalidate_sidebar_cache"
     }
 }
 
@@ -184,6 +194,21 @@ doc_events = {
 # 	],
 # }
 
+scheduler_events = {
+    "all": [
+        # Send admin digests of new applications once their window has passed
+        "climoro_onboarding.climoro_onboarding.onboarding_emails.flush_due_admin_notifications",
+        # Persist wizard drafts that have waited in the draft buffer long enough
+        "climoro_onboarding.climoro_onboarding.onboarding_draft_buffer.flush_due_drafts",
+    ],
+    "cron": {
+        # Resume onboarding approvals that failed or lost their worker
+        "*/5 * * * *": [
+            "climoro_onboarding.climoro_onboarding.doctype.onboarding_form.onboarding_form.retry_stalled_approvals",
+        ],
+    },
+}
+
 # Testing
 # -------
 
@@ -208,6 +233,13 @@ whitelisted_methods = [
     "climoro_onboarding.climoro_onboarding.enhanced_workspace_access.add_scope_mapping",
     "climoro_onboarding.climoro_onboarding.enhanced_workspace_access.get_available_roles",
     "climoro_onboarding.climoro_onboarding.enhanced_workspace_access.get_role_mappings",
+    # Access engine maintenance
+    "climoro_onboarding.climoro_onboarding.ghg_workspace_access.cleanup_private_workspaces",
+    "climoro_onboarding.climoro_onboarding.ghg_workspace_access.get_visible_workspaces",
+    "climoro_onboarding.climoro_onboarding.ghg_workspace_access.preview_company_access",
+    "climoro_onboarding.climoro_onboarding.ghg_workspace_access.apply_company_access_preview",
+    # Guest endpoint throttling
+    "climoro_onboarding.climoro_onboarding.onboarding_rate_limit.get_rate_limit_counters",
     # Role management utility methods
     "climoro_onboarding.climoro_onboarding.role_management_utils.add_custom_role",
     "climoro_onboarding.climoro_onboarding.role_management_utils.add_workspace_scope",
@@ -1,53 +1,68 @@
 (() => {
-  const ROLE_TO_LABEL = {
-    'Scope 1 Access': 'Scope 1',
-    'Scope 2 Access': 'Scope 2',
-    'Scope 3 Access': 'Scope 3',
-    'Reduction Factor Access': 'Reduction Factor',
-    'Scope 3 Upstream Access': 'Upstream',
-    'Scope 3 Downstream Access': 'Downstream',
-    'Scope 1 Stationary Access': 'Stationary Emissions',
-    'Scope 1 Mobile Access': 'Mobile Combustion',
-    'Scope 1 Fugitives Access': 'Fugitives',
-    'Scope 1 Process Access': 'Process',
-    'Reduction Energy Efficiency Access': 'Energy Efficiency',
-    'Reduction Solar Access': 'Solar',
-    'Reduction Process Optimization Access': 'Process Optimization',
-    'Reduction Waste Manage Access': 'Waste Manage',
-    'Reduction Transportation Access': 'Transportation-Upstream',
-    'Reduction Methane Recovery Access': 'Methane Recovery'
-  };
-
-  function getAllowedLabels() {
-    const roles = (window.frappe && frappe.user_roles) || [];
-    const labels = new Set();
-    roles.forEach(r => { const lbl = ROLE_TO_LABEL[r]; if (lbl) labels.add(lbl); });
-    // Always allow Home; reduce exposure for non-admins
-    labels.add('Climoro Dashboard');
-    return labels;
+  // Visible workspace tree for the user's role set, computed and cached on the server
+  const ENDPOINT = '/api/method/climoro_onboarding.climoro_onboarding.ghg_workspace_access.get_visible_workspaces';
+  const STORAGE_KEY = 'climoro_visible_workspaces';
+
+  let visibleNames = null;
+
+  function storageKey() {
+    const user = (window.frappe && frappe.session && frappe.session.user) || '';
+    return `${STORAGE_KEY}:${user}`;
+  }
+
+  function readStored() {
+    try { return JSON.parse(localStorage.getItem(storageKey())) || null; } catch (e) { return null; }
+  }
+
+  function remember(payload) {
+    visibleNames = new Set();
+    const walk = nodes => (nodes || []).forEach(n => {
+      visibleNames.add(n.name);
+      walk(n.children);
+    });
+    walk(payload && payload.workspaces);
+  }
+
+  function fetchVisibleWorkspaces() {
+    const stored = readStored();
+    const headers = { 'Accept': 'application/json' };
+    if (stored && stored.etag) headers['If-None-Match'] = stored.etag;
+    return fetch(ENDPOINT, { credentials: 'same-origin', headers })
+      .then(res => {
+        if (res.status === 304 && stored) return stored;
+        if (!res.ok) return stored;
+        return res.json().then(r => {
+          const payload = r && r.message;
+          if (!payload || !payload.workspaces) return stored;
+          try { localStorage.setItem(storageKey(), JSON.stringify(payload)); } catch (e) { /* storage full/disabled */ }
+          return payload;
+        });
+      })
+      .catch(() => stored);
   }
 
   function hideDisallowedSidebarItems() {
     try {
-      const allowed = getAllowedLabels();
+      if (!visibleNames) return;
       const sidebar = document.querySelector('.sidebar-items') || document.querySelector('.standard-sidebar');
       if (!sidebar) return;
-      const items = sidebar.querySelectorAll('[data-label], .sidebar-item, .link-item');
-      items.forEach(el => {
-        const text = (el.getAttribute('data-label') || el.textContent || '').trim();
-        // keep parents visible if any child allowed; basic heuristic
-        const isParent = /^(Scope 1|Scope 2|Scope 3|Reduction Factor)$/i.test(text);
-        if (allowed.has(text) || isParent) return;
-        // Hide if it matches managed labels list
-        if (Object.values(ROLE_TO_LABEL).includes(text)) {
-          el.style.display = 'none';
-        }
+      // Public workspace entries the role set cannot see; private pages are cleaned up server-side
+      sidebar.querySelectorAll('.sidebar-item-container[item-name]').forEach(el => {
+        if (el.getAttribute('item-public') === '0') return;
+        const name = el.getAttribute('item-name');
+        el.style.display = visibleNames.has(name) ? '' : 'none';
       });
     } catch (e) { /* no-op */ }
   }
 
   function install() {
+    const stored = readStored();
+    if (stored) remember(stored);
     hideDisallowedSidebarItems();
+    fetchVisibleWorkspaces().then(payload => {
+      if (payload) remember(payload);
+      hideDisallowedSidebarItems();
+    });
     document.addEventListener('app_ready', hideDisallowedSidebarItems);
     document.addEventListener('toolbar_setup', hideDisallowedSidebarItems);
     window.addEventListener('hashchange', () => setTimeout(hideDisallowedSidebarItems, 50));
@@ -55,5 +70,3 @@
 
   if (document.readyState === 'loading') document.addEventListener('DOMContentLoaded', install); else install();
 })();
-
-
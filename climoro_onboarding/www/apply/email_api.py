@@ -1,12 +1,28 @@
 import frappe
 from frappe import _
 from frappe.utils import now, now_datetime, get_url
-import uuid
 import json
-from datetime import timedelta
+from datetime import datetime
+
+from climoro_onboarding.climoro_onboarding.onboarding_drafts import (
+    STEP_FIELDS,
+    clear_draft_snapshot,
+    get_draft_snapshot,
+)
+from climoro_onboarding.climoro_onboarding.onboarding_emails import queue_email
+from climoro_onboarding.climoro_onboarding.onboarding_tokens import (
+    RESUME_TOKEN_TTL,
+    VERIFY_TOKEN_TTL,
+    InvalidTokenError,
+    make_token,
+    read_token,
+    revoke_token,
+)
+from climoro_onboarding.climoro_onboarding.onboarding_rate_limit import email_argument, rate_limited
 
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("send_verification_email", email_argument())
 def send_verification_email(email, data):
     """Send email verification after Step 1 completion"""
     try:
@@ -22,21 +38,10 @@ def send_verification_email(email, data):
         if isinstance(data, str):
             data = json.loads(data)
         
-        # Generate verification token
-        verification_token = str(uuid.uuid4())
-        
-        # Store session data temporarily (expires in 24 hours)
-        session_key = f"climoro_onboarding_{verification_token}"
-        session_data = {
-            "email": email,
-            "data": data,
-            "current_step": 1,
-            "verified": False,
-            "created_at": now()
-        }
-        
-        # Store in cache for 24 hours (86400 seconds)
-        frappe.cache().set_value(session_key, json.dumps(session_data), expires_in_sec=86400)
+        # Signed token carrying the Step 1 data encrypted; saved to the application once verified
+        application_id = frappe.db.get_value("Onboarding Form", {"email": email}, "name", order_by="creation desc")
+        step_data = {field: data[field] for field in STEP_FIELDS[1] if data.get(field)}
+        verification_token = make_token("verify", email, application_id, step_data, expires_in=VERIFY_TOKEN_TTL)
         
         # Create verification URL
         site_url = frappe.utils.get_url()
@@ -67,33 +72,20 @@ def verify_email(token):
         if not token:
             return {"success": False, "message": "Verification token is required"}
             
-        session_key = f"climoro_onboarding_{token}"
-        session_data_str = frappe.cache().get_value(session_key)
-        
-        if not session_data_str:
+        try:
+            claims = read_token(token, "verify", check_revoked=True)
+        except InvalidTokenError:
             return {"success": False, "message": "Invalid or expired verification token"}
-            
-        session_data = json.loads(session_data_str)
-        email = session_data.get("email")
-        
-        if not email:
-            return {"success": False, "message": "Email not found in session data"}
         
-        # Mark as verified in session
-        session_data["verified"] = True
-        session_data["verified_at"] = now()
-        
-        # Update cache with verified status
-        frappe.cache().set_value(session_key, json.dumps(session_data), expires_in_sec=86400)
+        email = claims.email
+        session_data = get_verified_session_data(claims, data=claims.data)
         
         # Save/update the doctype with verified email data
-        application_id = save_verified_email_to_doctype(email, session_data)
-        
-        # Update session data with the application ID if we got one
+        application_id = save_verified_email_to_doctype(email, session_data, claims.application_id)
         if application_id:
-            session_data["application_id"] = application_id
-            # Update cache with application ID
-            frappe.cache().set_value(session_key, json.dumps(session_data), expires_in_sec=86400)
+            session_data = get_verified_session_data(claims, application_id)
+            # Verification links are single use
+            revoke_token(claims)
         
         return {
             "success": True,
@@ -111,16 +103,19 @@ def verify_email(token):
         }
 
 
-def save_verified_email_to_doctype(email, session_data):
+def save_verified_email_to_doctype(email, session_data, application_id=None):
     """Save or update doctype with verified email data"""
     try:
         # Check if application already exists for this email
-        existing_applications = frappe.get_all(
-            "Onboarding Form",
-            filters={"email": email},
-            fields=["name", "status"],
-            limit=1
-        )
+        if application_id and frappe.db.exists("Onboarding Form", {"name": application_id, "email": email}):
+            existing_applications = [{"name": application_id}]
+        else:
+            existing_applications = frappe.get_all(
+                "Onboarding Form",
+                filters={"email": email},
+                fields=["name", "status"],
+                limit=1
+            )
         
         if existing_applications:
             # Update existing application
@@ -147,6 +142,7 @@ def save_verified_email_to_doctype(email, session_data):
             
             frappe.db.set_value("Onboarding Form", doc_name, updates)
             frappe.db.commit()
+            clear_draft_snapshot(doc_name)
             
             return doc_name
         else:
@@ -191,6 +187,7 @@ def save_verified_email_to_doctype(email, session_data):
 
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("send_resume_email", email_argument())
 def send_resume_email(email):
     """Send resume email to user with unique token"""
     try:
@@ -225,26 +222,13 @@ def send_resume_email(email):
         
         application = existing_applications[0]
         
-        # Generate unique resume token
-        resume_token = str(uuid.uuid4())
+        # Signed token carrying the application; verified without any stored state
+        resume_token = make_token("resume", email, application.name, expires_in=RESUME_TOKEN_TTL)
         
         # Create resume URL
         site_url = get_url()
         resume_url = f"{site_url}/apply?resume={resume_token}"
         
-        # Store session data in cache for 24 hours
-        session_data = {
-            "email": email,
-            "application_id": application.name,
-            "current_step": application.current_step or 1,
-            "company_name": application.company_name,
-            "created_at": now_datetime().isoformat(),
-            "expires_at": (now_datetime() + timedelta(hours=24)).isoformat()
-        }
-        
-        session_key = f"climoro_resume_{resume_token}"
-        frappe.cache().set_value(session_key, json.dumps(session_data), expires_in_sec=86400)  # 24 hours
-        
         # Send resume email
         send_resume_email_to_user(email, application.company_name, resume_url)
         
@@ -268,17 +252,17 @@ def get_session_data(token):
         if not token:
             return {"success": False, "message": "Verification token is required"}
             
-        session_key = f"climoro_onboarding_{token}"
-        session_data_str = frappe.cache().get_value(session_key)
-        
-        if not session_data_str:
+        try:
+            claims = read_token(token, "verify")
+        except InvalidTokenError:
             return {"success": False, "message": "Invalid or expired verification token"}
-            
-        session_data = json.loads(session_data_str)
         
-        if not session_data.get("verified"):
+        application_id = frappe.db.get_value("Onboarding Form", {"email": claims.email, "email_verified": 1}, "name")
+        if not application_id:
             return {"success": False, "message": "Email not verified", "requires_verification": True}
         
+        session_data = get_verified_session_data(claims, application_id)
+        
         return {
             "success": True,
             "session_data": session_data
@@ -343,103 +327,41 @@ def test_email_verification_flow():
         return {"success": False, "message": f"Test failed: {str(e)}"}
 
 
-def send_verification_email_to_user(email, company_name, verification_url):
-    """Send verification email to the applicant"""
-    subject = f"Verify Your Email - Climoro Onboarding Form"
-    
-    message = f"""
-    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-        <h2 style="color: #5e64ff;">Email Verification Required</h2>
-        
-        <p>Dear Applicant,</p>
-        
-        <p>Thank you for starting your Climoro onboarding process for <strong>{company_name or 'your company'}</strong>.</p>
-        
-        <p>To continue with your onboarding, please verify your email address by clicking the button below:</p>
-        
-        <div style="text-align: center; margin: 30px 0;">
-            <a href="{verification_url}" 
-               style="background-color: #5e64ff; color: white; padding: 15px 30px; text-decoration: none; border-radius: 5px; font-weight: bold; display: inline-block;">
-                Verify Email & Continue Onboarding
-            </a>
-        </div>
-        
-        <p style="color: #6c757d; font-size: 14px;">If the button doesn't work, copy and paste this link in your browser:</p>
-        <p style="color: #5e64ff; word-break: break-all; font-size: 14px;">{verification_url}</p>
-        
-        <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0;">
-            <h4 style="margin-top: 0; color: #495057;">What happens next?</h4>
-            <ul style="color: #6c757d; margin-bottom: 0;">
-                <li>Click the verification link</li>
-                <li>You'll be taken to Step 2: Company Details</li>
-                <li>Complete the remaining sections</li>
-                <li>Submit your complete onboarding form</li>
-            </ul>
-        </div>
-        
-        <p style="color: #dc3545; font-size: 14px;"><strong>Note:</strong> This verification link will expire in 24 hours.</p>
-        
-        <p>Best regards,<br>
-        <strong>Climoro Team</strong></p>
-    </div>
+def get_verified_session_data(claims, application_id=None, data=None):
+    """Session data returned to the wizard for a verified verification token.
+    The Step 1 data is `data` when given, else read from the application.
     """
-    
-    frappe.sendmail(
-        recipients=[email],
-        subject=subject,
-        message=message,
-        now=True
+    application_id = application_id or claims.application_id
+    # The wizard's step saves must carry the draft version they started from
+    snapshot = get_draft_snapshot(application_id, [1]) if application_id else None
+    if data is None:
+        data = {field: snapshot[field] for field in STEP_FIELDS[1] if snapshot and snapshot.get(field)}
+    return {
+        "email": claims.email,
+        "data": data,
+        "current_step": 1,
+        "verified": True,
+        "application_id": application_id,
+        "draft_version": snapshot.draft_version if snapshot else None,
+        "expires_at": datetime.fromtimestamp(claims.expires_at).isoformat(),
+    }
+
+
+def send_verification_email_to_user(email, company_name, verification_url):
+    """Queue the verification email to the applicant"""
+    queue_email(
+        [email],
+        "Verify Your Email - Climoro Onboarding Form",
+        "onboarding_verification",
+        {"company_name": company_name, "verification_url": verification_url},
     )
 
 
 def send_resume_email_to_user(email, company_name, resume_url):
-    """Send resume email with custom climoro template"""
-    subject = "Resume Your Climoro Onboarding Application"
-    message = f"""
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-            <div style="text-align: center; margin-bottom: 30px;">
-                <img src="/assets/climoro_onboarding/images/climoro.png" alt="Climoro Logo" style="max-width: 200px; height: auto;">
-            </div>
-            
-            <div style="background: #f8f9fa; padding: 20px; border-radius: 8px; margin-bottom: 20px;">
-                <h2 style="color: #2c3e50; margin-top: 0;">Resume Your Onboarding Application</h2>
-                <p style="color: #555; line-height: 1.6;">
-                    Dear {company_name or 'Valued Customer'},
-                </p>
-                <p style="color: #555; line-height: 1.6;">
-                    We noticed you started your Climoro onboarding application but didn't complete it. 
-                    You can resume your application from where you left off by clicking the button below.
-                </p>
-                <p style="color: #555; line-height: 1.6;">
-                    <strong>Important:</strong> This link will expire in 24 hours for security reasons.
-                </p>
-            </div>
-            
-            <div style="text-align: center; margin: 30px 0;">
-                <a href='{resume_url}' style="background: #28a745; color: white; padding: 15px 30px; border-radius: 5px; text-decoration: none; font-weight: bold; display: inline-block;">
-                    🔄 Resume Application
-                </a>
-            </div>
-            
-            <div style="background: #e9ecef; padding: 15px; border-radius: 5px; margin-top: 20px;">
-                <p style="color: #6c757d; margin: 0; font-size: 14px;">
-                    <strong>Need help?</strong> If you have any questions about your onboarding process, 
-                    please don't hesitate to contact our support team.
-                </p>
-            </div>
-            
-            <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #dee2e6; text-align: center;">
-                <p style="color: #6c757d; font-size: 12px; margin: 0;">
-                    Best regards,<br>
-                    The Climoro Team
-                </p>
-            </div>
-        </div>
-    """
-    
-    frappe.sendmail(
-        recipients=[email], 
-        subject=subject, 
-        message=message, 
-        now=True
-    ) 
\ No newline at end of file
+    """Queue the resume email with the climoro template"""
+    queue_email(
+        [email],
+        "Resume Your Climoro Onboarding Application",
+        "onboarding_resume",
+        {"company_name": company_name, "resume_url": resume_url},
+    )
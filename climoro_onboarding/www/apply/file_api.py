@@ -2,8 +2,11 @@ import frappe
 from frappe import _
 import os
 
+from climoro_onboarding.climoro_onboarding.onboarding_rate_limit import rate_limited
+
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("upload_file")
 def upload_file():
     """Handle file uploads for onboarding form documents"""
     try:
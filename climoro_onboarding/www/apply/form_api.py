@@ -3,8 +3,18 @@ from frappe import _
 from frappe.utils import now_datetime
 import json
 
+from climoro_onboarding.climoro_onboarding.onboarding_drafts import (
+    STEP_FIELDS,
+    DraftConflictError,
+    get_draft_snapshot,
+    save_step,
+)
+from climoro_onboarding.climoro_onboarding import onboarding_draft_buffer
+from climoro_onboarding.climoro_onboarding.onboarding_rate_limit import email_from_json, rate_limited
+
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("submit_onboarding_form", email_from_json("form_data"))
 def submit_onboarding_form(form_data):
     """Submit the complete onboarding form"""
     try:
@@ -37,6 +47,8 @@ def submit_onboarding_form(form_data):
             existing_app = existing_applications[0]
             doc_name = existing_app["name"]
             
+            # Persist buffered autosaves first so the submission starts from them
+            onboarding_draft_buffer.flush_draft(doc_name)
             doc = frappe.get_doc("Onboarding Form", doc_name)
             
             # Update all form fields
@@ -107,7 +119,7 @@ def get_existing_application(email):
         if applications:
             return {
                 "success": True,
-                "application": applications[0]
+                "application": onboarding_draft_buffer.apply_buffered_draft(applications[0].name, applications[0])
             }
         else:
             return {
@@ -124,6 +136,7 @@ def get_existing_application(email):
 
 
 @frappe.whitelist(allow_guest=True)
+@rate_limited("save_step_data", email_from_json("step_data"))
 def save_step_data(step_data):
     """Save step data for onboarding form (step-by-step save)"""
     import json
@@ -158,7 +171,7 @@ def save_step_data(step_data):
         application = frappe.get_all(
             "Onboarding Form",
             filters={"email": email},
-            fields=["name", "status", "current_step"],
+            fields=["name", "status", "current_step", "draft_version"],
             order_by="creation desc",
             limit=1
         )
@@ -169,20 +182,41 @@ def save_step_data(step_data):
             }
         doc_name = application[0]["name"]
 
-        # Update the existing document
-        doc = frappe.get_doc("Onboarding Form", doc_name)
-        
-        # Update fields based on step number
-        update_step_fields(doc, step_data, step_number)
+        # Keep draft steps in the buffer, or write only the changed fields of this step
+        try:
+            if step_data.get("draft_version") in (None, ""):
+                # A client that never loaded the draft could overwrite another tab's saves
+                buffered = onboarding_draft_buffer.get_buffered_draft(doc_name)
+                raise DraftConflictError(buffered.draft_version if buffered else application[0]["draft_version"])
+            result = None
+            if application[0]["status"] != "Approved" and onboarding_draft_buffer.is_enabled():
+                result = onboarding_draft_buffer.buffer_step(
+                    doc_name, step_number, step_data, step_data.get("draft_version"), application[0]["draft_version"]
+                )
+            if result is None:
+                result = save_step(doc_name, step_number, step_data, step_data.get("draft_version"))
+        except DraftConflictError as e:
+            frappe.db.rollback()
+            return {
+                "success": False,
+                "conflict": True,
+                "message": str(e),
+                "draft_version": e.draft_version
+            }
         
-        # Save the document
-        doc.save(ignore_permissions=True)
+        if result is None:
+            # Approved applications go through the full document save and its hooks
+            doc = frappe.get_doc("Onboarding Form", doc_name)
+            update_step_fields(doc, step_data, step_number)
+            doc.save(ignore_permissions=True)
+            result = frappe._dict(current_step=doc.current_step, draft_version=doc.draft_version)
         frappe.db.commit()
         
         return {
             "success": True,
             "message": f"Step {step_number} data saved successfully",
-            "current_step": doc.current_step
+            "current_step": result.current_step,
+            "draft_version": result.draft_version
         }
     except Exception as e:
         frappe.log_error(f"Error saving step data: {str(e)}")
@@ -193,8 +227,13 @@ def save_step_data(step_data):
 
 
 @frappe.whitelist(allow_guest=True)
-def get_saved_data():
-    """Get saved form data for the current session"""
+@rate_limited("get_saved_data")
+def get_saved_data(steps=None):
+    """Get the saved draft of the current session, limited to the given steps
+    (a JSON list or comma separated step numbers; all steps by default).
+
+    Answers 304 when the client's If-None-Match matches the draft's version.
+    """
     try:
         # Get session data
         session_data = frappe.get_session()
@@ -212,25 +251,25 @@ def get_saved_data():
                 "message": "No email found in session"
             }
         
-        # Get all application fields in a single query
         applications = frappe.get_all(
             "Onboarding Form",
             filters={"email": email},
-            fields=["*"],
+            pluck="name",
             order_by="creation desc",
             limit=1
         )
-        
-        if applications:
-            return {
-                "success": True,
-                "data": applications[0]
-            }
-        else:
+        snapshot = get_draft_snapshot(applications[0], parse_steps(steps)) if applications else None
+        if not snapshot:
             return {
                 "success": True,
                 "data": None
             }
+        if not_modified(snapshot):
+            return None
+        return {
+            "success": True,
+            "data": snapshot
+        }
             
     except Exception as e:
         frappe.log_error(f"Error getting saved data: {str(e)}")
@@ -240,6 +279,28 @@ def get_saved_data():
         }
 
 
+def parse_steps(steps):
+    """Step numbers from a JSON list or a comma separated string"""
+    if not steps:
+        return None
+    if isinstance(steps, str):
+        steps = json.loads(steps) if steps.startswith("[") else steps.split(",")
+    return [int(step) for step in steps]
+
+
+def not_modified(snapshot):
+    """Send the snapshot's ETag; True (with a 304 status) when the client already has it"""
+    response_headers = getattr(frappe.local, "response_headers", None)
+    if response_headers is not None:
+        response_headers.set("ETag", snapshot["etag"])
+        response_headers.set("Cache-Control", "private, no-cache")
+
+    if frappe.get_request_header("If-None-Match") == snapshot["etag"]:
+        frappe.local.response.http_status_code = 304
+        return True
+    return False
+
+
 def update_form_fields(doc, form_data):
     """Update form fields with data from frontend"""
     # Basic fields
@@ -280,126 +341,18 @@ def update_form_fields(doc, form_data):
 
 def update_step_fields(doc, step_data, step_number):
     """Update fields based on step number"""
-    if step_number == 1:
-        # Step 1: Contact Details
-        basic_fields = ["first_name", "middle_name", "last_name", "phone_number", "email", "position"]
-        for field in basic_fields:
-            if field in step_data:
-                setattr(doc, field, step_data[field])
-        doc.current_step = 1
-        
-    elif step_number == 2:
-        # Step 2: Company Details
-        company_fields = ["company_name", "address", "gps_coordinates", "location_name", "cin", 
-                         "gst_number", "industry_type", "sub_industry_type", "website", "letter_of_authorisation"]
-        for field in company_fields:
-            if field in step_data:
-                setattr(doc, field, step_data[field])
-        doc.current_step = 2
-        
-    elif step_number == 3:
-        # Step 3: GHG Accounting
-        ghg_fields = [
-            # Basic GHG fields
-            "purpose_of_reporting", "gases_to_report_co2", "gases_to_report_ch4",
-            "gases_to_report_n2o", "gases_to_report_hfcs", "gases_to_report_pfcs",
-            "gases_to_report_sf6", "gases_to_report_nf3", "scopes_to_report_scope1",
-            "scopes_to_report_scope2", "scopes_to_report_scope3", "scopes_to_report_reductions",
-            
-            # Scope 1 Options
-            "scope_1_options_process", "scope_1_options_stationary", "scope_1_options_mobile", "scope_1_options_fugitive",
-            
-            # Scope 2 Options
-            "scope_2_options_electricity",
-            
-            # Scope 3 Options
-            "scope_3_options_upstream", "scope_3_options_downstream",
-            
-            # Reduction Options
-            "reduction_options_energy_efficiency", "reduction_options_renewable_energy", "reduction_options_process_optimization",
-            "reduction_options_waste_management", "reduction_options_transportation", "reduction_options_other"
-        ]
-        for field in ghg_fields:
-            if field in step_data:
-                setattr(doc, field, step_data[field])
-        doc.current_step = 3
-        
-    elif step_number == 4:
-        # Step 4: Reduction Form - Section A: Emissions Inventory Setup
-        step5_fields = [
-            # Section A: Emissions Inventory Setup
-            "base_year", "base_year_reason", 
-            "scopes_covered_scope1", "scopes_covered_scope2", "scopes_covered_scope3",
-            "ghg_boundary_approach_operational_control", "ghg_boundary_approach_financial_control", "ghg_boundary_approach_equity_share",
-            "scope_3_categories_purchased_goods", "scope_3_categories_capital_goods", "scope_3_categories_fuel_energy",
-            "scope_3_categories_transportation", "scope_3_categories_waste", "scope_3_categories_business_travel",
-            "scope_3_categories_use_sold_products", "scope_3_categories_end_life_treatment", "scope_3_categories_leased_assets",
-            "emissions_exclusions",
-            
-            # Section B: Emissions Reduction Targets
-            "target_type", "scope_1_2_intensity_percentage", "scope_1_2_target_year",
-            "scope_3_intensity_percentage", "scope_3_target_year", "absolute_emissions_percentage",
-            "near_term_target_year", "long_term_target_year",
-            
-            # Target Metrics
-            "target_metrics_absolute_emissions", "target_metrics_kgco2e_mwh", "target_metrics_kgco2e_tonne",
-            "target_metrics_kgco2e_unit_service", "target_metrics_kgco2e_usd_revenue", "target_metrics_kgco2e_stove_year",
-            "target_metrics_kgco2e_tonne_biochar", "target_metrics_kgco2e_km_travelled",
-            
-            # Target Boundary
-            "target_boundary_scope1_2_95_percent", "target_boundary_scope3_90_percent_long_term",
-            "target_boundary_scope3_67_percent_near_term", "target_boundary_prioritize_relevance",
-            
-            # Operational Emissions Reduction Strategies
-            "operational_emissions_energy_efficiency", "operational_emissions_onsite_renewable",
-            "operational_emissions_offsite_renewable", "operational_emissions_fuel_switching",
-            "operational_emissions_process_optimization",
-            
-            # Value Chain Emissions Reduction Strategies
-            "value_chain_emissions_supplier_engagement", "value_chain_emissions_low_carbon_materials",
-            "value_chain_emissions_redesign_use_phase", "value_chain_emissions_optimize_logistics",
-            "value_chain_emissions_circular_economy",
-            
-            # Land Sector Removals
-            "land_sector_removals_afforestation", "land_sector_removals_soil_carbon",
-            "land_sector_removals_urban_greening", "land_sector_removals_biochar",
-            "land_sector_removals_carbon_capture", "land_sector_removals_certified_removals",
-            
-            # Residual Emissions
-            "residual_emissions_high_quality_credits", "residual_emissions_bvcm",
-            "residual_emissions_temporary_solutions",
-            
-            # Monitoring and Assurance
-            "monitoring_frequency", "monitoring_frequency_other_text", "assurance_validation",
-            "ghg_tracking_tools_excel", "ghg_tracking_tools_software", "ghg_tracking_tools_software_name",
-            "ghg_tracking_tools_web_platform", "recalculation_policy_structural", "recalculation_policy_methodology",
-            "recalculation_policy_boundary", "progress_communication_esg_dashboard", "progress_communication_sustainability_report",
-            "progress_communication_cdp_disclosure", "progress_communication_sbti_registry"
-        ]
-        for field in step5_fields:
-            if field in step_data:
-                setattr(doc, field, step_data[field])
-        doc.current_step = 4
-        
-    elif step_number == 5:
-        # Step 5: Method of Calculation
-        calc_fields = [
-            "method_of_calculation_option_a", "method_of_calculation_option_b",
-            "method_of_calculation_option_c", "method_of_calculation_option_d",
-            "method_of_calculation_option_e", "method_of_calculation_option_f",
-            "method_of_calculation_option_g"
-        ]
-        for field in calc_fields:
-            if field in step_data:
-                setattr(doc, field, step_data[field])
-        doc.current_step = 5
-
-    elif step_number == 6:
+    if step_number == 6:
         # Step 6: Units & Users
         doc.units = []
         doc.assigned_users = []
         add_units_and_users(doc, step_data)
-        doc.current_step = 6
+    elif step_number in STEP_FIELDS:
+        for field in STEP_FIELDS[step_number]:
+            if field in step_data:
+                setattr(doc, field, step_data[field])
+    else:
+        return
+    doc.current_step = step_number
 
 
 def add_units_and_users(doc, data):
@@ -433,23 +386,9 @@ def add_units_and_users(doc, data):
 def send_admin_notification(doc):
     """Send notification to admin about new application"""
     try:
-        admin_email = frappe.db.get_single_value("System Settings", "support_email") or "admin@example.com"
-        
-        frappe.sendmail(
-            recipients=[admin_email],
-            subject=f"New Onboarding Application - {doc.first_name}",
-            message=f"""
-            <h3>New Onboarding Application Received</h3>
-            <p><strong>Applicant:</strong> {doc.first_name} {doc.last_name or ''}</p>
-            <p><strong>Email:</strong> {doc.email}</p>
-            <p><strong>Company:</strong> {doc.company_name}</p>
-            <p><strong>Phone:</strong> {doc.phone_number}</p>
-            <p><strong>Submitted:</strong> {doc.submitted_at}</p>
-            <br>
-            <p>Please review the application in the Frappe system.</p>
-            """,
-            now=True
-        )
+        # Queued, and batched into a digest when several applications arrive together
+        from climoro_onboarding.climoro_onboarding.onboarding_emails import queue_admin_notification
+        queue_admin_notification(doc)
         
     except Exception as e:
-        frappe.log_error(f"Error sending admin notification: {str(e)}", "Admin Notification Error") 
\ No newline at end of file
+        frappe.log_error(f"Error sending admin notification: {str(e)}", "Admin Notification Error")
@@ -2,6 +2,14 @@ import frappe
 from frappe import _
 from frappe.utils import now_datetime
 import json
+from datetime import datetime
+
+from climoro_onboarding.climoro_onboarding.onboarding_drafts import get_draft_snapshot
+from climoro_onboarding.climoro_onboarding.onboarding_tokens import (
+    ExpiredTokenError,
+    InvalidTokenError,
+    read_token,
+)
 
 
 @frappe.whitelist(allow_guest=True)
@@ -14,55 +22,38 @@ def verify_resume_token(token):
                 "message": "Resume token is required"
             }
         
-        session_key = f"climoro_resume_{token}"
-        session_data_str = frappe.cache().get_value(session_key)
-        
-        if not session_data_str:
+        try:
+            claims = read_token(token, "resume")
+        except ExpiredTokenError:
+            return {
+                "success": False,
+                "message": "Resume token has expired. Please request a new one."
+            }
+        except InvalidTokenError:
             return {
                 "success": False,
                 "message": "Invalid or expired resume token"
             }
         
-        session_data = json.loads(session_data_str)
-        
-        # Check if token has expired
-        expires_at = session_data.get("expires_at")
-        if expires_at:
-            from frappe.utils import get_datetime
-            if get_datetime(expires_at) < now_datetime():
-                frappe.cache().delete_value(session_key)
-                return {
-                    "success": False,
-                    "message": "Resume token has expired. Please request a new one."
-                }
+        session_data = {
+            "email": claims.email,
+            "application_id": claims.application_id,
+            "current_step": 1,
+            "expires_at": datetime.fromtimestamp(claims.expires_at).isoformat()
+        }
         
-        # Get the latest application data
+        # The draft snapshot: a cache hit unless the draft changed since it was last read
+        application_id = session_data.get("application_id")
         email = session_data.get("email")
-        if email:
-            applications = frappe.get_all(
-                "Onboarding Form",
-                filters={"email": email, "status": "Draft"},
-                fields=["name", "current_step"],
-                order_by="modified desc",
-                limit=1
+        if not application_id and email:
+            application_id = frappe.db.get_value(
+                "Onboarding Form", {"email": email, "status": "Draft"}, "name", order_by="modified desc"
             )
-            
-            if applications:
-                doc = frappe.get_doc("Onboarding Form", applications[0].name)
-                # Convert doc to dict and handle datetime serialization
-                doc_dict = doc.as_dict()
-                
-                # Convert datetime objects to strings recursively
-                doc_dict = convert_datetime_to_string(doc_dict)
-                session_data["application_data"] = doc_dict
-                session_data["current_step"] = doc.current_step or 1
-                
-                # Refresh the cache with updated data
-                try:
-                    session_data_serializable = convert_datetime_to_string(session_data)
-                    frappe.cache().set_value(session_key, json.dumps(session_data_serializable), expires_in_sec=86400)
-                except Exception as cache_error:
-                    frappe.log_error(f"Cache refresh error: {str(cache_error)}")
+        snapshot = get_draft_snapshot(application_id) if application_id else None
+        if snapshot and snapshot.status == "Draft":
+            session_data["application_data"] = snapshot
+            session_data["company_name"] = snapshot.company_name
+            session_data["current_step"] = snapshot.current_step or 1
         
         return {
             "success": True,
@@ -113,40 +104,28 @@ def debug_resume_token(token):
                 "message": "Token is required"
             }
         
-        session_key = f"climoro_resume_{token}"
-        
-        # Check if token exists in cache
-        session_data_str = frappe.cache().get_value(session_key)
-        
-        debug_info = {
-            "token": token,
-            "session_key": session_key,
-            "cache_exists": session_data_str is not None,
-            "cache_data": session_data_str
-        }
-        
-        if session_data_str:
-            try:
-                session_data = json.loads(session_data_str)
-                debug_info["parsed_data"] = session_data
-                debug_info["email"] = session_data.get("email")
-                debug_info["current_step"] = session_data.get("current_step")
-                debug_info["expires_at"] = session_data.get("expires_at")
-                
-                # Check if application exists in database
-                if session_data.get("email"):
-                    applications = frappe.get_all(
-                        "Onboarding Form",
-                        filters={"email": session_data["email"], "status": "Draft"},
-                        fields=["name", "current_step", "company_name"],
-                        order_by="modified desc",
-                        limit=1
-                    )
-                    debug_info["database_applications"] = applications
-                    debug_info["application_count"] = len(applications)
-                
-            except json.JSONDecodeError as e:
-                debug_info["json_error"] = str(e)
+        debug_info = {"token": token}
+        try:
+            claims = read_token(token, "resume")
+            debug_info["valid"] = True
+            debug_info["claims"] = claims
+            debug_info["email"] = claims.email
+            debug_info["application_id"] = claims.application_id
+            debug_info["expires_at"] = datetime.fromtimestamp(claims.expires_at).isoformat()
+            
+            # Check if application exists in database
+            applications = frappe.get_all(
+                "Onboarding Form",
+                filters={"email": claims.email, "status": "Draft"},
+                fields=["name", "current_step", "company_name"],
+                order_by="modified desc",
+                limit=1
+            )
+            debug_info["database_applications"] = applications
+            debug_info["application_count"] = len(applications)
+        except InvalidTokenError as e:
+            debug_info["valid"] = False
+            debug_info["error"] = str(e)
         
         return {
             "success": True,
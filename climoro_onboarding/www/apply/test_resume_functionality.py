@@ -5,9 +5,6 @@ Test script for Climoro Onboarding Resume Functionality
 
 import frappe
 import json
-import uuid
-from frappe.utils import now_datetime
-from datetime import timedelta
 
 def test_resume_functionality():
     """Test the resume functionality"""
@@ -47,17 +44,8 @@ def test_resume_functionality():
     print("\n2. Testing verify_resume_token function...")
     try:
         # Create a test token
-        test_token = str(uuid.uuid4())
-        session_data = {
-            "email": test_email,
-            "current_step": 2,
-            "company_name": "Test Company",
-            "created_at": now_datetime().isoformat(),
-            "expires_at": (now_datetime() + timedelta(hours=24)).isoformat()
-        }
-        
-        session_key = f"climoro_resume_{test_token}"
-        frappe.cache().set_value(session_key, json.dumps(session_data), expires_in_sec=86400)
+        from climoro_onboarding.climoro_onboarding.onboarding_tokens import make_token
+        test_token = make_token("resume", test_email, doc.name)
         
         from climoro_onboarding.www.apply.api import verify_resume_token
         result = verify_resume_token(test_token)